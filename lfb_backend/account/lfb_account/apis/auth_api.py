@@ -1,58 +1,58 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, login, logout
 from django.core.exceptions import ImproperlyConfigured
 from django.views import View
 
-from core.mixins.response import ResponseMixin
-from core.utils import Validators
+from core.mixins.response import AsyncResponseMixin
+from core.schemas import Arg, RequestSchema
 
+LOGIN_SCHEMA = RequestSchema(
+    Arg('username', valid_type=str, null=False),
+    Arg('password', valid_type=str, null=False))
 
-class Login(ResponseMixin, View):
 
-    def post(self, request):
+class Login(AsyncResponseMixin, View):
 
-        args = request.POST.copy()
+    async def post(self, request):
+
+        args = request.POST
 
         if args:
-            validator = Validators(request_body=args)
-            username = validator.args_validator(
-                arg_key='username',
-                valid_type=str,
-                null=False)
-            password = validator.args_validator(
-                arg_key='password',
-                valid_type=str,
-                null=False)
-
-            is_valid_request, validation_msg = validator.is_valid_request()
-            if is_valid_request:
+            validation = LOGIN_SCHEMA.validate(args)
+            if validation.is_valid:
+                username = validation['username']
+                password = validation['password']
                 user = None
                 try:
-                    user = authenticate(request,
-                                        username=username,
-                                        password=password)
+                    user = await sync_to_async(authenticate)(
+                        request, username=username, password=password)
                 except ImproperlyConfigured:
                     pass
 
                 if user is not None:
-                    request.session['username'] = username
-                    request.session.set_expiry(1200)
-                    login(request, user)
+                    await sync_to_async(self.login)(request, user, username)
                 else:
                     self.success = False
                     self.status = '10003'
             else:
                 self.success = False
                 self.status = '10002'
-                self.msg = validation_msg
+                self.msg = validation.msg
         else:
             self.success = False
             self.status = '10001'
 
         return self.get_json_response()
 
+    @staticmethod
+    def login(request, user, username):
+        request.session['username'] = username
+        request.session.set_expiry(1200)
+        login(request, user)
+
 
-class Logout(ResponseMixin, View):
+class Logout(AsyncResponseMixin, View):
 
-    def post(self, request):
-        logout(request)
+    async def post(self, request):
+        await sync_to_async(logout)(request)
         return self.get_json_response()
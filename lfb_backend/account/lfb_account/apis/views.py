@@ -1,15 +1,21 @@
 from django.views import View
 
-from core.mixins.response import ResponseMixin
+from core.cache import TwoTierCache
+from core.mixins.response import AsyncResponseMixin
 
 from ..models import User
 
+USER_CACHE = TwoTierCache('user')
 
-class UserDetail(ResponseMixin, View):
 
-    def post(self, request):
+class UserDetail(AsyncResponseMixin, View):
+
+    async def post(self, request):
 
         username = request.user.username
-        user = User.object_list.get_by_field(username=username)
+        user = await USER_CACHE.aget_or_set(
+            f'detail:{username}',
+            lambda: User.object_list.get_by_field({'username': username}),
+            tags=[f'user:{username}', f'user_id:{request.user.pk}'])
 
         return self.get_json_response(user)
@@ -2,4 +2,12 @@ from django.apps import AppConfig
 
 
 class LfbAccountConfig(AppConfig):
-    name = 'lfb_account'
+    name = 'account.lfb_account'
+
+    def ready(self):
+        from core import search
+
+        from . import signals  # noqa: F401
+        from .models import User
+
+        search.register(User, 'username')
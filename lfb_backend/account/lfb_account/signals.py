@@ -0,0 +1,29 @@
+"""用户信息变更时失效用户详情缓存
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.querysets import bulk_updated
+
+from .apis.views import USER_CACHE
+from .models import User
+
+
+def user_tags(user):
+    # NOTE: 同时按id失效, 用户名修改后旧用户名下的缓存也会失效
+    return (f'user:{user.username}', f'user_id:{user.pk}')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    USER_CACHE.invalidate_tags(*user_tags(instance))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    USER_CACHE.invalidate_tags(*user_tags(instance))
+
+
+@receiver(bulk_updated, sender=User)
+def users_bulk_updated(sender, ids, fields, **kwargs):
+    USER_CACHE.invalidate_tags(*(f'user_id:{pk}' for pk in ids))
@@ -1,8 +1,153 @@
-from django.test import TestCase
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.test import (AsyncClient, Client, SimpleTestCase, TestCase,
+                         TransactionTestCase)
+
+from core.async_utils import AsyncRedisUtil
+from core.cache import TwoTierCache
+from core.querysets import bulk_updated
+from core.sessions import SESSION_CACHE
+from core.tests import FakeRedisMixin, benchmark, report
+
+from .apis.views import USER_CACHE
+from .models import User
 
 # Create your tests here.
 
 
+class UserCacheInvalidationTest(SimpleTestCase):
+    """用户修改/删除后失效用户详情缓存
+    """
+
+    def setUp(self):
+        patcher = mock.patch.object(USER_CACHE, 'invalidate_tags')
+        self.invalidate_tags = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User(pk=1, username='admin')
+
+    def test_saved(self):
+        post_save.send(sender=User, instance=self.user, created=False,
+                       using='default')
+
+        self.invalidate_tags.assert_called_once_with('user:admin',
+                                                     'user_id:1')
+
+    def test_deleted(self):
+        post_delete.send(sender=User, instance=self.user, using='default')
+
+        self.invalidate_tags.assert_called_once_with('user:admin',
+                                                     'user_id:1')
+
+    def test_bulk_updated(self):
+        bulk_updated.send(sender=User, ids=[1, 2], fields={'email'})
+
+        self.invalidate_tags.assert_called_once_with('user_id:1',
+                                                     'user_id:2')
+
+
+class UserDetailLoadBenchmarkTest(FakeRedisMixin, TransactionTestCase):
+    """用户详情接口在WSGI(uwsgi线程池)与ASGI(daphne单事件循环)下的吞吐对比
+
+    关闭用户详情的进程内缓存, 每个请求都通过asyncio客户端读取redis,
+    读取时加入模拟的网络延迟.
+    """
+
+    NUMBER = 200
+    LATENCY = 0.05
+    WORKERS = 8
+    CONCURRENCY = 64
+    URL = '/api/v1/detail/user'
+
+    @classmethod
+    def setUpClass(cls):
+        # NOTE: lfb_user为非托管表, 测试库中需要手动建表
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(User)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(User)
+
+    def setUp(self):
+        super().setUp()
+        redis_get = AsyncRedisUtil.get
+
+        async def slow_get(util, key):
+            await asyncio.sleep(self.LATENCY)
+            return await redis_get(util, key)
+
+        patchers = [
+            mock.patch.object(AsyncRedisUtil, 'get', slow_get),
+            mock.patch.object(TwoTierCache, '_listener_pid', os.getpid()),
+            mock.patch.object(USER_CACHE.local, 'ttl', 0),
+        ]
+        patchers += [mock.patch.object(cache, '_redis_util', None)
+                     for cache in TwoTierCache._registry.values()]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        SESSION_CACHE.local.clear()
+        self.addCleanup(SESSION_CACHE.local.clear)
+
+        user = User(username='admin', operator='admin')
+        user.set_password('admin')
+        user.save()
+        client = Client()
+        client.post('/api/v1/login', {'username': 'admin',
+                                      'password': 'admin'})
+        self.cookies = client.cookies
+
+    def wsgi_request(self):
+        client = Client()
+        client.cookies = self.cookies
+        response = client.post(self.URL)
+        self.assertTrue(response.json()['success'])
+
+    def wsgi(self):
+        # NOTE: 对应uwsgi的processes=8, 每个请求独占一个worker直到返回
+        with ThreadPoolExecutor(self.WORKERS) as executor:
+            for _ in executor.map(lambda _: self.wsgi_request(),
+                                  range(self.NUMBER)):
+                pass
+
+    async def asgi(self):
+        client = AsyncClient()
+        client.cookies = self.cookies
+        semaphore = asyncio.Semaphore(self.CONCURRENCY)
+
+        async def request():
+            async with semaphore:
+                response = await client.post(self.URL)
+            self.assertTrue(response.json()['success'])
+
+        await asyncio.gather(*[request() for _ in range(self.NUMBER)])
+
+    @benchmark
+    def test_benchmark(self):
+        self.wsgi_request()
+
+        started = time.perf_counter()
+        self.wsgi()
+        wsgi = time.perf_counter() - started
+        started = time.perf_counter()
+        asyncio.run(self.asgi())
+        asgi = time.perf_counter() - started
+
+        report(f'用户详情接口 x{self.NUMBER}, redis延迟'
+               f'{self.LATENCY * 1000:.0f}ms',
+               wsgi=wsgi, asgi=asgi)
+        self.assertLess(asgi, wsgi)
+
+
 import re
 import itertools
 
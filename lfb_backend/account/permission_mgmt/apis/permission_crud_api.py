@@ -1,11 +1,50 @@
+from django.db import transaction
 from django.views import View
 
+from core.errors import DataError
 from core.helpers import QuerySetHelper
+from core.importers import ImportHelper
 from core.mixins.response import ResponseMixin
-from core.utils import Validators
+from core.schemas import Arg, RequestSchema
+from core.search import get_search_backend
 
+from ..matrix import PermissionMatrix
 from ..models import Role, Permission
 
+ROLE_CREATION_SCHEMA = RequestSchema(
+    Arg('roleName', valid_type=str, null=False, verbose_note='角色名称'))
+PERMISSION_UPLOAD_SCHEMA = RequestSchema(
+    Arg('name', valid_type=str, null=False, verbose_note='权限名称'),
+    Arg('interface', valid_type=str, null=False, verbose_note='接口url'),
+    Arg('desc', valid_type=str, verbose_note='描述'),
+    Arg('isPrivate', valid_type=bool, default=True, verbose_note='是否私有'))
+ROLE_PERMISSION_UPDATE_SCHEMA = RequestSchema(
+    Arg('roleId', valid_type=int, null=False, verbose_note='角色id'),
+    Arg('permissionIds', valid_type='list', null=False,
+        verbose_note='权限id列表'))
+DELETION_SCHEMA = RequestSchema(
+    Arg('ids', valid_type='list', null=False, verbose_note='id列表'))
+BATCH_ROLE_PERMISSION_UPDATE_SCHEMA = RequestSchema(
+    Arg('rolePermissions', valid_type='dict', null=False,
+        verbose_note='{角色id: 权限id列表}'))
+# NOTE: 上传文件表头, 支持参数名及中文名称
+PERMISSION_UPLOAD_COLUMNS = {
+    'name': 'name',
+    '名称': 'name',
+    'interface': 'interface',
+    '接口url': 'interface',
+    'desc': 'desc',
+    '描述': 'desc',
+    'isPrivate': 'isPrivate',
+    '是否私有': 'isPrivate',
+}
+PERMISSION_UPLOAD_MAX_LENGTHS = {
+    key: Permission._meta.get_field(key).max_length
+    for key in ('name', 'interface', 'desc')
+}
+IMPORT_STATUSES = ('created', 'skipped', 'error')
+EXISTED_MSG = ResponseMixin.STATUS_MSG['10005']
+
 
 class RoleCreation(ResponseMixin, View):
     """角色创建视图
@@ -13,35 +52,24 @@ class RoleCreation(ResponseMixin, View):
 
     def post(self, request):
 
-        args = request.POST.copy()
+        args = request.POST
 
         if args:
-            validator = Validators(request_body=args)
-            role_name = validator.args_validator(
-                arg_key='roleName',
-                valid_type=str,
-                null=False,
-                verbose_note='角色名称')
+            validation = ROLE_CREATION_SCHEMA.validate(args)
 
             username = request.user.username
-            is_valid_request, validation_msg = validator.is_valid_request()
-            if is_valid_request:
-                field_query = {
-                    'name': role_name,
-                    'is_deleted': False
-                }
-                role = (Role
-                        .object_list
-                        .create_with_field_check(field_query,
-                                                 name=role_name,
-                                                 modifier=username,
-                                                 operator=username))
+            if validation.is_valid:
+                role_name = validation['roleName']
+                role = Role.object_list.create_if_absent('name',
+                                                         name=role_name,
+                                                         modifier=username,
+                                                         operator=username)
                 if role:
                     default_per_ids = list(Permission
                                            .objects
                                            .filter(is_private=False,
                                                    is_deleted=False)
-                                           .values('id', flat=True))
+                                           .values_list('id', flat=True))
                     role.permission.add(*default_per_ids)
                     data = (QuerySetHelper
                             .querydict_to_dict(role,
@@ -52,9 +80,259 @@ class RoleCreation(ResponseMixin, View):
             else:
                 self.success = False
                 self.status = '10002'
-                self.msg = validation_msg
+                self.msg = validation.msg
+        else:
+            self.success = False
+            self.status = '10001'
+
+        return self.get_json_response()
+
+
+class PermissionUpload(ResponseMixin, View):
+    """权限批量导入视图
+
+    上传csv/xls/xlsx文件(file), 表头见PERMISSION_UPLOAD_COLUMNS,
+    返回每行的导入结果: created(已创建)/skipped(名称已存在)/error(校验失败)
+    """
+
+    def post(self, request):
+
+        upload = request.FILES.get('file')
+
+        if upload:
+            username = request.user.username
+            try:
+                with transaction.atomic():
+                    data, created, has_public = self.import_permissions(
+                        upload, username)
+            except DataError as e:
+                self.success = False
+                self.status = '10002'
+                self.msg = e.args[0]
+            else:
+                # NOTE: 批量插入不触发post_save, 需手动刷新矩阵(公共权限)和搜索索引
+                if has_public:
+                    transaction.on_commit(
+                        lambda: PermissionMatrix.get().refresh_roles([]))
+                transaction.on_commit(
+                    lambda: get_search_backend().update(Permission, created))
+
+                return self.get_json_response(data)
         else:
             self.success = False
             self.status = '10001'
 
         return self.get_json_response()
+
+    @staticmethod
+    def import_permissions(upload, username):
+        """分批校验并写入上传的权限
+
+        每批只需一次按列校验和一次insert_ignore(名称冲突的行由唯一约束忽略)
+
+        Args:
+            upload (UploadedFile): 上传文件
+            username (str): 操作用户名
+
+        Returns:
+            tuple: (导入结果, 新建的权限id, 是否创建了公共权限)
+        """
+        counts = dict.fromkeys(IMPORT_STATUSES, 0)
+        rows = []
+        created_pks = []
+        has_public = False
+
+        records = ImportHelper.iter_records(upload, PERMISSION_UPLOAD_COLUMNS)
+        for batch in ImportHelper.batched(records):
+            validation = PERMISSION_UPLOAD_SCHEMA.validate_many(
+                record for _, record in batch)
+            results = [None] * len(batch)
+            for error in validation.errors:
+                results[error['row']] = ('error', error['msg'])
+
+            indexes = []
+            permissions = []
+            for index, row in zip(validation.indexes, validation.rows):
+                msg = PermissionUpload.check_length(row)
+                if msg:
+                    results[index] = ('error', msg)
+                    continue
+                indexes.append(index)
+                permissions.append({'name': row['name'],
+                                    'interface': row['interface'],
+                                    'desc': row['desc'],
+                                    'is_private': row['isPrivate']})
+
+            pks = Permission.object_list.insert_ignore(
+                permissions, 'name', modifier=username, operator=username)
+            for index, permission, pk in zip(indexes, permissions, pks):
+                if pk is not None:
+                    created_pks.append(pk)
+                    results[index] = ('created', '')
+                    has_public = has_public or not permission['is_private']
+                else:
+                    results[index] = ('skipped', EXISTED_MSG)
+
+            for (line, _), (status, msg) in zip(batch, results):
+                counts[status] += 1
+                rows.append({'row': line, 'status': status, 'msg': msg})
+
+        data = dict(counts, rows=rows)
+
+        return data, created_pks, has_public
+
+    @staticmethod
+    def check_length(row):
+        for key, max_length in PERMISSION_UPLOAD_MAX_LENGTHS.items():
+            value = row[key]
+            if value is not None and len(value) > max_length:
+                return f'参数{key}长度超过{max_length}'
+
+        return None
+
+
+class RolePermissionSync(ResponseMixin, View):
+    """角色权限同步视图基类, 子类将请求参数转换为{角色id: 权限id列表}
+    """
+
+    def sync(self, role_permissions):
+        """校验角色/权限是否存在, 并一次性同步全部角色的权限
+
+        Args:
+            role_permissions (dict): {角色id: 权限id列表}
+
+        Returns:
+            JsonResponse: 变更集合
+        """
+        try:
+            role_permissions = Role.object_list.clean_role_permissions(
+                role_permissions)
+        except (TypeError, ValueError) as e:
+            self.success = False
+            self.status = '10002'
+            self.msg = str(e)
+            return self.get_json_response()
+
+        permission_ids = set().union(*role_permissions.values())
+        roles = Role.objects.filter(id__in=role_permissions,
+                                    is_deleted=False)
+        permissions = Permission.objects.filter(id__in=permission_ids,
+                                                is_deleted=False)
+        if (roles.count() != len(role_permissions)
+                or permissions.count() != len(permission_ids)):
+            self.success = False
+            self.status = '10006'
+            return self.get_json_response()
+
+        data = Role.object_list.sync_permissions(role_permissions)
+
+        return self.get_json_response(data)
+
+
+class RolePermissionUpdate(RolePermissionSync):
+    """单个角色权限更新视图
+    """
+
+    def post(self, request):
+
+        args = request.POST
+
+        if args:
+            validation = ROLE_PERMISSION_UPDATE_SCHEMA.validate(args)
+
+            if validation.is_valid:
+                return self.sync({
+                    validation['roleId']: validation['permissionIds']
+                })
+
+            self.success = False
+            self.status = '10002'
+            self.msg = validation.msg
+        else:
+            self.success = False
+            self.status = '10001'
+
+        return self.get_json_response()
+
+
+class BatchRolePermissionUpdate(RolePermissionSync):
+    """批量角色权限更新视图
+    """
+
+    def post(self, request):
+
+        args = request.POST
+
+        if args:
+            validation = BATCH_ROLE_PERMISSION_UPDATE_SCHEMA.validate(args)
+
+            if validation.is_valid:
+                return self.sync(validation['rolePermissions'])
+
+            self.success = False
+            self.status = '10002'
+            self.msg = validation.msg
+        else:
+            self.success = False
+            self.status = '10001'
+
+        return self.get_json_response()
+
+
+class SoftDeletion(ResponseMixin, View):
+    """批量软删除视图基类, 子类通过get_queryset指定可删除的记录
+    """
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def post(self, request):
+
+        args = request.POST
+
+        if args:
+            validation = DELETION_SCHEMA.validate(args)
+
+            if validation.is_valid:
+                try:
+                    ids = {int(pk) for pk in validation['ids']}
+                except (TypeError, ValueError):
+                    self.success = False
+                    self.status = '10002'
+                    return self.get_json_response()
+
+                queryset = self.get_queryset()
+                found = list(queryset.filter(id__in=ids)
+                             .values_list('id', flat=True,
+                                          use_fields_only=True))
+                username = request.user.username
+                queryset.update_by_ids({pk: {'is_deleted': True,
+                                             'modifier': username}
+                                        for pk in found})
+
+                return self.get_json_response({'ids': found})
+
+            self.success = False
+            self.status = '10002'
+            self.msg = validation.msg
+        else:
+            self.success = False
+            self.status = '10001'
+
+        return self.get_json_response()
+
+
+class RoleDeletion(SoftDeletion):
+    """角色批量删除视图
+    """
+
+    def get_queryset(self):
+        return Role.object_list.existed()
+
+
+class PermissionDeletion(SoftDeletion):
+    """权限批量删除视图, 不允许编辑的权限不会被删除
+    """
+
+    def get_queryset(self):
+        return Permission.object_list.existed(editable=True)
@@ -1,3 +1,114 @@
-from django.shortcuts import render
+from django.views import View
 
-# Create your views here.
+from account.lfb_account.models import User
+from core.constants import PAGE_SIZE
+from core.mixins.response import ResponseMixin
+from core.schemas import Arg, RequestSchema
+
+from ..models import Permission, Role
+
+PAGE_ARGS = (
+    Arg('cursor', valid_type=str, verbose_note='分页游标'),
+    Arg('pageSize', valid_type=int, default=PAGE_SIZE, verbose_note='每页数量'),
+    Arg('order', valid_type=int, choices=(1, -1), default=1,
+        verbose_note='1升序, -1降序'),
+    Arg('count', valid_type=str, choices=('exact', 'estimate'),
+        verbose_note='是否返回总数'))
+ROLE_LIST_SCHEMA = RequestSchema(
+    *PAGE_ARGS,
+    Arg('orderField', valid_type=str, choices=('created', 'modified', 'name'),
+        default='created', verbose_note='排序字段'))
+ROLE_USER_LIST_SCHEMA = RequestSchema(
+    *PAGE_ARGS,
+    Arg('roleId', valid_type=int, null=False, verbose_note='角色id'))
+PERMISSION_EXPORT_SCHEMA = RequestSchema(
+    Arg('fileType', valid_type=str, choices=('csv', 'xlsx'), default='csv',
+        verbose_note='导出文件类型'))
+PERMISSION_EXPORT_FIELDS = ('id', 'name', 'interface', 'desc', 'displayed',
+                            'editable', 'operator', 'created')
+
+
+class RoleList(ResponseMixin, View):
+    """角色列表视图(键集分页)
+    """
+
+    def post(self, request):
+
+        validation = ROLE_LIST_SCHEMA.validate(request.POST)
+
+        if validation.is_valid:
+            queryset = Role.object_list.existed().values()
+
+            return self.get_page_response(
+                queryset,
+                cursor=validation['cursor'],
+                order_field=validation['orderField'],
+                order=validation['order'],
+                page_size=validation['pageSize'],
+                count=validation['count'])
+
+        self.success = False
+        self.status = '10002'
+        self.msg = validation.msg
+
+        return self.get_json_response()
+
+
+class RoleUserList(ResponseMixin, View):
+    """角色用户列表视图(键集分页)
+    """
+
+    def post(self, request):
+
+        args = request.POST
+
+        if args:
+            validation = ROLE_USER_LIST_SCHEMA.validate(args)
+
+            if validation.is_valid:
+                queryset = (User.object_list
+                            .filter(role_list__id=validation['roleId'])
+                            .values(*User.DISPLAY_FIELDS))
+
+                return self.get_page_response(
+                    queryset,
+                    cursor=validation['cursor'],
+                    order=validation['order'],
+                    page_size=validation['pageSize'],
+                    count=validation['count'])
+
+            self.success = False
+            self.status = '10002'
+            self.msg = validation.msg
+        else:
+            self.success = False
+            self.status = '10001'
+
+        return self.get_json_response()
+
+
+class PermissionExport(ResponseMixin, View):
+    """权限导出视图(流式下载)
+    """
+
+    def post(self, request):
+
+        validation = PERMISSION_EXPORT_SCHEMA.validate(request.POST)
+
+        if validation.is_valid:
+            queryset = Permission.object_list.existed().order_by('id')
+            headers = [str(Permission._meta.get_field(field).verbose_name)
+                       for field in PERMISSION_EXPORT_FIELDS]
+
+            return self.get_streaming_download_response(
+                'permission',
+                queryset,
+                headers=headers,
+                fields=PERMISSION_EXPORT_FIELDS,
+                file_type=validation['fileType'])
+
+        self.success = False
+        self.status = '10002'
+        self.msg = validation.msg
+
+        return self.get_json_response()
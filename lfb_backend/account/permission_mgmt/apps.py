@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 
 class PermissionMgmtConfig(AppConfig):
-    name = 'permission_mgmt'
+    name = 'account.permission_mgmt'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,447 @@
+"""角色-接口权限矩阵
+
+每个角色允许访问的接口(Permission.interface)按路径分段编译为前缀树,
+鉴权时只需沿请求路径走一遍前缀树, 不需要查询lfb_role_permission等多张表.
+
+矩阵保存在进程内存和redis中:
+    - redis hash保存每个角色的接口列表, 所有进程共享, 进程启动时直接加载
+    - 角色权限变更时只重建受影响的角色, 写回redis后通过pub/sub通知其他进程
+    - 另有版本号兜底, 进程定期比对, 防止错过通知
+
+接口支持通配符: '*' 匹配一段路径, '**' 匹配剩余的全部路径,
+e.g. 'api/v1/list/*', 'api/v1/**'
+"""
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from redis.exceptions import RedisError
+
+from core.cache import TwoTierCache
+from core.constants import (PERMISSION_MATRIX_CHANNEL, PERMISSION_MATRIX_KEY,
+                            PERMISSION_MATRIX_SYNC_INTERVAL,
+                            PERMISSION_MATRIX_VERSION_KEY, PUBLIC_ROLE)
+from core.utils import RedisUtil
+from log.log import lx_log
+
+from .models import Permission, Role
+
+TERMINAL = None
+ANY_SEGMENT = '*'
+ANY_SUFFIX = '**'
+
+USER_ROLE_CACHE = TwoTierCache('permission')
+
+
+class InterfaceTrie:
+    """接口路径前缀树
+
+    Args:
+        interfaces (iterable, optional): 接口列表. Defaults to ().
+    """
+
+    __slots__ = ('root', 'interfaces')
+
+    def __init__(self, interfaces=()):
+        self.root = {}
+        self.interfaces = set()
+        for interface in interfaces:
+            self.add(interface)
+
+    @staticmethod
+    def split(path):
+        """规范化接口路径并分段, 忽略域名/查询参数/首尾斜杠
+
+        Args:
+            path (str): 接口url或路径
+
+        Returns:
+            list: 路径分段
+        """
+        if '://' in path or '?' in path:
+            path = urlparse(path).path
+
+        return [segment for segment in path.split('/') if segment]
+
+    def add(self, interface):
+        segments = self.split(interface)
+        if not segments:
+            return
+        self.interfaces.add('/'.join(segments))
+
+        node = self.root
+        for segment in segments:
+            if segment == ANY_SUFFIX:
+                node[ANY_SUFFIX] = True
+                return
+            node = node.setdefault(segment, {})
+        node[TERMINAL] = True
+
+    def match(self, segments):
+        """判断路径是否命中任一接口, 复杂度与路径段数成正比
+
+        Args:
+            segments (list): 已分段的请求路径
+
+        Returns:
+            bool
+        """
+        length = len(segments)
+        stack = [(self.root, 0)]
+        while stack:
+            node, index = stack.pop()
+            if ANY_SUFFIX in node:
+                return True
+            if index == length:
+                if TERMINAL in node:
+                    return True
+                continue
+            child = node.get(ANY_SEGMENT)
+            if child is not None:
+                stack.append((child, index + 1))
+            child = node.get(segments[index])
+            if child is not None:
+                stack.append((child, index + 1))
+
+        return False
+
+    def __bool__(self):
+        return bool(self.interfaces)
+
+
+class PermissionMatrix:
+    """进程级权限矩阵
+
+    Examples:
+        PermissionMatrix.get().is_allowed(role_ids, request.path_info)
+
+        # 角色权限变更后
+        PermissionMatrix.get().refresh_roles([role.id])
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, redis_util=None):
+        self._pid = os.getpid()
+        self._redis_util = redis_util
+        self._tries = {}
+        self._version = None
+        self._synced_at = 0
+        self._loaded = False
+        self._listener_pid = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def get(cls):
+        """获取本进程的权限矩阵(fork后的子进程重新创建)
+
+        Returns:
+            PermissionMatrix
+        """
+        instance = cls._instance
+        if instance is None or instance._pid != os.getpid():
+            with cls._lock:
+                instance = cls._instance
+                if instance is None or instance._pid != os.getpid():
+                    instance = cls()
+                    cls._instance = instance
+
+        return instance
+
+    @classmethod
+    def reset(cls):
+        cls._lock = threading.Lock()
+        cls._instance = None
+
+    @property
+    def redis(self):
+        if self._redis_util is None:
+            self._redis_util = RedisUtil()
+
+        return self._redis_util
+
+    def is_allowed(self, role_ids, path):
+        """判断角色集合是否允许访问路径
+
+        Args:
+            role_ids (iterable): 用户的角色id
+            path (str): 请求路径
+
+        Returns:
+            bool
+        """
+        self._ensure_fresh()
+
+        return self._match(role_ids, path)
+
+    async def ais_allowed(self, role_ids, path):
+        """is_allowed的asyncio版本, 只有需要加载/同步矩阵时才切换到线程
+        """
+        if self._needs_sync():
+            await sync_to_async(self._ensure_fresh)()
+
+        return self._match(role_ids, path)
+
+    def _match(self, role_ids, path):
+        segments = InterfaceTrie.split(path)
+        tries = self._tries
+
+        public = tries.get(PUBLIC_ROLE)
+        if public is not None and public.match(segments):
+            return True
+        for role_id in role_ids:
+            trie = tries.get(str(role_id))
+            if trie is not None and trie.match(segments):
+                return True
+
+        return False
+
+    def interfaces(self, role_id):
+        """获取角色当前允许的接口(规范化后)
+
+        Returns:
+            set
+        """
+        self._ensure_fresh()
+        trie = self._tries.get(str(role_id))
+
+        return set(trie.interfaces) if trie is not None else set()
+
+    def _needs_sync(self):
+        return (not self._loaded
+                or self._listener_pid != os.getpid()
+                or time.monotonic() - self._synced_at >=
+                PERMISSION_MATRIX_SYNC_INTERVAL)
+
+    def _ensure_fresh(self):
+        if self._listener_pid != os.getpid():
+            self._listen()
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+            return
+
+        elapsed = time.monotonic() - self._synced_at
+        if elapsed < PERMISSION_MATRIX_SYNC_INTERVAL:
+            return
+        self._synced_at = time.monotonic()
+        try:
+            version = self.redis.get(PERMISSION_MATRIX_VERSION_KEY)
+        except RedisError as e:
+            lx_log.error(f'【权限矩阵版本读取失败】{e}')
+            return
+        if version != self._version:
+            with self._lock:
+                self._load()
+
+    def _load(self):
+        """从redis加载全部角色, redis中不存在时从数据库全量构建
+        """
+        try:
+            client = self.redis.conn_client
+            pipe = client.pipeline(transaction=False)
+            pipe.get(PERMISSION_MATRIX_VERSION_KEY)
+            pipe.hgetall(PERMISSION_MATRIX_KEY)
+            version, rows = pipe.execute()
+        except RedisError as e:
+            lx_log.error(f'【权限矩阵加载失败】{e}')
+            version, rows = None, {}
+
+        if version is None:
+            self.rebuild()
+            return
+
+        self._tries = {role: InterfaceTrie(json.loads(interfaces))
+                       for role, interfaces in rows.items()}
+        self._version = version
+        self._synced_at = time.monotonic()
+        self._loaded = True
+
+    @staticmethod
+    def _query(role_ids=None):
+        """查询角色接口
+
+        Args:
+            role_ids (iterable, optional): 角色id, 为None时查询全部角色.
+                Defaults to None.
+
+        Returns:
+            dict: {角色key: [接口]}, 公共权限的角色key为PUBLIC_ROLE
+        """
+        role_interfaces = {}
+
+        rows = Role.permission.through.objects.filter(
+            role__is_deleted=False, permission__is_deleted=False)
+        if role_ids is not None:
+            rows = rows.filter(role_id__in=role_ids)
+        for role_id, interface in rows.values_list('role_id',
+                                                   'permission__interface'):
+            role_interfaces.setdefault(str(role_id), []).append(interface)
+
+        public = Permission.objects.filter(is_private=False,
+                                           is_deleted=False)
+        role_interfaces[PUBLIC_ROLE] = list(
+            public.values_list('interface', flat=True))
+
+        return role_interfaces
+
+    def rebuild(self):
+        """从数据库全量重建并写入redis
+        """
+        role_interfaces = self._query()
+        with self._lock:
+            self._tries = {role: InterfaceTrie(interfaces)
+                           for role, interfaces in role_interfaces.items()}
+            self._store(role_interfaces, replace=True)
+            self._loaded = True
+        self._broadcast(None)
+
+    def refresh_roles(self, role_ids):
+        """只重建受影响的角色(及公共权限), 并通知其他进程
+
+        Args:
+            role_ids (iterable): 权限变更的角色id
+        """
+        role_ids = {str(role_id) for role_id in role_ids}
+        role_interfaces = self._query(role_ids)
+        roles = role_ids | {PUBLIC_ROLE}
+
+        with self._lock:
+            tries = dict(self._tries)
+            for role in roles:
+                interfaces = role_interfaces.get(role)
+                if interfaces:
+                    tries[role] = InterfaceTrie(interfaces)
+                else:
+                    tries.pop(role, None)
+            # NOTE: 整体替换引用, 鉴权线程无需加锁
+            self._tries = tries
+            self._store({role: role_interfaces.get(role, [])
+                         for role in roles})
+        self._broadcast(sorted(roles))
+
+    def _store(self, role_interfaces, replace=False):
+        try:
+            pipe = self.redis.conn_client.pipeline(transaction=True)
+            if replace:
+                pipe.delete(PERMISSION_MATRIX_KEY)
+            removed = [role for role, interfaces in role_interfaces.items()
+                       if not interfaces]
+            mapping = {role: json.dumps(interfaces)
+                       for role, interfaces in role_interfaces.items()
+                       if interfaces}
+            if removed:
+                pipe.hdel(PERMISSION_MATRIX_KEY, *removed)
+            if mapping:
+                pipe.hset(PERMISSION_MATRIX_KEY, mapping=mapping)
+            pipe.incr(PERMISSION_MATRIX_VERSION_KEY)
+            self._version = str(pipe.execute()[-1])
+            self._synced_at = time.monotonic()
+        except RedisError as e:
+            lx_log.error(f'【权限矩阵写入失败】{e}')
+
+    def _broadcast(self, roles):
+        message = json.dumps({'pid': os.getpid(), 'roles': roles})
+        try:
+            self.redis.public(PERMISSION_MATRIX_CHANNEL, message)
+        except RedisError as e:
+            lx_log.error(f'【权限矩阵通知失败】{e}')
+
+    def _reload_roles(self, roles):
+        """收到其他进程通知后, 从redis重新加载指定角色
+        """
+        if roles is None:
+            with self._lock:
+                self._load()
+            return
+
+        try:
+            pipe = self.redis.conn_client.pipeline(transaction=False)
+            pipe.get(PERMISSION_MATRIX_VERSION_KEY)
+            pipe.hmget(PERMISSION_MATRIX_KEY, roles)
+            version, values = pipe.execute()
+        except RedisError as e:
+            lx_log.error(f'【权限矩阵加载失败】{e}')
+            return
+
+        with self._lock:
+            tries = dict(self._tries)
+            for role, interfaces in zip(roles, values):
+                if interfaces:
+                    tries[role] = InterfaceTrie(json.loads(interfaces))
+                else:
+                    tries.pop(role, None)
+            self._tries = tries
+            self._version = version
+
+    def _listen(self):
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            subscription = self.redis.subscribe(PERMISSION_MATRIX_CHANNEL)
+            threading.Thread(target=self._handle_messages,
+                             args=(subscription, ),
+                             daemon=True).start()
+            self._listener_pid = os.getpid()
+
+    def _handle_messages(self, subscription):
+        pid = os.getpid()
+        for message in subscription:
+            try:
+                payload = json.loads(message['data'])
+            except (ValueError, TypeError):
+                continue
+            if payload.get('pid') == pid or not self._loaded:
+                continue
+            self._reload_roles(payload.get('roles'))
+
+
+class UserRoles:
+    """用户角色id缓存(两级缓存, 角色成员变更时按用户失效)
+    """
+
+    @staticmethod
+    def tag(user_id):
+        return f'user_roles:{user_id}'
+
+    @staticmethod
+    def query(user_id):
+        return list(Role.objects.filter(user__id=user_id, is_deleted=False)
+                    .values_list('id', flat=True))
+
+    @staticmethod
+    def get(user_id):
+        """获取用户未删除的角色id
+
+        Args:
+            user_id (int): 用户id
+
+        Returns:
+            list
+        """
+        return USER_ROLE_CACHE.get_or_set(f'user_roles:{user_id}',
+                                          lambda: UserRoles.query(user_id),
+                                          tags=[UserRoles.tag(user_id)])
+
+    @staticmethod
+    async def aget(user_id):
+        """get的asyncio版本, 缓存未命中时才在线程中查询数据库
+        """
+        return await USER_ROLE_CACHE.aget_or_set(
+            f'user_roles:{user_id}',
+            lambda: UserRoles.query(user_id),
+            tags=[UserRoles.tag(user_id)])
+
+    @staticmethod
+    def invalidate(user_ids):
+        USER_ROLE_CACHE.invalidate_tags(*[UserRoles.tag(user_id)
+                                          for user_id in user_ids])
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=PermissionMatrix.reset)
@@ -0,0 +1,56 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from core.middlewares import (AsyncCapableMiddleware, compile_url_patterns,
+                              resolve_user)
+from core.mixins.response import ResponseMixin
+
+from .matrix import PermissionMatrix, UserRoles
+
+PERMISSION_EXEMPT_URLS = compile_url_patterns(
+    tuple(getattr(settings, 'LOGIN_EXEMPT_URLS', ())) +
+    tuple(getattr(settings, 'PERMISSION_EXEMPT_URLS', ())))
+
+
+class PermissionRequiredMiddleware(AsyncCapableMiddleware):
+    """接口权限校验, 需放在LoginRequiredMiddleware之后
+
+    用户的角色id走两级缓存, 接口匹配走进程内权限矩阵, 正常情况下鉴权不访问数据库.
+    """
+
+    def sync_call(self, request):
+        user = request.user
+        if self.need_check(request, user.is_authenticated):
+            if not self.is_allowed(request, UserRoles.get(user.id)):
+                return self.forbidden()
+
+        return self.get_response(request)
+
+    async def async_call(self, request):
+        is_authenticated = await sync_to_async(resolve_user)(request)
+        if self.need_check(request, is_authenticated):
+            role_ids = await UserRoles.aget(request.user.id)
+            if not await PermissionMatrix.get().ais_allowed(
+                    role_ids, request.path_info):
+                return self.forbidden()
+
+        return await self.get_response(request)
+
+    @staticmethod
+    def need_check(request, is_authenticated):
+        return (is_authenticated
+                and not request.user.is_superuser
+                and not PERMISSION_EXEMPT_URLS.match(
+                    request.path_info.lstrip('/')))
+
+    @staticmethod
+    def is_allowed(request, role_ids):
+        return PermissionMatrix.get().is_allowed(role_ids, request.path_info)
+
+    @staticmethod
+    def forbidden():
+        response = ResponseMixin()
+        response.success = False
+        response.status = '10004'
+
+        return response.get_json_response()
@@ -0,0 +1,65 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:28
+#
+# NOTE: lfb_role/lfb_permission/lfb_role_permission在引入迁移前已存在于线上库,
+#       已有的数据库首次迁移需加--fake-initial, django检测到表已存在时只记录
+#       本迁移为已执行, 不重复建表, 后续迁移正常执行:
+#           python manage.py migrate permission_mgmt --fake-initial
+#       新建的数据库(含测试库)正常执行CreateModel
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Permission',
+            fields=[
+                ('created', models.DateTimeField(auto_now_add=True, help_text='YYYY-MM-DD hh:mm:ss format', verbose_name='创建时间')),
+                ('modified', models.DateTimeField(auto_now=True, help_text='YYYY-MM-DD hh:mm:ss format', verbose_name='修改时间')),
+                ('name', models.CharField(help_text='中文/英文', max_length=100, verbose_name='名称')),
+                ('desc', models.CharField(blank=True, help_text='中文/英文', max_length=300, null=True, verbose_name='描述')),
+                ('operator', models.CharField(help_text='用户名', max_length=50, verbose_name='创建者用户名')),
+                ('is_deleted', models.BooleanField(default=False, help_text='是否标记为删除(软删除功能)', verbose_name='删除标记')),
+                ('modifier', models.CharField(help_text='用户名', max_length=50, verbose_name='记录修改者用户名')),
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False, verbose_name='唯一标识')),
+                ('displayed', models.BooleanField(default=True, verbose_name='是否展示')),
+                ('is_private', models.BooleanField(default=True, help_text='用于判断是否应用于所有角色', verbose_name='是否私有')),
+                ('editable', models.CharField(default=True, help_text='是否允许对权限进行编辑', max_length=5, verbose_name='是否允许编辑')),
+                ('interface', models.CharField(max_length=500, verbose_name='接口url')),
+            ],
+            options={
+                'verbose_name': '权限信息表',
+                'db_table': 'lfb_permission',
+                'ordering': ['created'],
+                'get_latest_by': '-created',
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='Role',
+            fields=[
+                ('created', models.DateTimeField(auto_now_add=True, help_text='YYYY-MM-DD hh:mm:ss format', verbose_name='创建时间')),
+                ('modified', models.DateTimeField(auto_now=True, help_text='YYYY-MM-DD hh:mm:ss format', verbose_name='修改时间')),
+                ('name', models.CharField(help_text='中文/英文', max_length=100, verbose_name='名称')),
+                ('desc', models.CharField(blank=True, help_text='中文/英文', max_length=300, null=True, verbose_name='描述')),
+                ('operator', models.CharField(help_text='用户名', max_length=50, verbose_name='创建者用户名')),
+                ('is_deleted', models.BooleanField(default=False, help_text='是否标记为删除(软删除功能)', verbose_name='删除标记')),
+                ('modifier', models.CharField(help_text='用户名', max_length=50, verbose_name='记录修改者用户名')),
+                ('id', models.AutoField(editable=False, primary_key=True, serialize=False, verbose_name='唯一标识')),
+                ('permission', models.ManyToManyField(blank=True, db_table='lfb_role_permission', related_name='role_list', to='permission_mgmt.Permission', verbose_name='权限列表')),
+            ],
+            options={
+                'verbose_name': '角色信息表',
+                'db_table': 'lfb_role',
+                'ordering': ['created'],
+                'get_latest_by': '-created',
+                'managed': True,
+            },
+        ),
+    ]
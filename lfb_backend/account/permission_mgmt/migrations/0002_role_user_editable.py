@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+def normalize_editable(apps, schema_editor):
+    # NOTE: 原CharField保存的是'True'/'False', 转为布尔列前统一为'1'/'0'
+    Permission = apps.get_model('permission_mgmt', 'Permission')
+    Permission.objects.filter(editable__in=('True', 'true', '1')).update(
+        editable='1')
+    Permission.objects.exclude(editable='1').update(editable='0')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('permission_mgmt', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_editable, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='permission',
+            name='editable',
+            field=models.BooleanField(default=True, help_text='是否允许对权限进行编辑', verbose_name='是否允许编辑'),
+        ),
+        migrations.AddField(
+            model_name='role',
+            name='user',
+            field=models.ManyToManyField(blank=True, db_table='lfb_role_user', related_name='role_list', to=settings.AUTH_USER_MODEL, verbose_name='用户列表'),
+        ),
+    ]
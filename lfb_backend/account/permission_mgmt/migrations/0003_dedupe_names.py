@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import Count
+
+
+def dedupe_names(apps, schema_editor):
+    """添加名称唯一约束前处理重名记录
+
+    每个名称保留一条(优先未删除, 其次id最小), 其余重命名: 已软删除的与
+    软删除一致改为"名称_deleted_id", 未删除的改为"名称_id", 关联关系不变
+    """
+    for model_name in ('Permission', 'Role'):
+        model = apps.get_model('permission_mgmt', model_name)
+        max_length = model._meta.get_field('name').max_length
+        names = list(model.objects
+                     .order_by()
+                     .values('name')
+                     .annotate(count=Count('id'))
+                     .filter(count__gt=1)
+                     .values_list('name', flat=True))
+        for name in names:
+            rows = list(model.objects
+                        .filter(name=name)
+                        .order_by('is_deleted', 'id')
+                        .values_list('id', 'is_deleted'))
+            for pk, is_deleted in rows[1:]:
+                suffix = f'_deleted_{pk}' if is_deleted else f'_{pk}'
+                model.objects.filter(pk=pk).update(
+                    name=name[:max_length - len(suffix)] + suffix)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permission_mgmt', '0002_role_user_editable'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_names, migrations.RunPython.noop),
+    ]
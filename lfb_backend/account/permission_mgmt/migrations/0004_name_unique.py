@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permission_mgmt', '0003_dedupe_names'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='permission',
+            constraint=models.UniqueConstraint(fields=('name',), name='lfb_permission_name_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='role',
+            constraint=models.UniqueConstraint(fields=('name',), name='lfb_role_name_unique'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('permission_mgmt', '0004_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='permission',
+            index=models.Index(fields=['created', 'id'], name='lfb_permiss_created_a9025c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='role',
+            index=models.Index(fields=['created', 'id'], name='lfb_role_created_4144d1_idx'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 
 from core.behaviors import (Informable, Modifiable, Operatable, Timestampable,
@@ -13,13 +14,13 @@ class Permission(Informable,
                  Timestampable,
                  models.Model):
 
-    DISPLAY_FIELDS = ('name', 'modifer', 'operator', 'created', 'modified',
+    DISPLAY_FIELDS = ('name', 'modifier', 'operator', 'created', 'modified',
                       'id', 'displayed', 'editable')
     RENAME_FIELD = 'name'
 
     id = models.AutoField(
         primary_key=True,
-        editale=False,
+        editable=False,
         verbose_name='唯一标识')
     displayed = models.BooleanField(
         default=True,
@@ -28,7 +29,7 @@ class Permission(Informable,
         default=True,
         verbose_name='是否私有',
         help_text='用于判断是否应用于所有角色')
-    editable = models.CharField(
+    editable = models.BooleanField(
         default=True,
         verbose_name='是否允许编辑',
         help_text='是否允许对权限进行编辑')
@@ -42,6 +43,12 @@ class Permission(Informable,
     class Meta:
         managed = True
         db_table = 'lfb_permission'
+        constraints = [
+            models.UniqueConstraint(fields=['name'],
+                                    name='lfb_permission_name_unique'),
+        ]
+        # NOTE: 键集分页按(created, id)排序
+        indexes = [models.Index(fields=['created', 'id'])]
         get_latest_by = '-created'
         ordering = ['created']
         verbose_name = '权限信息表'
@@ -71,6 +78,12 @@ class Role(Informable,
         related_name='role_list',
         verbose_name='权限列表',
         db_table='lfb_role_permission')
+    user = models.ManyToManyField(
+        settings.AUTH_USER_MODEL,
+        blank=True,
+        related_name='role_list',
+        verbose_name='用户列表',
+        db_table='lfb_role_user')
 
     objects = models.Manager()
     object_list = RoleQuerySet.as_manager()
@@ -78,7 +91,13 @@ class Role(Informable,
     class Meta:
         managed = True
         db_table = 'lfb_role'
-        get_lastest_by = '-created'
+        constraints = [
+            models.UniqueConstraint(fields=['name'],
+                                    name='lfb_role_name_unique'),
+        ]
+        # NOTE: 键集分页按(created, id)排序
+        indexes = [models.Index(fields=['created', 'id'])]
+        get_latest_by = '-created'
         ordering = ['created']
         verbose_name = '角色信息表'
 
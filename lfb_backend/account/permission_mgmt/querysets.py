@@ -1,7 +1,12 @@
+from django.db import transaction
 from django.db.models import QuerySet
+from django.dispatch import Signal
 
 from core.querysets import CRUDQuerySet, DisplayQuerySet, FilterQuerySet
 
+# NOTE: 批量同步角色权限后(事务提交后)发送, kwargs: added, removed
+role_permissions_synced = Signal()
+
 
 class PermissionQuerySet(DisplayQuerySet,
                          CRUDQuerySet,
@@ -11,4 +16,108 @@ class PermissionQuerySet(DisplayQuerySet,
 
 
 class RoleQuerySet(DisplayQuerySet, CRUDQuerySet, FilterQuerySet, QuerySet):
-    pass
+
+    @staticmethod
+    def to_id(value):
+        """id转换为int, 只接受整数或整数字符串(json对象的key为字符串)
+
+        Raises:
+            ValueError: 不是整数或整数字符串(包括bool/float)
+        """
+        if value.__class__ is int:
+            return value
+        if isinstance(value, str) and value.strip().lstrip('-').isdecimal():
+            return int(value)
+
+        raise ValueError(f'id必须为整数: {value!r}')
+
+    @staticmethod
+    def clean_role_permissions(role_permissions):
+        """校验并转换{角色id: 权限id列表}为{int: set(int)}
+
+        NOTE: 权限id必须为列表, 字符串如"12"直接迭代会得到{1, 2}
+
+        Args:
+            role_permissions (dict): {角色id: 权限id列表}
+
+        Raises:
+            TypeError: 参数不是dict或权限id不是列表
+            ValueError: id不是整数
+
+        Returns:
+            dict: {角色id: 权限id集合}
+        """
+        if not isinstance(role_permissions, dict):
+            raise TypeError('角色权限必须为{角色id: 权限id列表}')
+
+        to_id = RoleQuerySet.to_id
+        desired = {}
+        for role_id, permission_ids in role_permissions.items():
+            if not isinstance(permission_ids, (list, tuple, set)):
+                raise TypeError(f'角色{role_id}的权限id必须为列表')
+            desired[to_id(role_id)] = {to_id(pk) for pk in permission_ids}
+
+        return desired
+
+    def sync_permissions(self, role_permissions):
+        """将角色权限同步为指定的权限集合
+
+        一次查询当前关系并在内存中求差集, 新增关系一次bulk_create,
+        移除关系按through主键一次delete, 查询次数与角色数量无关.
+
+        NOTE: bulk_create/delete不触发m2m_changed, 事务提交后发送
+              role_permissions_synced信号
+
+        Args:
+            role_permissions (dict): {角色id: 权限id列表}, 未包含的角色不变
+
+        Raises:
+            TypeError, ValueError: 参数格式错误, 见clean_role_permissions
+
+        Returns:
+            dict: 变更集合, {'added': {角色id: [权限id]},
+                            'removed': {角色id: [权限id]}}
+        """
+        through = self.model.permission.through
+        desired = self.clean_role_permissions(role_permissions)
+        added = {}
+        removed = {}
+
+        with transaction.atomic(using=self.db):
+            current = {}
+            through_ids = {}
+            rows = (through.objects
+                    .using(self.db)
+                    .select_for_update()
+                    .filter(role_id__in=desired)
+                    .values_list('id', 'role_id', 'permission_id'))
+            for through_id, role_id, permission_id in rows:
+                current.setdefault(role_id, set()).add(permission_id)
+                through_ids[role_id, permission_id] = through_id
+
+            for role_id, permission_ids in desired.items():
+                existed = current.get(role_id, set())
+                if permission_ids - existed:
+                    added[role_id] = sorted(permission_ids - existed)
+                if existed - permission_ids:
+                    removed[role_id] = sorted(existed - permission_ids)
+
+            if added:
+                through.objects.using(self.db).bulk_create(
+                    [through(role_id=role_id, permission_id=permission_id)
+                     for role_id, permission_ids in added.items()
+                     for permission_id in permission_ids])
+            if removed:
+                through.objects.using(self.db).filter(id__in=[
+                    through_ids[role_id, permission_id]
+                    for role_id, permission_ids in removed.items()
+                    for permission_id in permission_ids
+                ]).delete()
+
+            if added or removed:
+                transaction.on_commit(
+                    lambda: role_permissions_synced.send(
+                        sender=self.model, added=added, removed=removed),
+                    using=self.db)
+
+        return {'added': added, 'removed': removed}
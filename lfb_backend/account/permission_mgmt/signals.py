@@ -0,0 +1,143 @@
+"""角色/权限变更时增量刷新权限矩阵和用户角色缓存
+"""
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from core import search
+from core.querysets import bulk_updated
+
+from .matrix import PermissionMatrix, UserRoles
+from .models import Permission, Role
+from .querysets import role_permissions_synced
+
+M2M_ACTIONS = ('post_add', 'post_remove', 'post_clear')
+# NOTE: 影响权限矩阵的字段
+ROLE_MATRIX_FIELDS = frozenset(('is_deleted',))
+PERMISSION_MATRIX_FIELDS = frozenset(('is_deleted', 'is_private', 'interface'))
+
+search.register(Role, 'name')
+search.register(Permission, 'name')
+
+
+def changed_pks(instance, action, pk_set, related_manager):
+    """获取m2m变更涉及的对端主键
+
+    NOTE: clear()时pk_set为None, 在pre_clear时先记录对端主键
+    """
+    if action == 'pre_clear':
+        instance._cleared_pks = list(
+            related_manager.values_list('pk', flat=True))
+        return None
+    if action not in M2M_ACTIONS:
+        return None
+    if action == 'post_clear':
+        return instance.__dict__.pop('_cleared_pks', [])
+
+    return pk_set or []
+
+
+def refresh_roles(role_ids, using):
+    """事务提交后刷新角色权限矩阵
+
+    NOTE: 提交前其他进程/连接读不到新数据, 立即刷新会把旧数据写回redis;
+    回滚时也不会刷新
+    """
+    role_ids = list(role_ids)
+    transaction.on_commit(
+        lambda: PermissionMatrix.get().refresh_roles(role_ids), using=using)
+
+
+def invalidate_users(user_ids, using):
+    """事务提交后失效用户角色缓存
+    """
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: UserRoles.invalidate(user_ids),
+                          using=using)
+
+
+@receiver(m2m_changed, sender=Role.permission.through)
+def role_permission_changed(sender, instance, action, reverse, pk_set,
+                            using, **kwargs):
+    if reverse:
+        role_ids = changed_pks(instance, action, pk_set, instance.role_list)
+    else:
+        role_ids = (None if action not in M2M_ACTIONS else [instance.pk])
+
+    if role_ids:
+        refresh_roles(role_ids, using)
+
+
+@receiver(role_permissions_synced, sender=Role)
+def role_permissions_batch_synced(sender, added, removed, **kwargs):
+    PermissionMatrix.get().refresh_roles(set(added) | set(removed))
+
+
+@receiver(m2m_changed, sender=Role.user.through)
+def role_user_changed(sender, instance, action, reverse, pk_set, using,
+                      **kwargs):
+    if reverse:
+        user_ids = (None if action not in M2M_ACTIONS else [instance.pk])
+    else:
+        user_ids = changed_pks(instance, action, pk_set, instance.user)
+
+    if user_ids:
+        invalidate_users(user_ids, using)
+
+
+@receiver(pre_delete, sender=Role)
+@receiver(pre_delete, sender=Permission)
+def related_before_delete(sender, instance, **kwargs):
+    # NOTE: 删除后m2m关系已不存在, 先记录关联的用户/角色
+    related = instance.user if sender is Role else instance.role_list
+    instance._related_pks = list(related.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def role_changed(sender, instance, using, **kwargs):
+    if kwargs.get('created'):
+        return
+
+    refresh_roles([instance.pk], using)
+    user_ids = instance.__dict__.pop('_related_pks', None)
+    if user_ids is None:
+        user_ids = instance.user.values_list('id', flat=True)
+    invalidate_users(user_ids, using)
+
+
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def permission_changed(sender, instance, using, **kwargs):
+    if kwargs.get('created') and instance.is_private:
+        return
+
+    role_ids = instance.__dict__.pop('_related_pks', None)
+    if role_ids is None:
+        role_ids = instance.role_list.values_list('id', flat=True)
+    refresh_roles(role_ids, using)
+
+
+@receiver(bulk_updated, sender=Role)
+def roles_bulk_updated(sender, ids, fields, **kwargs):
+    if ROLE_MATRIX_FIELDS.isdisjoint(fields):
+        return
+
+    PermissionMatrix.get().refresh_roles(ids)
+    user_ids = set(Role.user.through.objects
+                   .filter(role_id__in=ids)
+                   .values_list('user_id', flat=True))
+    if user_ids:
+        UserRoles.invalidate(user_ids)
+
+
+@receiver(bulk_updated, sender=Permission)
+def permissions_bulk_updated(sender, ids, fields, **kwargs):
+    if PERMISSION_MATRIX_FIELDS.isdisjoint(fields):
+        return
+
+    role_ids = set(Role.permission.through.objects
+                   .filter(permission_id__in=ids)
+                   .values_list('role_id', flat=True))
+    PermissionMatrix.get().refresh_roles(role_ids)
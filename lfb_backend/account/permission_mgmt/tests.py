@@ -1,3 +1,1011 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (AsyncRequestFactory, RequestFactory,
+                         SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from account.lfb_account.models import User
+from core.cache import LocalLRUCache, TwoTierCache
+from core.importers import ImportHelper
+from core.querysets import bulk_updated, supports_update_returning
+from core.search import get_search_backend
+from core.tests import FakeRedisMixin
+
+from .apis.permission_crud_api import (BatchRolePermissionUpdate,
+                                       PermissionDeletion, PermissionUpload,
+                                       RoleDeletion)
+from .apis.views import PermissionExport, RoleUserList
+from .matrix import USER_ROLE_CACHE, InterfaceTrie, PermissionMatrix
+from .middlewares import PermissionRequiredMiddleware
+from .models import Permission, Role
+from .querysets import role_permissions_synced
+
+
+class CRUDQuerySetQueryCountTest(TestCase):
+    """固定CRUDQuerySet每个操作的SQL语句数量, 防止回退为多次查询
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name='role',
+                                       modifier='admin',
+                                       operator='admin')
+        cls.other = Role.objects.create(name='other',
+                                        modifier='admin',
+                                        operator='admin')
+
+    @property
+    def update_queries(self):
+        return 1 if supports_update_returning(connection) else 2
+
+    def test_get_by_id(self):
+        with self.assertNumQueries(1):
+            data = Role.object_list.get_by_id(self.role.id)
+        self.assertEqual(data['name'], 'role')
+
+    def test_get_by_id_not_found(self):
+        with self.assertNumQueries(1):
+            data = Role.object_list.get_by_id(0)
+        self.assertEqual(data, {})
+
+    def test_get_by_field(self):
+        with self.assertNumQueries(1):
+            data = Role.object_list.get_by_field({'name': 'other'})
+        self.assertEqual(data['id'], self.other.id)
+
+    def test_update_by_id(self):
+        with self.assertNumQueries(self.update_queries):
+            role = Role.object_list.update_by_id(self.role.id,
+                                                 desc='desc',
+                                                 modifier='modifier')
+        self.assertEqual(role.desc, 'desc')
+        self.assertEqual(role.modifier, 'modifier')
+        self.assertGreater(role.modified, self.role.modified)
+
+    def test_update_by_id_soft_delete(self):
+        with self.assertNumQueries(self.update_queries):
+            role = Role.object_list.update_by_id(self.role.id,
+                                                 is_deleted=True)
+        self.assertTrue(role.is_deleted)
+        self.assertEqual(role.name, f'role_deleted_{self.role.id}')
+
+    def test_update_by_id_joined_filter(self):
+        permission = Permission.objects.create(name='permission',
+                                               interface='/api',
+                                               modifier='admin',
+                                               operator='admin')
+        self.other.permission.add(permission)
+        unassigned = Role.object_list.filter(permission__isnull=True)
+
+        with self.assertNumQueries(2):
+            role = unassigned.update_by_id(self.role.id, desc='desc')
+        self.assertEqual(role.desc, 'desc')
+        self.assertIsNone(unassigned.update_by_id(self.other.id,
+                                                  desc='desc'))
+
+    def test_update_by_id_filtered_field_without_returning(self):
+        existed = Role.object_list.existed()
+
+        with mock.patch('core.querysets.supports_update_returning',
+                        return_value=False), self.assertNumQueries(2):
+            role = existed.update_by_id(self.role.id, is_deleted=True)
+
+        self.assertTrue(role.is_deleted)
+        self.assertEqual(role.name, f'role_deleted_{self.role.id}')
+
+    def test_update_returning_single_table_only(self):
+        unassigned = Role.object_list.filter(permission__isnull=True,
+                                             id=self.role.id)
+        query = unassigned._update_query({'desc': 'desc'})
+
+        with self.assertRaises(AssertionError):
+            unassigned._update_returning(connection, query)
+
+    def test_estimate_count_with_filter(self):
+        Role.object_list.update_by_id(self.other.id, is_deleted=True)
+
+        # NOTE: 有过滤条件时不能使用整表的统计行数
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                self.assertNumQueries(1):
+            self.assertEqual(Role.object_list.existed().estimate_count(), 1)
+
+    def test_update_by_id_not_found(self):
+        with self.assertNumQueries(1):
+            role = Role.object_list.update_by_id(0, desc='desc')
+        self.assertIsNone(role)
+
+    def test_create_if_absent(self):
+        with self.assertNumQueries(1):
+            role = Role.object_list.create_if_absent('name',
+                                                     name='new',
+                                                     modifier='admin',
+                                                     operator='admin')
+        self.assertEqual(Role.objects.get(name='new').id, role.id)
+
+    def test_create_if_absent_existed(self):
+        with self.assertNumQueries(1):
+            role = Role.object_list.create_if_absent('name',
+                                                     name='role',
+                                                     modifier='admin',
+                                                     operator='admin')
+        self.assertIsNone(role)
+
+
+class PermissionUploadTest(TestCase):
+    """有效/无效/重复行混合上传时逐行返回结果, 文件解析失败时整体回滚
+    """
+
+    def setUp(self):
+        Permission.objects.create(name='existed',
+                                  interface='api/v1/existed',
+                                  modifier='admin',
+                                  operator='admin')
+
+    def upload(self, content):
+        request = RequestFactory().post('/api/v1/upload/permission', {
+            'file': SimpleUploadedFile('permission.csv', content)})
+        request.user = mock.Mock(username='admin')
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = PermissionUpload.as_view()(request)
+
+        return json.loads(response.content), callbacks
+
+    def test_mixed_rows(self):
+        content = '\n'.join([
+            '名称,接口url,描述',
+            'new,api/v1/new,',
+            ',api/v1/no-name,',
+            'existed,api/v1/other,',
+            'new,api/v1/again,',
+            f'{"x" * 101},api/v1/long,',
+            '',
+            'other,api/v1/other,描述',
+        ]).encode('utf-8-sig')
+
+        result, callbacks = self.upload(content)
+
+        data = result['data']
+        self.assertTrue(result['success'])
+        self.assertEqual((data['created'], data['skipped'], data['error']),
+                         (2, 2, 2))
+        self.assertEqual([(row['row'], row['status']) for row in data['rows']],
+                         [(2, 'created'), (3, 'error'), (4, 'skipped'),
+                          (5, 'skipped'), (6, 'error'), (8, 'created')])
+        self.assertIn('name', data['rows'][1]['msg'])
+        self.assertIn('长度', data['rows'][4]['msg'])
+        self.assertEqual(dict(Permission.objects.values_list('name',
+                                                             'interface')),
+                         {'existed': 'api/v1/existed',
+                          'new': 'api/v1/new',
+                          'other': 'api/v1/other'})
+        self.assertEqual(Permission.objects.get(name='other').modifier,
+                         'admin')
+        # NOTE: 只有搜索索引更新, 没有公共权限时不刷新矩阵
+        self.assertEqual(len(callbacks), 1)
+
+    def test_parse_error_rolls_back(self):
+        content = 'name,interface\nfirst,api/v1/first\n'.encode() + (
+            b'second,api/v1/\xff\n')
+        batched = ImportHelper.batched
+
+        # NOTE: 每批1行, 第一批写入后解析第二批时失败
+        with mock.patch.object(ImportHelper, 'batched',
+                               lambda iterable: batched(iterable, 1)):
+            result, callbacks = self.upload(content)
+
+        self.assertFalse(result['success'])
+        self.assertEqual(result['status'], '10002')
+        self.assertFalse(Permission.objects.filter(name='first').exists())
+        self.assertEqual(callbacks, [])
+
+
+class RoleUserListTest(TestCase):
+    """角色用户列表只返回用户的展示字段
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # NOTE: lfb_user为非托管表, 测试库中需要手动建表
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(User)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(User)
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User(username='admin', operator='admin')
+        user.set_password('admin')
+        user.save()
+        cls.role = Role.objects.create(name='role',
+                                       modifier='admin',
+                                       operator='admin')
+        cls.role.user.add(user)
+
+    def test_display_fields_only(self):
+        request = RequestFactory().post('/api/v1/list/roleUser',
+                                        {'roleId': self.role.id})
+        response = RoleUserList.as_view()(request)
+
+        rows = json.loads(response.content)['data']
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['username'], 'admin')
+        self.assertNotIn('password', rows[0])
+        self.assertEqual(set(rows[0]),
+                         {'username', 'lastLogin', 'created', 'modified',
+                          'id'})
+
+
+class InsertIgnoreTest(TestCase):
+    """insert_ignore在各数据库分支下返回新记录主键, 冲突的行为None
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.role = Role.objects.create(name='role',
+                                       modifier='admin',
+                                       operator='admin')
+
+    def insert(self):
+        rows = [{'name': name} for name in ('new', 'role', 'new', 'other')]
+        pks = Role.object_list.insert_ignore(rows, 'name',
+                                             modifier='admin',
+                                             operator='admin')
+
+        self.assertIsNone(pks[1])
+        self.assertIsNone(pks[2])
+        self.assertEqual(
+            dict(Role.objects.filter(pk__in=[pks[0], pks[3]])
+                 .values_list('pk', 'name')),
+            {pks[0]: 'new', pks[3]: 'other'})
+        self.assertEqual(Role.objects.count(), 3)
+
+    def test_returning(self):
+        if not supports_update_returning(connection):
+            self.skipTest('数据库不支持INSERT ... RETURNING')
+
+        self.insert()
+
+    def test_without_returning(self):
+        with mock.patch('core.querysets.supports_update_returning',
+                        return_value=False):
+            self.insert()
+
+    def test_mysql_duplicate_key_update(self):
+        mysql = mock.Mock(vendor='mysql', ops=connection.ops)
+        fields = [Role._meta.get_field(name)
+                  for name in ('name', 'created', 'modifier', 'operator')]
+        now = timezone.now()
+        cursor = mock.Mock()
+
+        def executemany(sql, params):
+            # NOTE: 模拟mysql执行, 名称冲突的行不修改
+            self.assertFalse(sql.startswith('INSERT IGNORE'))
+            self.assertTrue(sql.endswith(
+                'ON DUPLICATE KEY UPDATE "id" = "id"'))
+            for name, created, modifier, operator in params:
+                if not Role.objects.filter(name=name).exists():
+                    role = Role.objects.create(name=name, modifier=modifier,
+                                               operator=operator)
+                    Role.objects.filter(pk=role.pk).update(created=created)
+
+        cursor.executemany.side_effect = executemany
+        batch = [{'name': name} for name in ('a', 'role', 'a')]
+        result = Role.object_list.all()._mysql_insert_ignore(
+            cursor, mysql, fields, 'name', batch,
+            [[row['name'], now, 'admin', 'admin'] for row in batch], now)
+
+        self.assertEqual(result,
+                         {'a': Role.objects.get(name='a').pk})
+
+    def test_mysql_without_auto_now_add(self):
+        mysql = mock.Mock(vendor='mysql', ops=connection.ops)
+        queryset = Role.object_list.all()
+
+        with mock.patch.object(queryset, '_savepoint_insert_ignore',
+                               return_value={'a': 1}) as savepoint:
+            result = queryset._mysql_insert_ignore(
+                mock.Mock(), mysql, [Role._meta.get_field('name')], 'name',
+                [{'name': 'a'}], [['a']], None)
+
+        self.assertEqual(result, {'a': 1})
+        savepoint.assert_called_once()
+
+
+class RolePermissionCleanTest(SimpleTestCase):
+    """角色权限参数校验, 权限id必须为整数列表
+    """
+
+    def test_clean(self):
+        self.assertEqual(
+            Role.object_list.clean_role_permissions({'1': [2, '3'], 4: []}),
+            {1: {2, 3}, 4: set()})
+
+    def test_invalid(self):
+        for role_permissions, error in (([1], TypeError),
+                                        ({'1': '12'}, TypeError),
+                                        ({'1': 12}, TypeError),
+                                        ({'1': [True]}, ValueError),
+                                        ({'1': [1.5]}, ValueError),
+                                        ({'1': ['1a']}, ValueError),
+                                        ({'a': [1]}, ValueError)):
+            with self.subTest(role_permissions=role_permissions):
+                with self.assertRaises(error):
+                    Role.object_list.clean_role_permissions(role_permissions)
+
+    def test_view_rejects_string_ids(self):
+        request = RequestFactory().post(
+            '/api/v1/update/BatchRolePermission',
+            {'rolePermissions': json.dumps({'1': '12'})})
+        response = BatchRolePermissionUpdate.as_view()(request)
+
+        data = json.loads(response.content)
+        self.assertEqual(data['status'], '10002')
+        self.assertEqual(data['msg'], '角色1的权限id必须为列表')
+
+
+class PermissionExportTest(TransactionTestCase):
+    """权限导出在WSGI与ASGI下的流式输出
+    """
+
+    URL = '/api/v1/export/permission'
+
+    @classmethod
+    def setUpClass(cls):
+        # NOTE: lfb_user为非托管表, 清空lfb_role_user时需要该表存在
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(User)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(User)
+
+    def setUp(self):
+        for i in range(3):
+            Permission.objects.create(name=f'permission{i}',
+                                      interface=f'/api/v1/permission{i}',
+                                      modifier='admin',
+                                      operator='admin')
+        Permission.objects.create(name='deleted',
+                                  interface='/api/v1/deleted',
+                                  modifier='admin',
+                                  operator='admin',
+                                  is_deleted=True)
+
+    @staticmethod
+    def parse(content):
+        return list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+
+    def assert_exported(self, response):
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="permission.csv"')
+        rows = self.parse(self.content)
+        self.assertEqual(rows[0][:3], ['唯一标识', '名称', '接口url'])
+        self.assertEqual([row[1] for row in rows[1:]],
+                         ['permission0', 'permission1', 'permission2'])
+
+    def test_wsgi(self):
+        request = RequestFactory().post(self.URL)
+        response = PermissionExport.as_view()(request)
+        self.content = b''.join(response.streaming_content)
+
+        self.assert_exported(response)
+
+    def test_asgi(self):
+        request = AsyncRequestFactory().post(
+            self.URL, 'fileType=csv',
+            content_type='application/x-www-form-urlencoded')
+
+        async def handle():
+            # NOTE: 与django 3.2的ASGIHandler一致, 在事件循环中同步迭代响应
+            response = await sync_to_async(PermissionExport.as_view())(
+                request)
+            self.content = b''.join(response)
+            response.close()
+            return response
+
+        self.assert_exported(asyncio.run(handle()))
+
+    def test_invalid_file_type(self):
+        request = RequestFactory().post(self.URL, {'fileType': 'pdf'})
+        response = PermissionExport.as_view()(request)
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(json.loads(response.content)['status'], '10002')
+
+
+@override_settings(SEARCH_BACKEND='redis')
+class RedisSearchBackendTest(FakeRedisMixin, TestCase):
+    """redis n-gram索引只提供候选集合, 结果仍需关键词校验
+    """
+
+    def setUp(self):
+        super().setUp()
+        for name in ('abc', 'ab_bc', '张三的角色'):
+            Role.objects.create(name=name, modifier='admin', operator='admin')
+        self.backend = get_search_backend()
+        self.backend.rebuild(Role, 'name')
+
+    def search(self, search_string):
+        return sorted(Role.object_list.fuzzy_filter('name', search_string)
+                      .values_list('name', flat=True, use_fields_only=True))
+
+    def test_ngram_candidates_rechecked(self):
+        self.assertEqual(self.search('abc'), ['abc'])
+        self.assertEqual(self.search('ab bc'), ['ab_bc', 'abc'])
+
+    def test_pinyin(self):
+        self.assertEqual(self.search('zhangsan'), ['张三的角色'])
+        self.assertEqual(self.search('zsd'), ['张三的角色'])
+        self.assertEqual(self.search('zhangsan 角色'), ['张三的角色'])
+
+    def test_index_updated_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Role.objects.create(name='新角色', modifier='admin',
+                                operator='admin')
+            self.assertEqual(self.search('新角色'), [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.search('新角色'), ['新角色'])
+
+
+class InterfaceTrieTest(SimpleTestCase):
+    """接口前缀树的通配符匹配及路径规范化
+    """
+
+    def match(self, trie, path):
+        return trie.match(InterfaceTrie.split(path))
+
+    def test_exact(self):
+        trie = InterfaceTrie(['/api/v1/list/role/'])
+
+        self.assertTrue(self.match(trie, '/api/v1/list/role'))
+        self.assertTrue(self.match(trie, 'http://host/api/v1/list/role?a=1'))
+        self.assertFalse(self.match(trie, '/api/v1/list'))
+        self.assertFalse(self.match(trie, '/api/v1/list/role/1'))
+
+    def test_any_segment(self):
+        trie = InterfaceTrie(['api/v1/*/role'])
+
+        self.assertTrue(self.match(trie, 'api/v1/list/role'))
+        self.assertTrue(self.match(trie, 'api/v1/delete/role'))
+        self.assertFalse(self.match(trie, 'api/v1/role'))
+        self.assertFalse(self.match(trie, 'api/v1/list/all/role'))
+
+    def test_any_suffix(self):
+        trie = InterfaceTrie(['api/v1/**', 'api/v2/list'])
+
+        self.assertTrue(self.match(trie, 'api/v1/list/role/1'))
+        self.assertTrue(self.match(trie, 'api/v2/list'))
+        self.assertFalse(self.match(trie, 'api/v2/list/role'))
+        self.assertFalse(InterfaceTrie())
+
+
+class PermissionMatrixMixin(FakeRedisMixin):
+    """权限矩阵/用户角色缓存使用fakeredis, 不启动pub/sub监听线程
+    """
+
+    def setUp(self):
+        super().setUp()
+        PermissionMatrix.reset()
+        self.addCleanup(PermissionMatrix.reset)
+        for target, attr, value in (
+                (PermissionMatrix, '_listen', lambda matrix: None),
+                (TwoTierCache, '_listener_pid', os.getpid()),
+                (USER_ROLE_CACHE, '_redis_util', None),
+                (USER_ROLE_CACHE, 'local', LocalLRUCache())):
+            patcher = mock.patch.object(target, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def create_permission(name, interface, is_private=True):
+        return Permission.objects.create(name=name,
+                                         interface=interface,
+                                         is_private=is_private,
+                                         modifier='admin',
+                                         operator='admin')
+
+
+class PermissionMatrixTest(PermissionMatrixMixin, TestCase):
+    """公共权限, 以及m2m/save/批量更新后(事务提交时)刷新矩阵
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.role = Role.objects.create(name='role',
+                                        modifier='admin',
+                                        operator='admin')
+        self.role.permission.add(
+            self.create_permission('list', 'api/v1/list/*'))
+        self.create_permission('public', 'api/v1/public/**',
+                               is_private=False)
+        self.matrix = PermissionMatrix.get()
+
+    def allowed(self, path, role_ids=None):
+        if role_ids is None:
+            role_ids = [self.role.id]
+
+        return self.matrix.is_allowed(role_ids, path)
+
+    def test_role_and_public_interfaces(self):
+        self.assertTrue(self.allowed('/api/v1/list/role'))
+        self.assertFalse(self.allowed('/api/v1/delete/role'))
+        self.assertTrue(self.allowed('/api/v1/public/a/b', role_ids=[]))
+        self.assertFalse(self.allowed('/api/v1/list/role', role_ids=[]))
+
+    def test_refresh_after_m2m_commit(self):
+        self.allowed('/api/v1/delete/role')
+        permission = self.create_permission('delete', 'api/v1/delete/*')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.role.permission.add(permission)
+        # NOTE: 提交前不刷新
+        self.assertFalse(self.allowed('/api/v1/delete/role'))
+
+        for callback in callbacks:
+            callback()
+        self.assertTrue(self.allowed('/api/v1/delete/role'))
+
+    def test_refresh_after_save(self):
+        permission = self.role.permission.get()
+        permission.interface = 'api/v2/**'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            permission.save()
+
+        self.assertTrue(self.allowed('/api/v2/list/role'))
+        self.assertFalse(self.allowed('/api/v1/list/role'))
+
+    def test_refresh_after_bulk_update(self):
+        self.assertTrue(self.allowed('/api/v1/list/role'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Role.object_list.update_by_ids({self.role.id: {
+                'is_deleted': True}})
+
+        self.assertFalse(self.allowed('/api/v1/list/role'))
+        self.assertTrue(self.allowed('/api/v1/public/a'))
+
+
+class PermissionRequiredMiddlewareTest(PermissionMatrixMixin, TestCase):
+    """未授权接口返回10004, 超级用户及免检url不校验
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # NOTE: lfb_user为非托管表, 测试库中需要手动建表
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(User)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(User)
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='user', operator='admin')
+        role = Role.objects.create(name='role',
+                                   modifier='admin',
+                                   operator='admin')
+        role.permission.add(self.create_permission('list', 'api/v1/list/*'))
+        role.user.add(self.user)
+        self.get_response = mock.Mock(return_value='ok')
+        self.middleware = PermissionRequiredMiddleware(self.get_response)
+
+    def call(self, path, user=None):
+        request = RequestFactory().get(path)
+        request.user = user or self.user
+
+        return self.middleware(request)
+
+    def assertForbidden(self, response):
+        self.assertEqual(json.loads(response.content)['status'], '10004')
+        self.get_response.assert_not_called()
+
+    def test_granted(self):
+        self.assertEqual(self.call('/api/v1/list/role'), 'ok')
+
+    def test_not_granted(self):
+        self.assertForbidden(self.call('/api/v1/delete/role'))
+
+    def test_superuser_bypass(self):
+        self.user.is_superuser = True
+
+        self.assertEqual(self.call('/api/v1/delete/role'), 'ok')
+
+    def test_exempt_bypass(self):
+        self.assertEqual(self.call('/api/v1/logout'), 'ok')
+        self.assertEqual(self.call('/api/v1/login'), 'ok')
+
+    def test_role_removed_on_commit(self):
+        self.assertEqual(self.call('/api/v1/list/role'), 'ok')
+        self.get_response.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.role_list.clear()
+
+        self.assertForbidden(self.call('/api/v1/list/role'))
+
+    def test_async_not_granted(self):
+        async def get_response(request):
+            return 'ok'
+
+        # NOTE: sqlite测试事务中其他线程无法查询, 先同步加载缓存和矩阵
+        self.call('/api/v1/list/role')
+        middleware = PermissionRequiredMiddleware(get_response)
+        request = AsyncRequestFactory().get('/api/v1/delete/role')
+        request.user = self.user
+
+        response = asyncio.run(middleware(request))
+
+        self.assertEqual(json.loads(response.content)['status'], '10004')
+
+
+class SyncPermissionsTest(PermissionMatrixMixin, TestCase):
+    """sync_permissions的增删差集, 以及提交后role_permissions_synced的参数
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.roles = [Role.objects.create(name=f'role{i}',
+                                          modifier='admin',
+                                          operator='admin')
+                      for i in range(3)]
+        self.permissions = [
+            self.create_permission(f'permission{i}', f'api/v1/{i}')
+            for i in range(4)]
+        p = self.pks(self.permissions)
+        self.roles[0].permission.set(p[:2])
+        self.roles[1].permission.set(p[2:3])
+        self.roles[2].permission.set(p[:1])
+
+    @staticmethod
+    def pks(objs):
+        return [obj.pk for obj in objs]
+
+    def current(self, role):
+        return sorted(role.permission.values_list('id', flat=True))
+
+    def test_added_and_removed(self):
+        r = self.pks(self.roles)
+        p = self.pks(self.permissions)
+
+        changes = Role.object_list.sync_permissions({
+            str(r[0]): [p[1], p[2], p[3]],
+            r[1]: [],
+        })
+
+        self.assertEqual(changes, {'added': {r[0]: [p[2], p[3]]},
+                                   'removed': {r[0]: [p[0]],
+                                               r[1]: [p[2]]}})
+        self.assertEqual(self.current(self.roles[0]), p[1:])
+        self.assertEqual(self.current(self.roles[1]), [])
+        # NOTE: 未包含的角色不变
+        self.assertEqual(self.current(self.roles[2]), p[:1])
+
+    def test_synced_signal_on_commit(self):
+        r = self.pks(self.roles)
+        p = self.pks(self.permissions)
+        handler = mock.Mock()
+        role_permissions_synced.connect(handler, sender=Role)
+        self.addCleanup(role_permissions_synced.disconnect, handler,
+                        sender=Role)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Role.object_list.sync_permissions({r[1]: [p[0], p[2]]})
+            handler.assert_not_called()
+
+        handler.assert_called_once_with(signal=role_permissions_synced,
+                                        sender=Role,
+                                        added={r[1]: [p[0]]},
+                                        removed={})
+        self.assertTrue(PermissionMatrix.get().is_allowed([r[1]],
+                                                          'api/v1/0'))
+
+    def test_unchanged_sends_nothing(self):
+        r = self.pks(self.roles)
+        p = self.pks(self.permissions)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            changes = Role.object_list.sync_permissions({r[0]: p[:2]})
+
+        self.assertEqual(changes, {'added': {}, 'removed': {}})
+        self.assertEqual(callbacks, [])
+
+
+class DedupeNamesMigrationTest(TransactionTestCase):
+    """名称唯一约束前的数据迁移, 重名记录保留一条, 其余重命名
+    """
+
+    BEFORE = [('permission_mgmt', '0002_role_user_editable')]
+
+    @classmethod
+    def setUpClass(cls):
+        # NOTE: lfb_user为非托管表, 测试库中需要手动建表
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(User)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(User)
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+
+        return executor.loader.project_state(targets).apps
+
+    def test_dedupe(self):
+        self.addCleanup(
+            lambda: self.migrate(MigrationExecutor(connection)
+                                 .loader.graph.leaf_nodes()))
+        old_role = self.migrate(self.BEFORE).get_model('permission_mgmt',
+                                                       'Role')
+        pks = [old_role.objects.create(name=name,
+                                       is_deleted=is_deleted,
+                                       modifier='admin',
+                                       operator='admin').pk
+               for name, is_deleted in (('a', True), ('a', False),
+                                        ('a', False), ('b', False))]
+
+        self.migrate([('permission_mgmt', '0004_name_unique')])
+
+        self.assertEqual(
+            list(Role.objects.order_by('id').values_list('name', flat=True)),
+            [f'a_deleted_{pks[0]}', 'a', f'a_{pks[2]}', 'b'])
+
+
+class UpdateByIdsTest(PermissionMatrixMixin, TestCase):
+    """各行/各批次字段不同的批量更新, 软删除重命名及bulk_updated信号
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.roles = [Role.objects.create(name=f'role{i}',
+                                          desc='desc',
+                                          modifier='admin',
+                                          operator='admin')
+                      for i in range(3)]
+        self.pks = [role.pk for role in self.roles]
+
+    def rows(self):
+        return list(Role.objects.filter(pk__in=self.pks)
+                    .order_by('id')
+                    .values_list('name', 'desc', 'modifier'))
+
+    def test_mixed_fields(self):
+        a, b, c = self.pks
+        for batch_size in (1, 2, 3):
+            with self.subTest(batch_size=batch_size):
+                updated = Role.object_list.update_by_ids({
+                    a: {'desc': f'{batch_size}'},
+                    b: {'modifier': f'm{batch_size}'},
+                    c: {'desc': 'c', 'modifier': 'c'},
+                }, batch_size=batch_size)
+
+                self.assertEqual(updated, 3)
+                self.assertEqual(self.rows(), [
+                    ('role0', f'{batch_size}', 'admin'),
+                    ('role1', 'desc', f'm{batch_size}'),
+                    ('role2', 'c', 'c'),
+                ])
+
+    def test_modified(self):
+        a, b, _ = self.pks
+        modified = timezone.now() - timezone.timedelta(days=1)
+
+        Role.object_list.update_by_ids({a: {'modified': modified},
+                                        b: {'desc': 'b'}})
+
+        self.assertEqual(Role.objects.get(pk=a).modified, modified)
+        self.assertGreater(Role.objects.get(pk=b).modified,
+                           self.roles[1].modified)
+
+    def test_soft_delete_rename(self):
+        a, b, c = self.pks
+
+        Role.object_list.update_by_ids({
+            a: {'is_deleted': True},
+            b: {'desc': 'b'},
+            c: {'is_deleted': True, 'name': 'renamed'},
+        }, batch_size=2)
+
+        self.assertEqual([name for name, _, _ in self.rows()],
+                         [f'role0_deleted_{a}', 'role1', 'renamed'])
+
+    def test_bulk_updated_on_commit(self):
+        a, b, _ = self.pks
+        handler = mock.Mock()
+        bulk_updated.connect(handler, sender=Role)
+        self.addCleanup(bulk_updated.disconnect, handler, sender=Role)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Role.object_list.update_by_ids({a: {'is_deleted': True},
+                                            b: {'desc': 'b'}},
+                                           batch_size=1)
+            handler.assert_not_called()
+
+        handler.assert_called_once_with(
+            signal=bulk_updated, sender=Role, ids=[a, b],
+            fields={'is_deleted', 'desc', 'name', 'modified'})
+
+
+class SoftDeletionViewTest(PermissionMatrixMixin, TestCase):
+    """批量软删除视图只删除可删除的记录并重命名
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.roles = [Role.objects.create(name=f'role{i}',
+                                          modifier='admin',
+                                          operator='admin')
+                      for i in range(2)]
+        Role.object_list.update_by_id(self.roles[1].pk, is_deleted=True)
+        self.permissions = [
+            self.create_permission('editable', 'api/v1/editable'),
+            self.create_permission('fixed', 'api/v1/fixed')]
+        Permission.objects.filter(name='fixed').update(editable=False)
+
+    def delete(self, view, ids):
+        request = RequestFactory().post('/api/v1/delete',
+                                        {'ids': json.dumps(ids)})
+        request.user = mock.Mock(username='deleter')
+
+        return json.loads(view.as_view()(request).content)
+
+    def test_role_deletion(self):
+        live, deleted = (role.pk for role in self.roles)
+
+        result = self.delete(RoleDeletion, [live, deleted, 0])
+
+        self.assertEqual(result['data'], {'ids': [live]})
+        role = Role.objects.get(pk=live)
+        self.assertTrue(role.is_deleted)
+        self.assertEqual(role.name, f'role0_deleted_{live}')
+        self.assertEqual(role.modifier, 'deleter')
+        # NOTE: 已删除的记录不重复重命名
+        self.assertEqual(Role.objects.get(pk=deleted).name,
+                         f'role1_deleted_{deleted}')
+
+    def test_permission_deletion_skips_fixed(self):
+        editable, fixed = (permission.pk for permission in self.permissions)
+
+        result = self.delete(PermissionDeletion, [editable, fixed])
+
+        self.assertEqual(result['data'], {'ids': [editable]})
+        self.assertEqual(
+            dict(Permission.objects.values_list('name', 'is_deleted')),
+            {f'editable_deleted_{editable}': True, 'fixed': False})
+
+    def test_invalid_ids(self):
+        result = self.delete(RoleDeletion, ['a'])
+
+        self.assertEqual(result['status'], '10002')
+        self.assertFalse(Role.objects.filter(is_deleted=True)
+                         .exclude(pk=self.roles[1].pk).exists())
+
+
+class KeysetPaginateTest(PermissionMatrixMixin, TestCase):
+    """键集分页逐页翻页、created相同的行按主键排序、过滤与不过滤的计数
+    """
+
+    def setUp(self):
+        super().setUp()
+        roles = [Role.objects.create(name=f'role{i}',
+                                     modifier='admin',
+                                     operator='admin')
+                 for i in range(7)]
+        # NOTE: 每个created值对应多行, 只能靠主键区分位置
+        now = timezone.now()
+        for i, role in enumerate(roles):
+            Role.objects.filter(pk=role.pk).update(
+                created=now + timezone.timedelta(seconds=(i * 2) % 3))
+        self.ordered = list(Role.objects.order_by('created', 'pk')
+                            .values_list('pk', flat=True))
+
+    def walk(self, queryset, order=1):
+        ids, cursor, pages = [], None, 0
+        while True:
+            page = queryset.keyset_paginate(cursor=cursor,
+                                            order=order,
+                                            page_size=2)
+            ids.extend(row['id'] if isinstance(row, dict) else row.pk
+                       for row in page['rows'])
+            pages += 1
+            cursor = page['next']
+            if cursor is None:
+                return ids, pages
+
+    def test_forward_pages_with_ties(self):
+        ids, pages = self.walk(Role.object_list.all())
+
+        self.assertEqual(ids, self.ordered)
+        self.assertEqual(pages, 4)
+
+    def test_descending_pages_with_ties(self):
+        ids, _ = self.walk(Role.object_list.all(), order=-1)
+
+        self.assertEqual(ids, self.ordered[::-1])
+
+    def test_prev_cursor(self):
+        queryset = Role.object_list.all()
+        first = queryset.keyset_paginate(page_size=2)
+        second = queryset.keyset_paginate(cursor=first['next'], page_size=2)
+        third = queryset.keyset_paginate(cursor=second['next'], page_size=2)
+
+        self.assertIsNone(first['prev'])
+        back = queryset.keyset_paginate(cursor=third['prev'], page_size=2)
+        self.assertEqual([row.pk for row in back['rows']],
+                         [row.pk for row in second['rows']])
+        self.assertEqual(back['next'], second['next'])
+        back = queryset.keyset_paginate(cursor=back['prev'], page_size=2)
+        self.assertEqual([row.pk for row in back['rows']], self.ordered[:2])
+        self.assertIsNone(back['prev'])
+
+    def test_values_rows(self):
+        ids, _ = self.walk(Role.object_list.values('id', 'created'))
+
+        self.assertEqual(ids, self.ordered)
+
+    def test_filtered_count(self):
+        Role.object_list.update_by_id(self.ordered[0], is_deleted=True)
+        for count in ('exact', 'estimate'):
+            with self.subTest(count=count):
+                self.assertEqual(Role.object_list.all().keyset_paginate(
+                    page_size=2, count=count)['total'], 7)
+                page = Role.object_list.existed().keyset_paginate(
+                    page_size=2, count=count)
+                self.assertEqual(page['total'], 6)
+                self.assertNotIn(self.ordered[0],
+                                 [row.pk for row in page['rows']])
+                # NOTE: 总数不受游标条件影响
+                page = Role.object_list.existed().keyset_paginate(
+                    cursor=page['next'], page_size=2, count=count)
+                self.assertEqual(page['total'], 6)
+
+    def test_index_matches_ordering(self):
+        index, = Role._meta.indexes
+        self.assertEqual(index.fields, ['created', 'id'])
+        if connection.vendor != 'sqlite':
+            return
+
+        first = Role.object_list.all().keyset_paginate(page_size=2)
+        queryset = Role.object_list.all()
+        for cursor in (None, first['next']):
+            with self.subTest(cursor=cursor), \
+                    CaptureQueriesContext(connection) as queries:
+                queryset.keyset_paginate(cursor=cursor, page_size=2)
+            with connection.cursor() as db_cursor:
+                db_cursor.execute('EXPLAIN QUERY PLAN '
+                                  + queries.captured_queries[0]['sql'])
+                plan = ' '.join(str(row[-1])
+                                for row in db_cursor.fetchall())
+            self.assertIn(index.name, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
@@ -1,9 +1,8 @@
 import os
 
-import django
-from channels.routing import get_default_application
+from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.dev")
 
-django.setup()
-application = get_default_application()
+# NOTE: 使用django原生ASGI handler, async视图/中间件直接在事件循环中执行
+application = get_asgi_application()
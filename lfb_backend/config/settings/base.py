@@ -50,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'core.middlewares.LoginRequiredMiddleware',
+    'account.permission_mgmt.middlewares.PermissionRequiredMiddleware',
     'silk.middleware.SilkyMiddleware',
 ]
 
@@ -125,6 +126,35 @@ LOGIN_EXEMPT_URLS = (
     r'^silk/'
 )
 
+# NOTE: redis/es连接配置, 各环境配置文件按需覆盖
+REDIS_OPTIONS = {
+    'HOST': 'localhost',
+    'PORT': 6379,
+    'DB': 0,
+    'PASSWD': None,
+}
+
+ES_OPTIONS = {
+    'HOST': 'localhost',
+    'PORT': 9200,
+    'NODE': ['localhost:9200'],
+}
+
+# NOTE: 默认使用数据库session. redis session引擎(core.sessions)读写更快,
+#       但redis不可用时无法登录, 部署了redis的环境在各自的配置文件中开启:
+#       SESSION_ENGINE = 'core.sessions'
+#       session滑动过期默认值见core.constants(SESSION_SLIDING_EXPIRY,
+#       SESSION_REFRESH_FRACTION), 需要时在各环境配置文件中覆盖
+
+# NOTE: 登录后无需接口权限即可访问的url
+PERMISSION_EXEMPT_URLS = (
+    r'^api/v1/logout$',
+    r'^api/v1/detail/user$',
+)
+
+# NOTE: fuzzy_filter搜索后端: like/fulltext/redis, 见core.search
+SEARCH_BACKEND = 'like'
+
 SILKY_PYTHON_PROFILER = True
 SILKY_PYTHON_PROFILER_BINARY = True
 SILKY_PYTHON_PROFILER_RESULT_PATH = os.path.join(BASE_DIR, 'profiles/')
@@ -23,7 +23,11 @@ import account.permission_mgmt.urls as permission_mgmt_urls
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
-    url(r'^silk/', include('silk.urls', namespace='silk')),
     url(r'^api/v1/', include(lfb_account_urls)),
     url(r'^api/v1/', include(permission_mgmt_urls)),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+
+# NOTE: silk为开发环境的性能分析工具, 未启用(INSTALLED_APPS中移除)时不加载
+if 'silk' in settings.INSTALLED_APPS:
+    urlpatterns.append(
+        url(r'^silk/', include('silk.urls', namespace='silk')))
@@ -0,0 +1,106 @@
+"""asyncio版本的redis访问工具, 供ASGI(daphne)下的async视图/中间件使用
+
+asyncio客户端与事件循环绑定, 注册表按(事件循环, 配置)复用连接池,
+同一个daphne进程内的所有请求共用一个连接池, 不需要每个请求占用一个线程.
+"""
+import asyncio
+import json
+import os
+
+import redis.asyncio as aioredis
+from django.conf import settings
+
+from .constants import REDIS_ENCODING, REDIS_MAX_CONN, REDIS_POOL_TIMEOUT
+
+
+class LoopBoundRegistry:
+    """按事件循环缓存客户端, 事件循环关闭后自动丢弃
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._clients = {}
+        self._pid = os.getpid()
+
+    def get(self, config, *args):
+        if self._pid != os.getpid():
+            self._clients = {}
+            self._pid = os.getpid()
+
+        loop = asyncio.get_running_loop()
+        key = (id(loop), json.dumps(config, sort_keys=True, default=str),
+               args)
+        entry = self._clients.get(key)
+        if entry is None or entry[0] is not loop:
+            self._clients = {k: v for k, v in self._clients.items()
+                             if not v[0].is_closed()}
+            entry = (loop, self.factory(config, *args))
+            self._clients[key] = entry
+
+        return entry[1]
+
+
+def _create_redis(config, decode):
+    conn_params = {
+        'host': config['HOST'],
+        'port': config['PORT'],
+        'db': config['DB'],
+        'password': config['PASSWD'],
+        'max_connections': config.get('max_connections', REDIS_MAX_CONN),
+    }
+    if decode is True:
+        conn_params['encoding'] = config.get('encoding', REDIS_ENCODING)
+        conn_params['decode_responses'] = True
+
+    # NOTE: 并发协程数可能远大于连接数, 连接用尽时等待而不是直接报错
+    conn_pool = aioredis.BlockingConnectionPool(
+        timeout=config.get('pool_timeout', REDIS_POOL_TIMEOUT), **conn_params)
+
+    return aioredis.Redis(connection_pool=conn_pool)
+
+
+REDIS_REGISTRY = LoopBoundRegistry(_create_redis)
+
+
+class AsyncRedisUtil:
+    """RedisUtil的asyncio版本(常用命令)
+
+    Examples:
+        value = await AsyncRedisUtil().get('key')
+    """
+
+    def __init__(self, config=None, decode=True):
+        """从当前事件循环的注册表获取共享的redis连接池
+
+        Args:
+            config (dict, optional): 配置信息. Defaults to settings.REDIS_OPTIONS.
+            decode (bool, optional): 是否对结果进行解码. Defaults to True.
+        """
+        self.config = config if config is not None else settings.REDIS_OPTIONS
+        self.conn_client = REDIS_REGISTRY.get(self.config, decode)
+
+    async def set(self, key, value, expired_time=0):
+        if isinstance(expired_time, int) and expired_time > 0:
+            await self.conn_client.set(key, value, ex=expired_time)
+        else:
+            await self.conn_client.set(key, value)
+
+    async def get(self, key):
+
+        return await self.conn_client.get(key)
+
+    async def mget(self, keys):
+        if not keys:
+            return []
+
+        return await self.conn_client.mget(keys)
+
+    async def delete(self, key):
+        await self.conn_client.delete(key)
+
+    async def exists(self, key):
+
+        return await self.conn_client.exists(key)
+
+    async def public(self, channel, msg):
+        await self.conn_client.publish(channel, msg)
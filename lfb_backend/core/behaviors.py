@@ -75,3 +75,6 @@ class Modifiable(models.Model):
         max_length=50,
         verbose_name='记录修改者用户名',
         help_text='用户名')
+
+    class Meta:
+        abstract = True
@@ -0,0 +1,476 @@
+"""两级(进程内LRU + redis)读穿透缓存
+
+读取顺序: 进程内LRU -> redis -> 加载函数. 同一个key同时只有一个加载者
+(进程内分段锁 + redis NX锁), 其余请求等待结果. 失效按tag进行, 并通过redis
+pub/sub广播, 所有uwsgi/daphne进程同时删除本地缓存.
+"""
+import functools
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from redis.exceptions import RedisError
+
+from log.log import lx_log
+
+from .constants import (CACHE_CHANNEL, CACHE_LOCAL_MAXSIZE, CACHE_LOCAL_TTL,
+                        CACHE_LOCK_STRIPES, CACHE_LOCK_TIMEOUT,
+                        CACHE_LOCK_WAIT, CACHE_TIMEOUT)
+from .async_utils import AsyncRedisUtil
+from .utils import RedisUtil
+
+MISSING = object()
+
+
+class LocalLRUCache:
+    """线程安全的进程内LRU缓存, 条目数有上限且带过期时间
+
+    Args:
+        maxsize (int, optional): 最大条目数. Defaults to CACHE_LOCAL_MAXSIZE.
+        ttl (int, optional): 默认过期秒数. Defaults to CACHE_LOCAL_TTL.
+    """
+
+    def __init__(self, maxsize=CACHE_LOCAL_MAXSIZE, ttl=CACHE_LOCAL_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """获取缓存
+
+        Returns:
+            any: 缓存值, 不存在或已过期时返回MISSING
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache:
+    """两级读穿透缓存
+
+    Examples:
+        user_cache = TwoTierCache('user')
+
+        detail = user_cache.get_or_set(
+            f'detail:{username}',
+            lambda: User.object_list.get_by_field({'username': username}),
+            tags=[f'user:{username}'])
+
+        user_cache.invalidate_tags(f'user:{username}')
+
+    Args:
+        namespace (str): 缓存命名空间, 不同命名空间的key互不影响
+        timeout (int, optional): redis缓存过期秒数. Defaults to CACHE_TIMEOUT.
+        local_ttl (int, optional): 进程内缓存过期秒数.
+            Defaults to CACHE_LOCAL_TTL.
+        local_maxsize (int, optional): 进程内缓存最大条目数.
+            Defaults to CACHE_LOCAL_MAXSIZE.
+        redis_util (RedisUtil, optional): redis连接(不解码).
+            Defaults to RedisUtil(decode=False).
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+    _listener_pid = None
+
+    def __init__(self,
+                 namespace,
+                 timeout=CACHE_TIMEOUT,
+                 local_ttl=CACHE_LOCAL_TTL,
+                 local_maxsize=CACHE_LOCAL_MAXSIZE,
+                 redis_util=None):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.local = LocalLRUCache(local_maxsize, local_ttl)
+        self._redis_util = redis_util
+        self._locks = [threading.Lock() for _ in range(CACHE_LOCK_STRIPES)]
+        self.stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0,
+                      'loads': 0, 'errors': 0}
+
+        with self._registry_lock:
+            self._registry[namespace] = self
+
+    @property
+    def redis(self):
+        # NOTE: 延迟创建连接, 允许在模块导入时声明缓存
+        if self._redis_util is None:
+            self._redis_util = RedisUtil(decode=False)
+        if TwoTierCache._listener_pid != os.getpid():
+            self._ensure_listener(self._redis_util)
+
+        return self._redis_util
+
+    def make_key(self, key):
+        return f'cache:{self.namespace}:{key}'
+
+    def tag_key(self, tag):
+        return f'cache:{self.namespace}:tag:{tag}'
+
+    def get(self, key, default=None):
+        """只读缓存, 不触发加载
+
+        Returns:
+            any: 缓存值, 未命中时返回default
+        """
+        value = self._get_cached(key)
+
+        return default if value is MISSING else value
+
+    def _get_cached(self, key):
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.stats['local_hits'] += 1
+            return value
+
+        try:
+            raw = self.redis.get(self.make_key(key))
+        except RedisError as e:
+            self._log_error('读取', e)
+            return MISSING
+
+        if raw is None:
+            return MISSING
+
+        value = pickle.loads(raw)
+        self.stats['redis_hits'] += 1
+        self.local.set(key, value)
+
+        return value
+
+    def set(self, key, value, timeout=None, tags=(), broadcast=False):
+        """写入两级缓存
+
+        Args:
+            key (str): 缓存key
+            value (any): 可pickle的缓存值
+            timeout (int, optional): redis过期秒数. Defaults to self.timeout.
+            tags (iterable, optional): 失效标签. Defaults to ().
+            broadcast (bool, optional): 是否通知其他进程删除本地旧值.
+                Defaults to False.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.local.set(key, value, min(self.local.ttl, timeout))
+
+        full_key = self.make_key(key)
+        try:
+            with self.redis.pipeline() as pipe:
+                pipe.set(full_key, pickle.dumps(value), timeout)
+                for tag in tags:
+                    tag_key = self.tag_key(tag)
+                    pipe.conn_client.sadd(tag_key, full_key)
+                    pipe.conn_client.expire(tag_key, timeout)
+        except RedisError as e:
+            self._log_error('写入', e)
+            return
+
+        if broadcast:
+            self._broadcast([key])
+
+    def add(self, key, value, timeout=None, fail_silently=True):
+        """key不存在时才写入(redis SET NX)
+
+        Args:
+            fail_silently (bool, optional): redis不可用时是否返回False,
+                为False时抛出RedisError. Defaults to True.
+
+        Returns:
+            bool: 是否写入成功, redis不可用时返回False
+        """
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            added = self.redis.conn_client.set(self.make_key(key),
+                                               pickle.dumps(value),
+                                               nx=True,
+                                               ex=timeout or None)
+        except RedisError as e:
+            self._log_error('写入', e)
+            if not fail_silently:
+                raise
+            return False
+
+        if added:
+            self.local.set(key, value, min(self.local.ttl, timeout))
+
+        return bool(added)
+
+    def get_or_set(self, key, loader, timeout=None, tags=()):
+        """读穿透: 未命中时调用loader加载并写入缓存
+
+        同一个key同时只有一个加载者, 其余请求等待其结果, 防止缓存击穿.
+
+        Args:
+            key (str): 缓存key
+            loader (callable): 无参加载函数
+            timeout (int, optional): redis过期秒数. Defaults to self.timeout.
+            tags (iterable, optional): 失效标签. Defaults to ().
+
+        Returns:
+            any: 缓存值
+        """
+        value = self._get_cached(key)
+        if value is not MISSING:
+            return value
+
+        with self._locks[hash(key) % CACHE_LOCK_STRIPES]:
+            value = self._get_cached(key)
+            if value is not MISSING:
+                return value
+
+            lock_key = f'{self.make_key(key)}:lock'
+            acquired = self._acquire_redis_lock(lock_key)
+            # NOTE: redis不可用(None)时直接加载, 只有锁被其他进程持有时才等待
+            if acquired is False:
+                value = self._wait_for_loader(key)
+                if value is not MISSING:
+                    return value
+
+            self.stats['misses'] += 1
+            try:
+                value = loader()
+                self.stats['loads'] += 1
+                self.set(key, value, timeout, tags)
+            finally:
+                if acquired:
+                    self._release_redis_lock(lock_key)
+
+        return value
+
+    async def aget_or_set(self, key, loader, timeout=None, tags=()):
+        """get_or_set的asyncio版本
+
+        本地命中直接返回, redis通过asyncio客户端读取, 都未命中时才在线程中
+        执行get_or_set(加载函数通常是数据库查询).
+
+        Returns:
+            any: 缓存值
+        """
+        value = self.local.get(key)
+        if value is not MISSING:
+            self.stats['local_hits'] += 1
+            return value
+
+        try:
+            raw = await AsyncRedisUtil(self.redis.config,
+                                       decode=False).get(self.make_key(key))
+        except RedisError as e:
+            self._log_error('读取', e)
+            raw = None
+        if raw is not None:
+            value = pickle.loads(raw)
+            self.stats['redis_hits'] += 1
+            self.local.set(key, value)
+            return value
+
+        return await sync_to_async(self.get_or_set)(key, loader, timeout, tags)
+
+    def _acquire_redis_lock(self, lock_key):
+        """获取redis加载锁
+
+        Returns:
+            bool or None: 是否获取成功, redis不可用时返回None
+        """
+        try:
+            return bool(self.redis.conn_client.set(
+                lock_key, b'1', nx=True, ex=CACHE_LOCK_TIMEOUT))
+        except RedisError as e:
+            self._log_error('加锁', e)
+            return None
+
+    def _release_redis_lock(self, lock_key):
+        try:
+            self.redis.delete(lock_key)
+        except RedisError as e:
+            self._log_error('解锁', e)
+
+    def _wait_for_loader(self, key):
+        """其他进程正在加载时, 短暂等待其写入redis
+        """
+        deadline = time.monotonic() + CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            value = self._get_cached(key)
+            if value is not MISSING:
+                return value
+
+        return MISSING
+
+    def delete(self, *keys):
+        """删除指定key并广播给其他进程
+        """
+        self.local.delete(*keys)
+        try:
+            self.redis.conn_client.delete(*[self.make_key(key)
+                                            for key in keys])
+        except RedisError as e:
+            self._log_error('删除', e)
+        self._broadcast(list(keys))
+
+    def invalidate_tags(self, *tags):
+        """按标签失效缓存, 所有进程同时删除本地缓存
+
+        Args:
+            *tags (str): 失效标签
+        """
+        if not tags:
+            return
+
+        prefix = len(self.make_key(''))
+        try:
+            client = self.redis.conn_client
+            tag_keys = [self.tag_key(tag) for tag in tags]
+            pipe = client.pipeline(transaction=False)
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            full_keys = set()
+            for members in pipe.execute():
+                full_keys.update(members)
+            client.delete(*full_keys, *tag_keys)
+        except RedisError as e:
+            self._log_error('标签失效', e)
+            self.local.clear()
+            return
+
+        keys = [full_key.decode()[prefix:] for full_key in full_keys]
+        self.local.delete(*keys)
+        self._broadcast(keys)
+
+    def _broadcast(self, keys):
+        if not keys:
+            return
+        message = json.dumps({'namespace': self.namespace, 'keys': keys})
+        try:
+            self.redis.public(CACHE_CHANNEL, message)
+        except RedisError as e:
+            self._log_error('广播', e)
+
+    def _log_error(self, action, error):
+        self.stats['errors'] += 1
+        lx_log.error(f'【缓存{self.namespace}{action}失败】{error}')
+
+    @classmethod
+    def _ensure_listener(cls, redis_util):
+        """每个进程启动一个监听线程, 处理其他进程广播的失效消息
+
+        NOTE: 以pid判断, fork出的worker进程会重新启动自己的监听线程
+        """
+        with cls._registry_lock:
+            if cls._listener_pid == os.getpid():
+                return
+            subscription = redis_util.subscribe(CACHE_CHANNEL)
+            threading.Thread(target=cls._listen,
+                             args=(subscription, ),
+                             daemon=True).start()
+            cls._listener_pid = os.getpid()
+
+    @classmethod
+    def _listen(cls, subscription):
+        for message in subscription:
+            try:
+                data = message['data']
+                payload = json.loads(data.decode()
+                                     if isinstance(data, bytes) else data)
+                cache = cls._registry.get(payload['namespace'])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if cache is not None:
+                cache.local.delete(*payload['keys'])
+
+    def cached(self, timeout=None, tags=None, key_func=None):
+        """函数结果缓存装饰器
+
+        Examples:
+            @role_cache.cached(tags=lambda role_id: [f'role:{role_id}'])
+            def get_role_permissions(role_id):
+                return list(Role.objects.get(id=role_id)
+                            .permission.values('id', 'name'))
+
+        Args:
+            timeout (int, optional): redis过期秒数. Defaults to self.timeout.
+            tags (iterable or callable, optional): 失效标签, 可调用时以函数参数
+                计算标签. Defaults to None.
+            key_func (callable, optional): 以函数参数计算缓存key.
+                Defaults to 函数名+参数repr.
+
+        Returns:
+            function
+        """
+        def decorator(func):
+            prefix = f'{func.__module__}.{func.__qualname__}'
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if key_func is not None:
+                    key = f'{prefix}:{key_func(*args, **kwargs)}'
+                else:
+                    key = f'{prefix}:{args!r}:{sorted(kwargs.items())!r}'
+                key_tags = (tags(*args, **kwargs)
+                            if callable(tags) else (tags or ()))
+
+                return self.get_or_set(key,
+                                       lambda: func(*args, **kwargs),
+                                       timeout=timeout,
+                                       tags=key_tags)
+
+            wrapper.cache = self
+
+            return wrapper
+
+        return decorator
+
+    def get_queryset(self, key, queryset, timeout=None, tags=()):
+        """缓存queryset结果(求值为list后缓存)
+
+        Args:
+            key (str): 缓存key
+            queryset (QuerySet): 需要缓存的查询, 如qs.values(...)
+            timeout (int, optional): redis过期秒数. Defaults to self.timeout.
+            tags (iterable, optional): 失效标签. Defaults to ().
+
+        Returns:
+            list
+        """
+        return self.get_or_set(key, lambda: list(queryset), timeout, tags)
+
+    @classmethod
+    def reset(cls):
+        """fork后的子进程不继承父进程的锁状态
+        """
+        cls._registry_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=TwoTierCache.reset)
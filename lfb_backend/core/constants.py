@@ -1,8 +1,78 @@
 # NOTE: es constans
 DOC_TYPE = 'default'
+ES_POOL_SIZE = 10
+ES_TIMEOUT = 30
+ES_RETRIES = 1
+ES_METADATA_TTL = 60
+BULK_CHUNK_SIZE = 500
+BULK_CHUNK_BYTES = 10 * 1024 * 1024
+BULK_MAX_RETRIES = 3
+BULK_RETRY_BACKOFF = 1
+BULK_MAX_BACKOFF = 30
+SCROLL_SIZE = 1000
+SCROLL_KEEP_ALIVE = '2m'
+# NOTE: 不使用point in time时search_after的排序兜底字段, 需唯一且有doc_values
+SCROLL_TIEBREAKER = 'id'
+REINDEX_REQUESTS_PER_SECOND = 1000
+REINDEX_POLL_INTERVAL = 5
+REINDEX_STATE_PREFIX = 'es:reindex:'
+REINDEX_STATE_EXPIRED_TIME = 7 * 24 * 3600
 
 # NOTE: redis constans
 REDIS_MAX_CONN = 100
 REDIS_ENCODING = 'utf-8'
+REDIS_POOL_TIMEOUT = 5
+QUEUE_BATCH_SIZE = 100
+QUEUE_BLOCK_TIMEOUT = 5
+QUEUE_WORKER_COUNT = 4
+PUBSUB_QUEUE_SIZE = 1000
+PUBSUB_POLL_INTERVAL = 0.2
+PUBSUB_RECONNECT_INTERVAL = 1
+
+# NOTE: cache constans
+CACHE_TIMEOUT = 300
+CACHE_LOCAL_TTL = 30
+CACHE_LOCAL_MAXSIZE = 1024
+CACHE_LOCK_STRIPES = 64
+CACHE_LOCK_TIMEOUT = 10
+CACHE_LOCK_WAIT = 2
+CACHE_CHANNEL = 'cache:invalidate'
+
+# NOTE: session constans
+SESSION_SLIDING_EXPIRY = 3600
+SESSION_REFRESH_FRACTION = 0.5
+SESSION_REFRESHED_KEY = '_refreshed_at'
+SESSION_LOCAL_TTL = 5
+SESSION_LOCAL_MAXSIZE = 10000
+
+# NOTE: permission constans
+PERMISSION_MATRIX_KEY = 'permission:matrix'
+PERMISSION_MATRIX_VERSION_KEY = 'permission:matrix:version'
+PERMISSION_MATRIX_CHANNEL = 'permission:matrix'
+PERMISSION_MATRIX_SYNC_INTERVAL = 30
+PUBLIC_ROLE = 'public'
+
+# NOTE: renderer constans
+RENDERER_KEY_CACHE_SIZE = 10000
+
+# NOTE: export constans
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_STREAM_BUFFER = 64 * 1024
+# NOTE: ASGI下后台线程预读的数据块数量
+EXPORT_THREAD_QUEUE_SIZE = 4
+EXPORT_THREAD_POLL_INTERVAL = 0.1
+
+# NOTE: import constans
+IMPORT_BATCH_SIZE = 2000
+
+# NOTE: queryset constans
+UPDATE_BATCH_SIZE = 1000
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# NOTE: search constans
+SEARCH_KEY_PREFIX = 'search'
+SEARCH_NGRAM_SIZE = 2
+SEARCH_BATCH_SIZE = 1000
 
 DEFAULT_HEADERS = {'Content-Type': 'application/json'}
@@ -0,0 +1,842 @@
+"""elastic search批量/流式操作工具
+
+供 core.utils.ESUtil 调用, 所有类只依赖传入的es客户端/连接.
+"""
+import json
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.serializers.json import DjangoJSONEncoder
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
+from elasticsearch.exceptions import TransportError
+
+from log.log import lx_log
+
+from .constants import (BULK_CHUNK_BYTES, BULK_CHUNK_SIZE, BULK_MAX_BACKOFF,
+                        BULK_MAX_RETRIES, BULK_RETRY_BACKOFF, DOC_TYPE,
+                        ES_METADATA_TTL, REINDEX_POLL_INTERVAL,
+                        REINDEX_REQUESTS_PER_SECOND,
+                        REINDEX_STATE_EXPIRED_TIME, REINDEX_STATE_PREFIX,
+                        SCROLL_KEEP_ALIVE, SCROLL_SIZE, SCROLL_TIEBREAKER)
+
+# NOTE: es对文档的元数据字段, 其余字段作为文档内容
+BULK_META_FIELDS = ('_id', '_index', '_routing')
+BULK_RETRY_STATUS = frozenset((429, ))
+# NOTE: 后台翻页线程与消费者之间的消息类型
+PAGE, PAGE_ERROR, PAGE_DONE = range(3)
+
+
+class BulkResult:
+    """批量插入结果
+
+    Attributes:
+        success (int): 成功写入的文档数
+        failed (list): 失败文档, e.g. [{'seq': 3, '_id': 'a', 'status': 400,
+            'error': {...}}], seq为文档在输入中的序号, 连接错误时status为None
+    """
+
+    __slots__ = ('success', 'failed')
+
+    def __init__(self):
+        self.success = 0
+        self.failed = []
+
+    def __bool__(self):
+        return not self.failed
+
+    def __repr__(self):
+        return (f'<BulkResult success={self.success} '
+                f'failed={len(self.failed)}>')
+
+
+class ESBulkIndexer:
+    """流式分块批量写入es
+
+    文档被惰性序列化为NDJSON, 按文档数或字节数阈值分块提交, 内存中最多只保留
+    thread_count + 1 个分块. 被es拒绝(429)的文档按指数退避单独重试,
+    其余失败逐条记录在BulkResult中.
+
+    Args:
+        es (Elasticsearch): es客户端
+        index (str): 默认写入的索引
+        doc_type (str, optional): 索引文档类型. Defaults to DOC_TYPE.
+        op_type (str, optional): bulk操作类型index/create. Defaults to 'index'.
+        chunk_size (int, optional): 每块最多文档数. Defaults to BULK_CHUNK_SIZE.
+        max_chunk_bytes (int, optional): 每块最大字节数.
+            Defaults to BULK_CHUNK_BYTES.
+        thread_count (int, optional): 并行提交的线程数, 1为同步提交.
+            Defaults to 1.
+        max_retries (int, optional): 被拒绝文档的最大重试次数.
+            Defaults to BULK_MAX_RETRIES.
+        backoff (float, optional): 首次重试等待秒数, 之后每次翻倍.
+            Defaults to BULK_RETRY_BACKOFF.
+    """
+
+    def __init__(self,
+                 es,
+                 index,
+                 doc_type=DOC_TYPE,
+                 op_type='index',
+                 chunk_size=BULK_CHUNK_SIZE,
+                 max_chunk_bytes=BULK_CHUNK_BYTES,
+                 thread_count=1,
+                 max_retries=BULK_MAX_RETRIES,
+                 backoff=BULK_RETRY_BACKOFF):
+        self.es = es
+        self.index = index
+        self.doc_type = doc_type
+        self.op_type = op_type
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.thread_count = max(1, thread_count)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def serialize(self, doc):
+        """将单个文档序列化为bulk所需的两行NDJSON
+
+        Args:
+            doc (dict): 文档, 可包含_id/_index/_routing元数据字段
+
+        Returns:
+            tuple: (文档_id, NDJSON bytes)
+        """
+        meta = {}
+        source = doc
+        if any(field in doc for field in BULK_META_FIELDS):
+            source = dict(doc)
+            for field in BULK_META_FIELDS:
+                if field in source:
+                    meta[field] = source.pop(field)
+
+        action = json.dumps({self.op_type: meta})
+        body = json.dumps(source, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+        return meta.get('_id'), f'{action}\n{body}\n'.encode()
+
+    def chunks(self, docs):
+        """将文档迭代器切分为满足阈值的分块
+
+        Args:
+            docs (iterable): 文档迭代器/生成器
+
+        Yields:
+            list: [(序号, 文档_id, NDJSON bytes), ...]
+        """
+        chunk = []
+        size = 0
+        for seq, doc in enumerate(docs):
+            doc_id, line = self.serialize(doc)
+            if chunk and (len(chunk) >= self.chunk_size
+                          or size + len(line) > self.max_chunk_bytes):
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append((seq, doc_id, line))
+            size += len(line)
+        if chunk:
+            yield chunk
+
+    def bulk(self, docs):
+        """流式写入文档
+
+        Args:
+            docs (iterable): 文档迭代器/生成器
+
+        Returns:
+            BulkResult
+        """
+        result = BulkResult()
+
+        if self.thread_count == 1:
+            for chunk in self.chunks(docs):
+                self._merge(result, self._send(chunk))
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.thread_count) as executor:
+            pending = set()
+            for chunk in self.chunks(docs):
+                # NOTE: 限制在途分块数量, 保证内存占用不随数据量增长
+                if len(pending) >= self.thread_count:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._merge(result, future.result())
+                pending.add(executor.submit(self._send, chunk))
+            for future in pending:
+                self._merge(result, future.result())
+
+        return result
+
+    @staticmethod
+    def _merge(result, chunk_result):
+        success, failed = chunk_result
+        result.success += success
+        result.failed.extend(failed)
+
+    def _send(self, chunk):
+        """提交单个分块, 只重试被es拒绝的文档
+
+        Args:
+            chunk (list): [(序号, 文档_id, NDJSON bytes), ...]
+
+        Returns:
+            tuple: (成功数, 失败文档列表)
+        """
+        success = 0
+        failed = []
+        attempt = 0
+
+        while chunk:
+            # NOTE: [(文档, 状态码, 错误信息)], 超出重试次数时记录最后一次的失败原因
+            retry = []
+            try:
+                res = self.es.bulk(body=b''.join(line for _, _, line in chunk),
+                                   index=self.index,
+                                   doc_type=self.doc_type)
+            except (ESConnectionError, TransportError) as e:
+                if isinstance(e, ESConnectionError):
+                    retry = [(entry, None, str(e)) for entry in chunk]
+                elif e.status_code in BULK_RETRY_STATUS:
+                    retry = [(entry, e.status_code, str(e)) for entry in chunk]
+                else:
+                    lx_log.error(f'【es批量写入{self.index}】{e}')
+                    failed.extend({'seq': seq, '_id': doc_id,
+                                   'status': e.status_code, 'error': str(e)}
+                                  for seq, doc_id, _ in chunk)
+            else:
+                items = res.get('items', [])
+                if not res.get('errors'):
+                    success += len(items)
+                else:
+                    for entry, item in zip(chunk, items):
+                        info = next(iter(item.values()))
+                        status = info.get('status', 500)
+                        if status < 300:
+                            success += 1
+                        elif status in BULK_RETRY_STATUS:
+                            retry.append((entry, status, info.get('error')))
+                        else:
+                            failed.append({'seq': entry[0], '_id': entry[1],
+                                           'status': status,
+                                           'error': info.get('error')})
+
+            if retry and attempt < self.max_retries:
+                time.sleep(min(self.backoff * 2 ** attempt,
+                               BULK_MAX_BACKOFF))
+                attempt += 1
+                chunk = [entry for entry, _, _ in retry]
+                continue
+
+            failed.extend({'seq': seq, '_id': doc_id, 'status': status,
+                           'error': error}
+                          for (seq, doc_id, _), status, error in retry)
+            chunk = None
+
+        return success, failed
+
+
+class ESScroller:
+    """按页遍历整个索引, 避免from/size深分页
+
+    mode='scroll' 使用scroll游标; mode='search_after' 优先使用
+    point in time + search_after(es 7.10+), 客户端不支持时直接对索引按sort
+    做search_after, 此时sort末尾追加唯一的tiebreaker字段, 保证翻页不重复/遗漏.
+
+    Args:
+        es (Elasticsearch): es客户端
+        index (str): 需要遍历的索引
+        query (dict, optional): 查询条件. Defaults to match_all.
+        source (list or bool, optional): _source过滤字段. Defaults to None.
+        size (int, optional): 每页文档数. Defaults to SCROLL_SIZE.
+        keep_alive (str, optional): 游标保持时间. Defaults to SCROLL_KEEP_ALIVE.
+        mode (str, optional): 'scroll'或'search_after'. Defaults to 'scroll'.
+        sort (list, optional): 排序条件, 默认按索引顺序. Defaults to None.
+        slice_id (int, optional): 切片序号, 与max_slices同时使用.
+        max_slices (int, optional): 切片总数.
+        tiebreaker (str, optional): 不使用point in time时追加的唯一排序字段.
+            Defaults to SCROLL_TIEBREAKER.
+    """
+
+    def __init__(self,
+                 es,
+                 index,
+                 query=None,
+                 source=None,
+                 size=SCROLL_SIZE,
+                 keep_alive=SCROLL_KEEP_ALIVE,
+                 mode='scroll',
+                 sort=None,
+                 slice_id=None,
+                 max_slices=None,
+                 tiebreaker=SCROLL_TIEBREAKER):
+        if mode not in ('scroll', 'search_after'):
+            raise ValueError(f'不支持的遍历方式: {mode}')
+
+        self.es = es
+        self.index = index
+        self.query = query or {'match_all': {}}
+        self.source = source
+        self.size = size
+        self.keep_alive = keep_alive
+        self.mode = mode
+        self.sort = sort
+        self.slice_id = slice_id
+        self.max_slices = max_slices
+        self.tiebreaker = tiebreaker
+
+    def _body(self, default_sort):
+        body = {
+            'query': self.query,
+            'sort': self.sort or default_sort,
+        }
+        if self.max_slices and self.max_slices > 1:
+            body['slice'] = {'id': self.slice_id, 'max': self.max_slices}
+
+        return body
+
+    def _search_kwargs(self):
+        kwargs = {'size': self.size}
+        if self.source is not None:
+            kwargs['_source'] = self.source
+
+        return kwargs
+
+    def pages(self):
+        """逐页返回命中文档
+
+        Yields:
+            list: 一页hits
+        """
+        if self.mode == 'scroll':
+            return self._scroll_pages()
+
+        return self._search_after_pages()
+
+    def _scroll_pages(self):
+        scroll_id = None
+        try:
+            res = self.es.search(index=self.index,
+                                 body=self._body(['_doc']),
+                                 scroll=self.keep_alive,
+                                 **self._search_kwargs())
+            while True:
+                scroll_id = res.get('_scroll_id')
+                hits = res['hits']['hits']
+                if not hits:
+                    break
+                yield hits
+                res = self.es.scroll(scroll_id=scroll_id,
+                                     scroll=self.keep_alive)
+        finally:
+            if scroll_id:
+                try:
+                    self.es.clear_scroll(scroll_id=scroll_id)
+                except TransportError as e:
+                    lx_log.error(f'【es游标清理{self.index}】{e}')
+
+    def _search_after_pages(self):
+        pit_id = None
+        use_pit = hasattr(self.es, 'open_point_in_time')
+        search_after = None
+        try:
+            if use_pit:
+                pit_id = self.es.open_point_in_time(
+                    index=self.index, keep_alive=self.keep_alive)['id']
+                body = self._body([{'_shard_doc': 'asc'}])
+                if self.sort:
+                    body['sort'] = list(self.sort) + [{'_shard_doc': 'asc'}]
+            else:
+                # NOTE: 排序值相同的文档需唯一字段区分, es7已不建议按_id排序
+                tiebreaker = {self.tiebreaker: 'asc'}
+                body = self._body([tiebreaker])
+                if self.sort and tiebreaker not in self.sort:
+                    body['sort'] = list(self.sort) + [tiebreaker]
+
+            while True:
+                if use_pit:
+                    body['pit'] = {'id': pit_id, 'keep_alive': self.keep_alive}
+                if search_after is not None:
+                    body['search_after'] = search_after
+                res = self.es.search(index=None if use_pit else self.index,
+                                     body=body,
+                                     **self._search_kwargs())
+                pit_id = res.get('pit_id', pit_id)
+                hits = res['hits']['hits']
+                if not hits:
+                    break
+                yield hits
+                search_after = hits[-1]['sort']
+        finally:
+            if pit_id:
+                try:
+                    self.es.close_point_in_time(body={'id': pit_id})
+                except TransportError as e:
+                    lx_log.error(f'【es point in time关闭{self.index}】{e}')
+
+    def __iter__(self):
+        for page in self.pages():
+            yield from page
+
+    def iter_hits(self, prefetch=False):
+        """逐条返回命中文档
+
+        Args:
+            prefetch (bool, optional): 是否在后台线程预取下一页. Defaults to False.
+
+        Yields:
+            dict: 单条hit
+        """
+        if not prefetch:
+            return iter(self)
+
+        return iter_pages_in_background([self.pages()], maxsize=1)
+
+
+def iter_pages_in_background(page_iters, maxsize=1):
+    """在后台线程中拉取分页数据, 调用方处理当前页时下一页已在获取
+
+    每个分页迭代器各使用一个线程, 所有页汇总到一个有界队列中.
+    调用方提前停止迭代时, 后台线程会随之退出并清理游标.
+
+    Args:
+        page_iters (list): 分页迭代器列表
+        maxsize (int, optional): 预取的最大页数. Defaults to 1.
+
+    Yields:
+        dict: 单条hit
+    """
+    pages = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(message):
+        while not stop.is_set():
+            try:
+                pages.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(page_iter):
+        try:
+            for page in page_iter:
+                if not put((PAGE, page)):
+                    break
+        except Exception as e:
+            put((PAGE_ERROR, e))
+        finally:
+            page_iter.close()
+            put((PAGE_DONE, None))
+
+    threads = [threading.Thread(target=produce, args=(page_iter, ),
+                                daemon=True)
+               for page_iter in page_iters]
+    for thread in threads:
+        thread.start()
+
+    remaining = len(threads)
+    try:
+        while remaining:
+            kind, payload = pages.get()
+            if kind == PAGE:
+                yield from payload
+            elif kind == PAGE_ERROR:
+                raise payload
+            else:
+                remaining -= 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def parallel_scan(es, index, slices, **kwargs):
+    """切片并行遍历索引, 每个切片一个线程同时从es拉取
+
+    Args:
+        es (Elasticsearch): es客户端
+        index (str): 需要遍历的索引
+        slices (int): 切片数量
+        **kwargs: 传给ESScroller的其余参数
+
+    Yields:
+        dict: 单条hit, 不同切片间的文档顺序不确定
+    """
+    scrollers = [ESScroller(es, index, slice_id=slice_id, max_slices=slices,
+                            **kwargs)
+                 for slice_id in range(slices)]
+
+    return iter_pages_in_background([scroller.pages()
+                                     for scroller in scrollers],
+                                    maxsize=slices * 2)
+
+
+class ESReindexTask:
+    """零停机索引重建任务
+
+    按阶段推进: 创建新索引 -> 后台_reindex(限流, 切片) -> 原子切换别名.
+    每次进入新阶段都会把状态写入state_store, 进程崩溃后可通过load恢复,
+    继续轮询同一个es task, 不会重复迁移数据.
+    新任务需先claim(SET NX)占用别名, 结束(完成或失败)时释放.
+
+    Args:
+        connection (ESConnection): es连接
+        state_store (RedisUtil): 任务状态存储, 需提供get/set(nx)/delete
+        alias (str): 索引别名, 同时作为任务标识
+        old_index (str): 旧索引索引名
+        new_index (str): 新索引索引名
+        mappings (dict): 新索引文档字段映射关系
+        requests_per_second (int, optional): 迁移限流, -1为不限流.
+            Defaults to REINDEX_REQUESTS_PER_SECOND.
+        slices (int or str, optional): 迁移切片数. Defaults to 'auto'.
+    """
+
+    CREATING = 'creating'
+    REINDEXING = 'reindexing'
+    SWAPPING = 'swapping'
+    DONE = 'done'
+    FAILED = 'failed'
+    RUNNING_STAGES = (CREATING, REINDEXING, SWAPPING)
+
+    def __init__(self,
+                 connection,
+                 state_store,
+                 alias,
+                 old_index=None,
+                 new_index=None,
+                 mappings=None,
+                 requests_per_second=REINDEX_REQUESTS_PER_SECOND,
+                 slices='auto'):
+        self.connection = connection
+        self.state_store = state_store
+        self.alias = alias
+        self.old_index = old_index
+        self.new_index = new_index
+        self.mappings = mappings
+        self.requests_per_second = requests_per_second
+        self.slices = slices
+        self.stage = self.CREATING
+        self.task_id = None
+        self.progress = {}
+        self.error = None
+        # NOTE: 从状态存储恢复的任务, 新索引可能已由崩溃前的进程创建
+        self.resumed = False
+
+    @staticmethod
+    def state_key(alias):
+        return f'{REINDEX_STATE_PREFIX}{alias}'
+
+    @staticmethod
+    def lock_key(alias):
+        return f'{REINDEX_STATE_PREFIX}{alias}:lock'
+
+    @classmethod
+    def load(cls, connection, state_store, alias):
+        """从状态存储恢复任务
+
+        Args:
+            connection (ESConnection): es连接
+            state_store (RedisUtil): 任务状态存储
+            alias (str): 索引别名
+
+        Returns:
+            ESReindexTask or None: 不存在任务时返回None
+        """
+        state = state_store.get(cls.state_key(alias))
+        if not state:
+            return None
+
+        state = json.loads(state)
+        task = cls(connection, state_store, alias)
+        for field in ('old_index', 'new_index', 'mappings',
+                      'requests_per_second', 'slices', 'stage', 'task_id',
+                      'progress', 'error'):
+            setattr(task, field, state.get(field))
+        task.resumed = True
+
+        return task
+
+    @property
+    def is_running(self):
+        return self.stage in self.RUNNING_STAGES
+
+    def to_dict(self):
+        return {
+            'alias': self.alias,
+            'old_index': self.old_index,
+            'new_index': self.new_index,
+            'stage': self.stage,
+            'task_id': self.task_id,
+            'progress': self.progress,
+            'error': self.error,
+        }
+
+    def save(self):
+        state = self.to_dict()
+        state.update(mappings=self.mappings,
+                     requests_per_second=self.requests_per_second,
+                     slices=self.slices)
+        self.state_store.set(self.state_key(self.alias),
+                             json.dumps(state),
+                             REINDEX_STATE_EXPIRED_TIME)
+
+    def claim(self):
+        """占用别名的迁移任务, 同一别名同时只允许一个任务
+
+        Returns:
+            bool: 是否占用成功
+        """
+        return self.state_store.set(self.lock_key(self.alias), 1,
+                                    REINDEX_STATE_EXPIRED_TIME, nx=True)
+
+    def release(self):
+        self.state_store.delete(self.lock_key(self.alias))
+
+    def fail(self, error):
+        self.stage = self.FAILED
+        self.error = error
+        self.save()
+        self.release()
+        lx_log.error(f'【索引迁移{self.alias}】{error}')
+
+    @staticmethod
+    def _error_type(res):
+        try:
+            error = res.json().get('error')
+        except ValueError:
+            return res.text
+        return error.get('type') if isinstance(error, dict) else error
+
+    def advance(self):
+        """不阻塞地推进任务到下一个可达阶段
+
+        Returns:
+            str: 当前阶段
+        """
+        if self.stage == self.CREATING:
+            self._create_and_start()
+        if self.stage == self.REINDEXING:
+            self._poll()
+        if self.stage == self.SWAPPING:
+            self._swap_alias()
+
+        return self.stage
+
+    def wait(self, poll_interval=REINDEX_POLL_INTERVAL, timeout=None):
+        """阻塞直到任务完成或失败
+
+        Args:
+            poll_interval (float, optional): 轮询间隔秒数.
+                Defaults to REINDEX_POLL_INTERVAL.
+            timeout (float, optional): 最长等待秒数. Defaults to None.
+
+        Returns:
+            str: 当前阶段
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        while self.advance() in self.RUNNING_STAGES:
+            if deadline and time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+
+        return self.stage
+
+    def _create_and_start(self):
+        self.save()
+        exists = None
+        # NOTE: 只有恢复的任务才复用已存在的新索引, 新任务由PUT保证索引不存在
+        if self.resumed:
+            exists = self.connection.request('HEAD', self.new_index)
+            if exists is None:
+                return self.fail('索引迁移新索引创建失败: 连接网络错误')
+
+        if exists is None or exists.status_code != 200:
+            create_res = self.connection.request('PUT', self.new_index,
+                                                 data=self.mappings)
+            self.connection.metadata.invalidate()
+            if create_res is None or create_res.status_code != 200:
+                err_msg = (self._error_type(create_res)
+                           if create_res is not None else '连接网络错误')
+                return self.fail(f'索引迁移新索引创建失败: {err_msg}')
+
+        body = {
+            'source': {
+                'index': self.old_index
+            },
+            'dest': {
+                'index': self.new_index
+            }
+        }
+        reindex_res = self.connection.request(
+            'POST',
+            (f'_reindex?wait_for_completion=false'
+             f'&requests_per_second={self.requests_per_second}'
+             f'&slices={self.slices}'),
+            data=body)
+        if reindex_res is None or reindex_res.status_code != 200:
+            err_msg = ('数据迁移错误'
+                       if reindex_res is not None else '连接网络错误')
+            return self.fail(f'索引迁移数据迁移失败: {err_msg}')
+
+        self.task_id = reindex_res.json().get('task')
+        self.stage = self.REINDEXING
+        self.save()
+
+    def _poll(self):
+        res = self.connection.request('GET', f'_tasks/{self.task_id}')
+        if res is None:
+            # NOTE: 网络错误时保持当前阶段, 下次轮询重试
+            return
+        if res.status_code != 200:
+            return self.fail(f'索引迁移任务查询失败: {self._error_type(res)}')
+
+        info = res.json()
+        status = info.get('task', {}).get('status', {})
+        self.progress = {field: status.get(field)
+                         for field in ('total', 'created', 'updated',
+                                       'deleted', 'version_conflicts')}
+        if not info.get('completed'):
+            return self.save()
+
+        response = info.get('response', {})
+        if info.get('error') or response.get('failures'):
+            return self.fail('索引迁移数据迁移失败: 数据迁移错误')
+
+        self.stage = self.SWAPPING
+        self.save()
+
+    def _swap_alias(self):
+        # NOTE: 删除旧别名与添加新别名在同一个_aliases请求中原子完成
+        actions = {
+            'actions': [
+                {'remove': {'index': self.old_index, 'alias': self.alias}},
+                {'add': {'index': self.new_index, 'alias': self.alias}},
+            ]
+        }
+        res = self.connection.request('POST', '_aliases', data=actions)
+        self.connection.metadata.invalidate()
+        if res is None:
+            return
+        if res.status_code != 200:
+            return self.fail(f'索引迁移别名切换失败: {self._error_type(res)}')
+
+        self.stage = self.DONE
+        self.save()
+        self.release()
+
+
+class ESMetadataCache:
+    """es集群/索引元数据缓存
+
+    缓存索引集合, 别名映射及主节点ip, 过期(ttl)后下次访问时整体刷新;
+    创建/删除索引及别名操作后需调用invalidate使缓存失效.
+
+    Args:
+        connection (ESConnection): es连接
+        ttl (int, optional): 缓存有效期(秒). Defaults to ES_METADATA_TTL.
+    """
+
+    def __init__(self, connection, ttl=ES_METADATA_TTL):
+        self.connection = connection
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._expires_at = 0
+        self._indices = frozenset()
+        self._aliases = {}
+        self._master_node_ip = None
+
+    def invalidate(self):
+        self._expires_at = 0
+
+    def _cat(self, path):
+        res = self.connection.request('GET', f'_cat/{path}')
+        if res is None or res.status_code != 200:
+            return None
+        return res.json()
+
+    def _ensure_loaded(self):
+        """缓存过期时刷新
+
+        Returns:
+            bool: 缓存是否可用
+        """
+        if time.monotonic() < self._expires_at:
+            return True
+
+        with self._lock:
+            if time.monotonic() < self._expires_at:
+                return True
+
+            indices = self._cat('indices?format=json&h=index')
+            aliases = self._cat('aliases?format=json&h=alias,index')
+            master = self._cat('master?format=json&h=ip')
+            if indices is None or aliases is None:
+                lx_log.error('【es元数据查询】连接es网络错误')
+                return False
+
+            alias_map = {}
+            for row in aliases:
+                alias_map.setdefault(row['alias'], set()).add(row['index'])
+            self._indices = frozenset(row['index'] for row in indices)
+            self._aliases = {alias: frozenset(names)
+                             for alias, names in alias_map.items()}
+            self._master_node_ip = master[0].get('ip') if master else None
+            self._expires_at = time.monotonic() + self.ttl
+
+        return True
+
+    def index_exists(self, index, include_aliases=True):
+        """索引(或别名)是否存在
+
+        Args:
+            index (str): 索引名或别名
+            include_aliases (bool, optional): 别名是否视为存在.
+                Defaults to True.
+
+        Returns:
+            bool or None: 连接es失败时返回None
+        """
+        if not self._ensure_loaded():
+            return None
+
+        if index in self._indices:
+            return True
+
+        return include_aliases and index in self._aliases
+
+    def is_alias(self, name):
+        """名称是否为别名(而非实际索引)
+
+        Args:
+            name (str): 索引名或别名
+
+        Returns:
+            bool or None: 连接es失败时返回None
+        """
+        if not self._ensure_loaded():
+            return None
+
+        return name in self._aliases
+
+    def alias_indices(self, alias):
+        """获取别名指向的索引集合
+
+        Args:
+            alias (str): 索引别名
+
+        Returns:
+            frozenset or None: 连接es失败时返回None
+        """
+        if not self._ensure_loaded():
+            return None
+
+        return self._aliases.get(alias, frozenset())
+
+    @property
+    def master_node_ip(self):
+        if not self._ensure_loaded():
+            return None
+
+        return self._master_node_ip
@@ -0,0 +1,233 @@
+"""流式导出csv/xlsx
+
+数据源可以是queryset或任意可迭代对象(行为dict/list/tuple), 按块读取并逐块输出,
+导出百万行数据时内存占用保持不变.
+"""
+import csv
+import json
+import queue
+import tempfile
+import threading
+from datetime import datetime
+from uuid import UUID
+
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .constants import (EXPORT_CHUNK_SIZE, EXPORT_STREAM_BUFFER,
+                        EXPORT_THREAD_POLL_INTERVAL, EXPORT_THREAD_QUEUE_SIZE)
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    # NOTE: 导出xlsx需要安装openpyxl
+    Workbook = None
+
+CSV_BOM = '﻿'
+
+
+class Echo:
+    """csv.writer的伪文件对象, write直接返回写入内容
+    """
+
+    def write(self, value):
+        return value
+
+
+class ExportHelper:
+
+    @staticmethod
+    def iter_queryset(queryset, fields=None, chunk_size=EXPORT_CHUNK_SIZE):
+        """分块读取queryset, 逐行返回字段值列表
+
+        sqlite/postgresql等支持流式读取的数据库使用iterator(chunk_size)
+        (postgresql为服务端游标); mysqlclient会把结果集整体缓存在客户端,
+        因此指定了fields时mysql按主键分批查询(按主键排序).
+
+        Args:
+            queryset (QuerySet): 查询集
+            fields (iterable, optional): 导出字段. Defaults to None.
+                为None时queryset需已调用values()/values_list()
+            chunk_size (int, optional): 每批行数. Defaults to EXPORT_CHUNK_SIZE.
+
+        Yields:
+            list or tuple: 行数据
+        """
+        if fields is None or connections[queryset.db].vendor != 'mysql':
+            if fields is not None:
+                # NOTE: 绕过DisplayQuerySet.values_list追加的默认展示字段
+                queryset = QuerySet.values_list(queryset, *fields)
+            yield from queryset.iterator(chunk_size=chunk_size)
+            return
+
+        # NOTE: 额外取出主键用于分批, 输出时去掉
+        keyed = QuerySet.values_list(queryset, 'pk', *fields).order_by('pk')
+        last_pk = None
+        while True:
+            batch = keyed if last_pk is None else keyed.filter(pk__gt=last_pk)
+            rows = list(batch[:chunk_size])
+            if not rows:
+                return
+            for row in rows:
+                yield row[1:]
+            last_pk = rows[-1][0]
+
+    @staticmethod
+    def iter_rows(source, fields=None, chunk_size=EXPORT_CHUNK_SIZE):
+        """统一数据源为字段值列表
+
+        Args:
+            source (QuerySet or iterable): 数据源, 行为dict/list/tuple
+            fields (iterable, optional): 导出字段, 行为dict时按字段取值.
+                Defaults to None(使用第一行的key).
+            chunk_size (int, optional): queryset每批行数.
+                Defaults to EXPORT_CHUNK_SIZE.
+
+        Yields:
+            list or tuple: 行数据
+        """
+        if isinstance(source, QuerySet):
+            source = ExportHelper.iter_queryset(source, fields, chunk_size)
+            fields = None
+
+        for row in source:
+            if isinstance(row, dict):
+                if fields is None:
+                    fields = tuple(row)
+                yield [row.get(field) for field in fields]
+            else:
+                yield row
+
+    @staticmethod
+    def iter_csv(rows, headers=None):
+        """逐块编码csv, 带BOM头(兼容excel打开中文)
+
+        Args:
+            rows (iterable): 行数据(字段值列表)
+            headers (list, optional): 表头. Defaults to None.
+
+        Yields:
+            bytes: csv数据块
+        """
+        writer = csv.writer(Echo())
+        buffer = [CSV_BOM]
+        size = 0
+        if headers:
+            buffer.append(writer.writerow(headers))
+
+        for row in rows:
+            line = writer.writerow(row)
+            buffer.append(line)
+            size += len(line)
+            # NOTE: 合并多行再输出, 减少响应分块数量
+            if size >= EXPORT_STREAM_BUFFER:
+                yield ''.join(buffer).encode('utf-8')
+                buffer = []
+                size = 0
+
+        if buffer:
+            yield ''.join(buffer).encode('utf-8')
+
+    @staticmethod
+    def xlsx_value(value):
+        if isinstance(value, datetime) and timezone.is_aware(value):
+            # NOTE: excel不支持带时区的时间
+            return timezone.make_naive(value)
+        if isinstance(value, UUID):
+            return str(value)
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+
+        return value
+
+    @staticmethod
+    def iter_xlsx(rows, headers=None, sheet_name='Sheet1'):
+        """以openpyxl write_only模式逐行写入xlsx, 再分块输出
+
+        write_only模式下行数据直接写入临时文件, 内存占用与行数无关;
+        xlsx是zip格式, 需写完后才能输出, 因此先落盘到临时文件.
+
+        Args:
+            rows (iterable): 行数据(字段值列表)
+            headers (list, optional): 表头. Defaults to None.
+            sheet_name (str, optional): 工作表名称. Defaults to 'Sheet1'.
+
+        Yields:
+            bytes: xlsx文件数据块
+        """
+        if Workbook is None:
+            raise ImportError('导出xlsx需要安装openpyxl')
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(sheet_name)
+        if headers:
+            sheet.append(headers)
+        xlsx_value = ExportHelper.xlsx_value
+        for row in rows:
+            sheet.append([xlsx_value(value) for value in row])
+
+        with tempfile.TemporaryFile() as tmp:
+            workbook.save(tmp)
+            tmp.seek(0)
+            while True:
+                chunk = tmp.read(EXPORT_STREAM_BUFFER)
+                if not chunk:
+                    return
+                yield chunk
+
+    @staticmethod
+    def iter_in_thread(chunks, maxsize=EXPORT_THREAD_QUEUE_SIZE):
+        """在后台线程中迭代数据块, 通过有界队列逐块返回
+
+        django 3.2的ASGIHandler在事件循环中同步迭代StreamingHttpResponse,
+        直接迭代queryset.iterator()会抛出SynchronousOnlyOperation.
+        数据库查询放到后台线程中执行, 事件循环只从队列中取已生成的数据块.
+        响应关闭(客户端断开)时通知后台线程停止.
+
+        Args:
+            chunks (iterable): 数据块迭代器
+            maxsize (int, optional): 预读数据块数量.
+                Defaults to EXPORT_THREAD_QUEUE_SIZE.
+
+        Yields:
+            bytes: 数据块
+        """
+        chunk_queue = queue.Queue(maxsize)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    chunk_queue.put(item, timeout=EXPORT_THREAD_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+
+            return False
+
+        def produce():
+            try:
+                for chunk in chunks:
+                    if not put((chunk, None)):
+                        return
+                put((None, None))
+            except Exception as e:
+                put((None, e))
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+                # NOTE: 后台线程使用独立的数据库连接, 结束时关闭
+                connections.close_all()
+
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                chunk, error = chunk_queue.get()
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            stopped.set()
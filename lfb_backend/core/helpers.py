@@ -1,4 +1,7 @@
-from datetime import datetime, timedelta
+import base64
+import binascii
+import json
+from datetime import date, datetime, time, timedelta
 
 from dateutil.relativedelta import relativedelta
 from django.forms.models import model_to_dict
@@ -296,6 +299,53 @@ class QuerySetHelper:
         return dict_obj
 
 
+class CursorHelper:
+    """键集分页游标: (排序字段值, 主键, 是否向前翻页) 编码为url安全的base64
+    """
+
+    @staticmethod
+    def _default(value):
+        # NOTE: 不使用DjangoJSONEncoder, 其时间只保留到毫秒, 会导致游标位置偏移
+        if isinstance(value, (date, datetime, time)):
+            return value.isoformat()
+
+        return str(value)
+
+    @staticmethod
+    def encode(value, pk, backward=False):
+        """
+        Args:
+            value (any): 排序字段值
+            pk (any): 主键
+            backward (bool, optional): 是否向前翻页. Defaults to False.
+
+        Returns:
+            str: 游标
+        """
+        raw = json.dumps([value, pk, int(backward)],
+                         default=CursorHelper._default,
+                         separators=(',', ':'))
+
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode(cursor):
+        """
+        Returns:
+            tuple: (排序字段值, 主键, 是否向前翻页)
+
+        Raises:
+            ValueError: 游标无效
+        """
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            value, pk, backward = json.loads(raw)
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+            raise ValueError(f'无效的分页游标: {cursor}')
+
+        return value, pk, bool(backward)
+
+
 class ListOperation:
 
     @staticmethod
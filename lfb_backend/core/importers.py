@@ -0,0 +1,139 @@
+"""上传文件(csv/xls/xlsx)批量导入
+
+按行流式读取上传文件, 以表头映射为参数名后逐批返回, 配合
+RequestSchema.validate_many 按列批量校验, 整个文件不会一次性载入为行对象.
+"""
+import codecs
+import csv
+import os
+from itertools import islice
+
+from .constants import IMPORT_BATCH_SIZE
+from .errors import DataError
+
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    # NOTE: 导入xlsx需要安装openpyxl
+    load_workbook = None
+
+try:
+    import xlrd
+except ImportError:
+    xlrd = None
+
+IMPORT_FILE_TYPES = ('csv', 'xls', 'xlsx')
+
+
+class ImportHelper:
+
+    @staticmethod
+    def file_type(file_name):
+        """根据文件名获取文件类型
+
+        Raises:
+            DataError: 不支持的文件类型
+        """
+        file_type = os.path.splitext(file_name or '')[1].lstrip('.').lower()
+        if file_type not in IMPORT_FILE_TYPES:
+            raise DataError(f'不支持的文件类型: {file_type or file_name}')
+
+        return file_type
+
+    @staticmethod
+    def iter_csv(file):
+        """逐行读取csv, 兼容带BOM的utf-8文件(excel另存为csv)
+        """
+        lines = codecs.iterdecode(file, 'utf-8-sig')
+        try:
+            yield from csv.reader(lines)
+        except UnicodeDecodeError:
+            raise DataError('csv文件需使用utf-8编码')
+
+    @staticmethod
+    def iter_xlsx(file):
+        """openpyxl read_only模式逐行读取第一个工作表
+        """
+        if load_workbook is None:
+            raise DataError('导入xlsx需要安装openpyxl')
+
+        try:
+            workbook = load_workbook(file, read_only=True, data_only=True)
+        except Exception as e:
+            raise DataError(f'xlsx文件解析失败: {e}')
+        try:
+            yield from workbook.worksheets[0].iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def iter_xls(file):
+        """xlrd读取第一个工作表
+
+        NOTE: xls为二进制复合文档格式, 无法流式解析, 需整体读入
+        """
+        if xlrd is None:
+            raise DataError('导入xls需要安装xlrd')
+
+        try:
+            workbook = xlrd.open_workbook(file_contents=file.read(),
+                                          on_demand=True)
+        except xlrd.XLRDError as e:
+            raise DataError(f'xls文件解析失败: {e}')
+        try:
+            sheet = workbook.sheet_by_index(0)
+            for index in range(sheet.nrows):
+                yield sheet.row_values(index)
+        finally:
+            workbook.release_resources()
+
+    @staticmethod
+    def iter_records(file, columns):
+        """按表头将上传文件的每行转换为dict, 跳过空行
+
+        Args:
+            file (UploadedFile): 上传文件
+            columns (dict): {表头: 参数名}, 表头不区分首尾空格
+
+        Yields:
+            tuple: (文件行号, 行数据dict), 行号从1开始(表头为第1行)
+
+        Raises:
+            DataError: 文件类型不支持/无法解析/缺少表头
+        """
+        file_type = ImportHelper.file_type(file.name)
+        rows = getattr(ImportHelper, f'iter_{file_type}')(file)
+
+        header = next(rows, None)
+        if not header:
+            raise DataError('文件为空')
+        keys = [columns.get(str(label).strip()) if label is not None else None
+                for label in header]
+        missing = set(columns.values()).difference(keys)
+        fields = [(index, key) for index, key in enumerate(keys) if key]
+        if not fields:
+            raise DataError(f'文件缺少表头: {sorted(missing)}')
+
+        for line, row in enumerate(rows, 2):
+            record = {}
+            for index, key in fields:
+                value = row[index] if index < len(row) else None
+                if value.__class__ is str:
+                    value = value.strip()
+                record[key] = value
+            if any(value not in (None, '') for value in record.values()):
+                yield line, record
+
+    @staticmethod
+    def batched(iterable, size=IMPORT_BATCH_SIZE):
+        """按size分批
+
+        Yields:
+            list: 每批数据
+        """
+        iterator = iter(iterable)
+        while True:
+            batch = list(islice(iterator, size))
+            if not batch:
+                return
+            yield batch
@@ -1,32 +1,125 @@
-from re import compile
+import asyncio
+import re
+import time
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
+from core.constants import (SESSION_REFRESH_FRACTION, SESSION_REFRESHED_KEY,
+                            SESSION_SLIDING_EXPIRY)
 from core.mixins.response import ResponseMixin
 
-LOGIN_EXEMPT_URLS = []
 
-if hasattr(settings, 'LOGIN_EXEMPT_URLS'):
-    LOGIN_EXEMPT_URLS += [compile(expr) for expr in settings.LOGIN_EXEMPT_URLS]
+def compile_url_patterns(exprs):
+    """将多个url正则合并编译为一个分支正则, 一次match完成匹配
 
+    Args:
+        exprs (iterable): url正则列表
 
-class LoginRequiredMiddleware(ResponseMixin):
+    Returns:
+        Pattern: 列表为空时返回不匹配任何url的正则
+    """
+    return re.compile('|'.join(f'(?:{expr})' for expr in exprs) or '(?!)')
+
+
+def resolve_user(request):
+    """加载request.user(AuthenticationMiddleware设置的惰性对象)
+
+    async中间件需要通过sync_to_async调用, 后续访问request.user不再查询数据库
+    """
+    return request.user.is_authenticated
+
+
+LOGIN_EXEMPT_URLS = compile_url_patterns(
+    getattr(settings, 'LOGIN_EXEMPT_URLS', ()))
+SLIDING_EXPIRY = getattr(settings, 'SESSION_SLIDING_EXPIRY',
+                         SESSION_SLIDING_EXPIRY)
+# NOTE: 距上次续期超过该秒数才续期, 避免每个请求都写session
+REFRESH_AFTER = SLIDING_EXPIRY * getattr(settings, 'SESSION_REFRESH_FRACTION',
+                                         SESSION_REFRESH_FRACTION)
+
+
+class AsyncCapableMiddleware:
+    """同时支持WSGI(uwsgi)和ASGI(daphne)的中间件基类
+
+    下游是协程时(ASGI)走async_call, 否则走sync_call, 避免django为中间件
+    额外做sync_to_async线程切换.
+    """
+
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # NOTE: 标记实例为协程函数, django据此以await方式调用
+            self._is_coroutine = asyncio.coroutines._is_coroutine
 
     def __call__(self, request):
-        assert hasattr(request, 'user')
+        if self.is_async:
+            return self.async_call(request)
+
+        return self.sync_call(request)
+
+    def sync_call(self, request):
+        raise NotImplementedError
+
+    async def async_call(self, request):
+        raise NotImplementedError
 
-        path = request.path_info.lstrip('/')
 
-        if not request.user.is_authenticated:
-            if not any(m.match(path) for m in LOGIN_EXEMPT_URLS):
-                self.success = False
-                self.status = '10007'
+class LoginRequiredMiddleware(AsyncCapableMiddleware):
 
-                return self.get_json_response()
+    def sync_call(self, request):
+        assert hasattr(request, 'user')
 
-        request.session.set_expiry(3600)
+        response = self.check(request, request.user.is_authenticated)
+        if response is not None:
+            return response
 
         return self.get_response(request)
+
+    async def async_call(self, request):
+        assert hasattr(request, 'user')
+
+        is_authenticated = await sync_to_async(resolve_user)(request)
+        response = self.check(request, is_authenticated)
+        if response is not None:
+            return response
+
+        return await self.get_response(request)
+
+    def check(self, request, is_authenticated):
+        """校验登录状态, 已登录时按需续期session
+
+        Returns:
+            HttpResponse or None: 未登录且非豁免url时返回错误response
+        """
+        if not is_authenticated:
+            if not LOGIN_EXEMPT_URLS.match(request.path_info.lstrip('/')):
+                # NOTE: 每次新建response状态, 中间件实例在请求间共享
+                response = ResponseMixin()
+                response.success = False
+                response.status = '10007'
+
+                return response.get_json_response()
+
+            return None
+
+        self.refresh_session(request.session)
+
+        return None
+
+    @staticmethod
+    def refresh_session(session):
+        """滑动过期: 只有session已过去一定比例的有效期时才续期
+
+        Args:
+            session (SessionBase): 当前请求的session
+        """
+        now = int(time.time())
+        refreshed_at = session.get(SESSION_REFRESHED_KEY)
+        if refreshed_at is None or now - refreshed_at >= REFRESH_AFTER:
+            session[SESSION_REFRESHED_KEY] = now
+            session.set_expiry(SLIDING_EXPIRY)
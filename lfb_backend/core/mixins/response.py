@@ -1,7 +1,20 @@
 """通用Http Response处理模块
 """
-from any_case import converts_keys
-from django.http import HttpResponse, JsonResponse
+import asyncio
+from functools import update_wrapper
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+
+from core.constants import EXPORT_CHUNK_SIZE, PAGE_SIZE
+from core.exporters import ExportHelper
+from core.renderers import JSONRenderer
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': ('application/vnd.openxmlformats-officedocument'
+             '.spreadsheetml.sheet'),
+}
 
 
 class ResponseMixin:
@@ -43,7 +56,7 @@ class ResponseMixin:
 
     @property
     def msg(self):
-        return self.msg
+        return self._msg
 
     @msg.setter
     def msg(self, value):
@@ -58,9 +71,42 @@ class ResponseMixin:
         kwargs['msg'] = self.msg
         kwargs['data'] = (None
                           if not args
-                          else converts_keys(args[0], case='camel'))
+                          else JSONRenderer.camelize(args[0]))
+
+        return JSONRenderer.response(kwargs)
+
+    def get_page_response(self,
+                          queryset,
+                          cursor=None,
+                          order_field='created',
+                          order=1,
+                          page_size=PAGE_SIZE,
+                          count=None):
+        """获取键集分页的JSON Response, 参数见FilterQuerySet.keyset_paginate
+
+        响应中额外返回nextCursor/prevCursor(没有下一页/上一页时为null),
+        count不为None时返回total
+
+        Args:
+            queryset (QuerySet): 继承FilterQuerySet的查询集
+        """
+        try:
+            page = queryset.keyset_paginate(cursor=cursor,
+                                            order_field=order_field,
+                                            order=order,
+                                            page_size=page_size,
+                                            count=count)
+        except ValueError as e:
+            self.success = False
+            self.status = '10002'
+            self.msg = e.args[0]
+            return self.get_json_response()
+
+        extra = {'nextCursor': page['next'], 'prevCursor': page['prev']}
+        if 'total' in page:
+            extra['total'] = page['total']
 
-        return JsonResponse(kwargs)
+        return self.get_json_response(page['rows'], **extra)
 
     def get_download_response(self, file_name, file_type):
         """获取csv Response
@@ -74,3 +120,74 @@ class ResponseMixin:
                                        .format(file_name, file_type))
         resp.write(u'\ufeff'.encode('utf8'))
         return resp
+
+    def get_streaming_download_response(self, file_name, source, headers=None,
+                                        fields=None, file_type='csv',
+                                        chunk_size=EXPORT_CHUNK_SIZE):
+        """获取流式下载Response, 边查询边输出, 内存占用与导出行数无关
+
+        ASGI(daphne)下查询和编码在后台线程中执行, 见ExportHelper.iter_in_thread
+
+        Examples:
+            queryset = Role.object_list.filter(is_deleted=False)
+            return self.get_streaming_download_response(
+                'role', queryset, headers=['名称', '描述'],
+                fields=['name', 'description'])
+
+        Args:
+            file_name (str): 文件名
+            source (QuerySet or iterable): 数据源, queryset或生成器,
+                行为dict/list/tuple
+            headers (list, optional): 表头. Defaults to None.
+            fields (list, optional): 导出字段. Defaults to None.
+            file_type (str, optional): csv/xlsx. Defaults to 'csv'.
+            chunk_size (int, optional): queryset每批读取行数.
+                Defaults to EXPORT_CHUNK_SIZE.
+
+        Returns:
+            StreamingHttpResponse
+        """
+        rows = ExportHelper.iter_rows(source, fields, chunk_size)
+        if file_type == 'xlsx':
+            content = ExportHelper.iter_xlsx(rows, headers)
+        else:
+            file_type = 'csv'
+            content = ExportHelper.iter_csv(rows, headers)
+        if isinstance(getattr(self, 'request', None), ASGIRequest):
+            content = ExportHelper.iter_in_thread(content)
+
+        resp = StreamingHttpResponse(
+            content, content_type=EXPORT_CONTENT_TYPES[file_type])
+        resp['Content-Disposition'] = ('attachment; filename="{}.{}"'
+                                       .format(file_name, file_type))
+        return resp
+
+
+class AsyncResponseMixin(ResponseMixin):
+    """async视图基类, 与django View一起使用, 处理方法定义为async def
+
+    Examples:
+        class UserDetail(AsyncResponseMixin, View):
+
+            async def post(self, request):
+                ...
+                return self.get_json_response(data)
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            # NOTE: http_method_not_allowed/options等默认处理方法是同步的
+            if asyncio.iscoroutine(response):
+                response = await response
+
+            return response
+
+        update_wrapper(async_view, view, updated=())
+        async_view.view_class = view.view_class
+        async_view.view_initkwargs = view.view_initkwargs
+
+        return async_view
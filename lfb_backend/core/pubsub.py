@@ -0,0 +1,341 @@
+"""进程内redis订阅分发中心
+
+每个进程只保留一个redis pubsub连接, 由后台线程读取消息后分发给本进程内的
+多个订阅者(线程或asyncio), 每个订阅者使用有界队列, 消费过慢时丢弃最旧的消息.
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+from log.log import lx_log
+
+from .constants import (PUBSUB_POLL_INTERVAL, PUBSUB_QUEUE_SIZE,
+                        PUBSUB_RECONNECT_INTERVAL)
+
+
+class Subscription:
+    """线程订阅者
+
+    Args:
+        hub (PubSubHub): 所属分发中心
+        channels (tuple): 订阅的频道
+        patterns (tuple): 订阅的频道模式
+        maxsize (int): 消息队列长度
+    """
+
+    def __init__(self, hub, channels, patterns, maxsize):
+        self.hub = hub
+        self.channels = tuple(channels)
+        self.patterns = tuple(patterns)
+        self.maxsize = maxsize
+        self.delivered = 0
+        self.dropped = 0
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def deliver(self, message):
+        """由分发线程调用, 队列已满时丢弃最旧的消息
+        """
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                self.delivered += 1
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """获取下一条消息
+
+        Args:
+            timeout (float, optional): 最长等待秒数. Defaults to None.
+
+        Returns:
+            dict or None: 消息, 包含type/pattern/channel/data, 超时返回None
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __iter__(self):
+        while True:
+            yield self.queue.get()
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+
+class AsyncSubscription(Subscription):
+    """asyncio订阅者, 需在事件循环中创建(如channels consumer)
+    """
+
+    def __init__(self, hub, channels, patterns, maxsize):
+        super().__init__(hub, channels, patterns, maxsize)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._deliver_nowait, message)
+        except RuntimeError:
+            # NOTE: 事件循环已关闭, 订阅者不再消费
+            self.close()
+
+    def _deliver_nowait(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+        self.delivered += 1
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def __iter__(self):
+        raise TypeError('AsyncSubscription请使用async for遍历')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+
+class PubSubHub:
+    """进程内订阅分发中心
+
+    redis pubsub连接不是线程安全的, 订阅/退订命令统一放入命令队列,
+    由监听线程在读取消息的间隙执行.
+
+    Args:
+        client (redis.Redis): redis客户端
+    """
+
+    _lock = threading.Lock()
+    _hubs = {}
+
+    def __init__(self, client):
+        self.client = client
+        self.pubsub = None
+        self._channels = {}
+        self._patterns = {}
+        self._lock = threading.Lock()
+        self._commands = queue.Queue()
+        self._thread = None
+        self.stats = {'received': 0, 'reconnects': 0}
+
+    @classmethod
+    def get(cls, redis_util):
+        """获取redis_util所在连接池对应的分发中心
+
+        Args:
+            redis_util (RedisUtil): redis连接
+
+        Returns:
+            PubSubHub
+        """
+        key = id(redis_util.conn_client)
+        hub = cls._hubs.get(key)
+        if hub is None:
+            with cls._lock:
+                hub = cls._hubs.get(key)
+                if hub is None:
+                    hub = cls(redis_util.conn_client)
+                    cls._hubs[key] = hub
+
+        return hub
+
+    @classmethod
+    def reset(cls):
+        """fork后的子进程不继承父进程的分发线程和连接
+        """
+        cls._lock = threading.Lock()
+        cls._hubs = {}
+
+    def subscribe(self, channels=(), patterns=(),
+                  maxsize=PUBSUB_QUEUE_SIZE):
+        """线程订阅
+
+        Args:
+            channels (str or iterable, optional): 频道. Defaults to ().
+            patterns (str or iterable, optional): 频道模式. Defaults to ().
+            maxsize (int, optional): 消息队列长度.
+                Defaults to PUBSUB_QUEUE_SIZE.
+
+        Returns:
+            Subscription
+        """
+        return self._add(Subscription, channels, patterns, maxsize)
+
+    def subscribe_async(self, channels=(), patterns=(),
+                        maxsize=PUBSUB_QUEUE_SIZE):
+        """asyncio订阅, 需在事件循环中调用
+
+        Returns:
+            AsyncSubscription
+        """
+        return self._add(AsyncSubscription, channels, patterns, maxsize)
+
+    def _add(self, subscription_class, channels, patterns, maxsize):
+        channels = (channels, ) if isinstance(channels, str) else channels
+        patterns = (patterns, ) if isinstance(patterns, str) else patterns
+        subscription = subscription_class(self, channels, patterns, maxsize)
+
+        with self._lock:
+            for channel in subscription.channels:
+                if channel not in self._channels:
+                    self._channels[channel] = set()
+                    self._commands.put(('subscribe', channel))
+                self._channels[channel].add(subscription)
+            for pattern in subscription.patterns:
+                if pattern not in self._patterns:
+                    self._patterns[pattern] = set()
+                    self._commands.put(('psubscribe', pattern))
+                self._patterns[pattern].add(subscription)
+            self._ensure_listening()
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """退订, 频道没有本地订阅者时才真正向redis退订
+
+        Args:
+            subscription (Subscription): 订阅者
+        """
+        with self._lock:
+            for names, registry, command in (
+                    (subscription.channels, self._channels, 'unsubscribe'),
+                    (subscription.patterns, self._patterns, 'punsubscribe')):
+                for name in names:
+                    subscribers = registry.get(name)
+                    if subscribers is None:
+                        continue
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del registry[name]
+                        self._commands.put((command, name))
+
+    def metrics(self):
+        """背压指标
+
+        Returns:
+            dict: 频道数, 订阅者数, 各订阅者累计投递/丢弃数及最大队列深度
+        """
+        with self._lock:
+            subscriptions = set()
+            for subscribers in self._channels.values():
+                subscriptions.update(subscribers)
+            for subscribers in self._patterns.values():
+                subscriptions.update(subscribers)
+            channel_count = len(self._channels)
+            pattern_count = len(self._patterns)
+
+        return {
+            'channels': channel_count,
+            'patterns': pattern_count,
+            'subscribers': len(subscriptions),
+            'received': self.stats['received'],
+            'reconnects': self.stats['reconnects'],
+            'delivered': sum(sub.delivered for sub in subscriptions),
+            'dropped': sum(sub.dropped for sub in subscriptions),
+            'max_depth': max((sub.depth for sub in subscriptions), default=0),
+        }
+
+    def _ensure_listening(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._listen, daemon=True)
+            self._thread.start()
+
+    def _connect(self):
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        # NOTE: 重连时重新订阅全部频道, 之前排队的命令已包含在内
+        with self._lock:
+            self._commands = queue.Queue()
+            channels = list(self._channels)
+            patterns = list(self._patterns)
+        if channels:
+            self.pubsub.subscribe(*channels)
+        if patterns:
+            self.pubsub.psubscribe(*patterns)
+
+    def _run_commands(self):
+        while True:
+            try:
+                command, name = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            getattr(self.pubsub, command)(name)
+
+    def _dispatch(self, message):
+        self.stats['received'] += 1
+        if message['type'] == 'pmessage':
+            registry, name = self._patterns, message['pattern']
+        else:
+            registry, name = self._channels, message['channel']
+        # NOTE: 不解码的客户端(decode=False)收到的频道名为bytes
+        if isinstance(name, bytes):
+            name = name.decode()
+        with self._lock:
+            subscribers = tuple(registry.get(name, ()))
+        for subscription in subscribers:
+            # NOTE: 单个订阅者出错不影响其他订阅者及监听线程
+            try:
+                subscription.deliver(message)
+            except Exception as e:
+                lx_log.error(f'【redis订阅消息分发失败】{name}: {e}')
+
+    def _listen(self):
+        connected = False
+        while True:
+            try:
+                if not connected:
+                    self._connect()
+                    connected = True
+                self._run_commands()
+                if not self.pubsub.subscribed:
+                    time.sleep(PUBSUB_POLL_INTERVAL)
+                    continue
+                message = self.pubsub.get_message(
+                    timeout=PUBSUB_POLL_INTERVAL)
+                if message and message['type'] in ('message', 'pmessage'):
+                    self._dispatch(message)
+            except RedisError as e:
+                # NOTE: 连接断开或命令错误(ResponseError)后连接状态不可信, 重连
+                lx_log.error(f'【redis订阅连接断开】{e}')
+                connected = False
+                self.stats['reconnects'] += 1
+                try:
+                    if self.pubsub is not None:
+                        self.pubsub.close()
+                except Exception:
+                    pass
+                time.sleep(PUBSUB_RECONNECT_INTERVAL)
+            except Exception as e:
+                # NOTE: 监听线程退出后只有新的subscribe才会重启, 记录后继续监听
+                lx_log.error(f'【redis订阅监听异常】{e}')
+                time.sleep(PUBSUB_POLL_INTERVAL)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=PubSubHub.reset)
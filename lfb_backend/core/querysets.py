@@ -1,8 +1,29 @@
-from datetime import datetime
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, transaction
+from django.db.models import (Case, CharField, F, Q, QuerySet, Value, When,
+                              signals, sql)
+from django.db.models.functions import Cast, Concat
+from django.dispatch import Signal
+from django.utils import timezone
 
-from django.db.models import QuerySet
+from core.constants import (IMPORT_BATCH_SIZE, MAX_PAGE_SIZE, PAGE_SIZE,
+                            UPDATE_BATCH_SIZE)
+from core.helpers import CursorHelper, DateTimeHelper
+from core.search import get_search_backend
 
-from core.helpers import DateTimeHelper
+# NOTE: update_by_ids批量更新后(事务提交后)发送, kwargs: ids, fields
+bulk_updated = Signal()
+
+
+def supports_update_returning(connection):
+    """数据库是否支持UPDATE/INSERT ... RETURNING
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+
+    return False
 
 
 class DateTimeQuerySet(QuerySet):
@@ -81,12 +102,211 @@ class DisplayQuerySet(QuerySet):
 class CRUDQuerySet(QuerySet):
 
     def create_with_name_check(self, **kwargs):
-        """创建时校验数据库中是否存在同名记录
+        """创建时校验数据库中是否存在同名记录(依赖name唯一约束)
         """
-        name = kwargs.get('name')
-        if not self.filter(name=name).exists():
+        return self.create_if_absent('name', **kwargs)
 
-            return super().create(**kwargs)
+    def create_if_absent(self, unique_field, **kwargs):
+        """单条语句创建记录, unique_field冲突时不创建
+
+        NOTE: 由数据库唯一约束保证并发下不会重复创建, 不需要先exists()查询
+
+        Args:
+            unique_field (str): 带唯一约束的字段名
+
+        Returns:
+            model obj: 创建的model对象, 已存在时返回None
+        """
+        obj = self.model(**kwargs)
+        row = {field.attname: field.pre_save(obj, True)
+               for field in self.model._meta.local_concrete_fields
+               if not (field.primary_key and obj.pk is None)}
+
+        pk = self.insert_ignore([row], unique_field)[0]
+        if pk is None:
+            return None
+
+        obj.pk = pk
+        obj._state.adding = False
+        obj._state.db = self.db
+        signals.post_save.send(sender=self.model, instance=obj, created=True,
+                               update_fields=None, raw=False,
+                               using=self.db)
+
+        return obj
+
+    def _insert_plan(self, keys, defaults):
+        """插入语句的字段: rows中的字段逐行转换, 其余字段只转换一次
+        """
+        connection = connections[self.db]
+        now = timezone.now()
+        row_fields = []
+        const_fields = []
+        const_values = []
+        for field in self.model._meta.local_concrete_fields:
+            if field.attname in keys:
+                row_fields.append(field)
+                continue
+            if field.primary_key:
+                continue
+            if field.attname in defaults:
+                value = defaults[field.attname]
+            elif (getattr(field, 'auto_now', False)
+                  or getattr(field, 'auto_now_add', False)):
+                value = now
+            else:
+                value = field.get_default()
+            const_fields.append(field)
+            const_values.append(field.get_db_prep_save(value, connection))
+
+        preps = [(field.attname, field.get_db_prep_save)
+                 for field in row_fields]
+
+        def prepare(row):
+            return ([prep(row[attname], connection)
+                     for attname, prep in preps] + const_values)
+
+        return connection, row_fields + const_fields, prepare, now
+
+    def _insert_sql(self, connection, fields, rows=1, ignore_field=None):
+        quote_name = connection.ops.quote_name
+        opts = self.model._meta
+        columns = ', '.join(quote_name(field.column) for field in fields)
+        values = ', '.join(['({})'.format(', '.join(['%s'] * len(fields)))]
+                           * rows)
+        sql = (f'INSERT INTO {quote_name(opts.db_table)} ({columns}) '
+               f'VALUES {values}')
+        if ignore_field is None:
+            return sql
+
+        pk_column = quote_name(opts.pk.column)
+        if connection.vendor == 'mysql':
+            # NOTE: 不使用INSERT IGNORE, 它会把非空/截断/外键等错误也降级为警告
+            return f'{sql} ON DUPLICATE KEY UPDATE {pk_column} = {pk_column}'
+
+        unique_column = quote_name(opts.get_field(ignore_field).column)
+        return (f'{sql} ON CONFLICT DO NOTHING '
+                f'RETURNING {pk_column}, {unique_column}')
+
+    def bulk_insert(self, rows, batch_size=IMPORT_BATCH_SIZE, **defaults):
+        """以executemany批量插入行数据
+
+        NOTE: bulk_create会为每个对象的每个字段编译SQL参数, 十万行级别的导入
+              大部分时间花在ORM上; 这里按列处理, 未传入的字段(默认值、
+              auto_now时间、defaults)只转换一次. 不回填主键, 不触发信号
+
+        Args:
+            rows (list): 行数据dict, key为字段名, 每行key相同
+            batch_size (int, optional): 每批行数. Defaults to IMPORT_BATCH_SIZE.
+            **defaults: 所有行共用的字段值
+
+        Returns:
+            int: 插入行数
+        """
+        if not rows:
+            return 0
+
+        connection, fields, prepare, _ = self._insert_plan(rows[0], defaults)
+        sql = self._insert_sql(connection, fields)
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(sql, [prepare(row) for row in
+                                         rows[start:start + batch_size]])
+
+        return len(rows)
+
+    def insert_ignore(self, rows, unique_field,
+                      batch_size=IMPORT_BATCH_SIZE, **defaults):
+        """批量插入, unique_field与已有记录(或rows中靠前的行)冲突的行忽略
+
+        postgresql/sqlite(>=3.35)使用INSERT ... ON CONFLICT DO NOTHING
+        RETURNING, 一条语句完成插入并返回新记录;
+        mysql使用INSERT ... ON DUPLICATE KEY UPDATE id=id(冲突时不修改, 其他错误
+        照常抛出), 再按本批次写入的auto_now_add时间查询一次新记录, 要求
+        unique_field是主键以外唯一的唯一约束;
+        其余数据库(如sqlite<3.35)及mysql下没有auto_now_add字段的model与
+        get_or_create相同, 逐行在savepoint中插入. 不触发信号.
+
+        Args:
+            rows (list): 行数据dict, key为字段名, 每行key相同
+            unique_field (str): 带唯一约束的字段名
+            batch_size (int, optional): 每批行数. Defaults to IMPORT_BATCH_SIZE.
+            **defaults: 所有行共用的字段值
+
+        Returns:
+            list: 与rows一一对应, 新记录的主键, 未插入的行为None
+        """
+        if not rows:
+            return []
+
+        connection, fields, prepare, now = self._insert_plan(rows[0],
+                                                             defaults)
+        attname = self.model._meta.get_field(unique_field).attname
+        max_params = connection.features.max_query_params
+        if max_params:
+            batch_size = max(1, min(batch_size, max_params // len(fields)))
+
+        pks = []
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                params = [prepare(row) for row in batch]
+                if connection.vendor == 'mysql':
+                    inserted = self._mysql_insert_ignore(
+                        cursor, connection, fields, attname, batch, params,
+                        now)
+                elif supports_update_returning(connection):
+                    cursor.execute(
+                        self._insert_sql(connection, fields, len(batch),
+                                         unique_field),
+                        [param for row in params for param in row])
+                    inserted = {value: pk for pk, value in cursor.fetchall()}
+                else:
+                    inserted = self._savepoint_insert_ignore(
+                        cursor, connection, fields, attname, batch, params)
+
+                for row in batch:
+                    # NOTE: rows中重复的值只有第一行算作新记录
+                    pks.append(inserted.pop(row[attname], None))
+
+        return pks
+
+    def _mysql_insert_ignore(self, cursor, connection, fields, attname,
+                             batch, params, now):
+        marker = next((field.attname for field in fields
+                       if getattr(field, 'auto_now_add', False)), None)
+        if marker is None:
+            # NOTE: django的mysql连接开启了CLIENT_FOUND_ROWS, 冲突时rowcount
+            #       同样为1, 没有auto_now_add字段时无法区分新记录, 逐行插入
+            return self._savepoint_insert_ignore(cursor, connection, fields,
+                                                 attname, batch, params)
+
+        cursor.executemany(self._insert_sql(connection, fields, 1, attname),
+                           params)
+        return dict(QuerySet.values_list(
+            self.filter(**{f'{attname}__in': [row[attname] for row in batch],
+                           marker: now}),
+            attname, 'pk'))
+
+    def _savepoint_insert_ignore(self, cursor, connection, fields, attname,
+                                 batch, params):
+        opts = self.model._meta
+        sql = self._insert_sql(connection, fields)
+        inserted = {}
+        for row, row_params in zip(batch, params):
+            try:
+                with transaction.atomic(using=self.db):
+                    cursor.execute(sql, row_params)
+            except IntegrityError:
+                # NOTE: 与get_or_create相同, 只忽略unique_field冲突
+                if not self.filter(**{attname: row[attname]}).exists():
+                    raise
+                continue
+            inserted[row[attname]] = connection.ops.last_insert_id(
+                cursor, opts.db_table, opts.pk.column)
+
+        return inserted
 
     def create_with_field_check(self, field_query, **kwargs):
         """创建时根据传入字段校验数据库中是否存在记录
@@ -101,33 +321,193 @@ class CRUDQuerySet(QuerySet):
     def update_by_id(self, id, **kwargs):
         """更新数据
 
+        NOTE: 支持UPDATE ... RETURNING的数据库(postgresql/sqlite>=3.35)
+              一条语句完成更新并返回新数据, 其余数据库或过滤条件涉及其他表时
+              更新后再查询一次; 软删除时的重命名由数据库拼接, 不需要先查询原名称
+
         Args:
             id (int): model对象id
 
         Returns:
-            model obj: 更新后的model数据对象
+            model obj: 更新后的model数据对象, 不存在时返回None
         """
+        rename_field = getattr(self.model, 'RENAME_FIELD', None)
+        if (kwargs.get('is_deleted')
+                and rename_field is not None
+                and rename_field not in kwargs):
+
+            kwargs[rename_field] = Concat(F(rename_field),
+                                          Value(f'_deleted_{id}'))
+
+        if (kwargs.get('modified') is None
+                and hasattr(self.model, 'modified')):
+
+            kwargs['modified'] = timezone.now()
 
         found = self.filter(id=id)
+        connection = connections[self.db]
+        if kwargs and supports_update_returning(connection):
+            query = found._update_query(kwargs)
+            if query.count_active_tables() == 1 and not query.related_updates:
+                return found._update_returning(connection, query)
 
-        if found:
+        if not found.update(**kwargs):
+            return None
 
-            if (kwargs.get('is_deleted')
-                    and hasattr(self.model, 'RENAME_FIELD')
-                    and self.model.RENAME_FIELD is not None):
+        # NOTE: 更新可能改变过滤条件涉及的字段(如existed()中软删除), 不能用found重新查询
+        return self.model._default_manager.using(self.db).filter(pk=id).first()
 
-                kwargs[self.model.RENAME_FIELD] = (
-                    '{}_deleted_{}'
-                    .format(getattr(found[0], self.model.RENAME_FIELD), id))
+    def _update_query(self, values):
+        query = self.query.chain(sql.UpdateQuery)
+        query.add_update_values(values)
+        # NOTE: 与QuerySet.update一致, 确保主表在查询中, 便于统计涉及的表
+        query.get_initial_alias()
 
-            if (kwargs.get('modified') is None
-                    and hasattr(self.model, 'modified')):
+        return query
 
-                kwargs['modified'] = datetime.now().isoformat()
+    def _update_returning(self, connection, query):
+        """执行UPDATE ... RETURNING, 返回更新后的model对象
 
-            found.update(**kwargs)
+        NOTE: 只支持单表条件. 条件涉及其他表时SQLUpdateCompiler.pre_sql_setup
+              会先查询主键, 多表继承的父表字段需要额外的UPDATE(related_updates),
+              这些结果都无法通过RETURNING返回
+
+        Args:
+            connection: 数据库连接
+            query (UpdateQuery): _update_query生成的更新查询
+
+        Returns:
+            model obj: 更新后的model对象, 不存在时返回None
+        """
+        assert query.count_active_tables() == 1, 'RETURNING只支持单表条件'
+        assert not query.related_updates, 'RETURNING不支持多表继承的父表字段'
+        # NOTE: as_sql内部会执行pre_sql_setup, 单表条件时不产生额外查询
+        update_sql, params = query.get_compiler(self.db).as_sql()
+
+        opts = self.model._meta
+        fields = opts.concrete_fields
+        quote_name = connection.ops.quote_name
+        returning = ', '.join(quote_name(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.execute(f'{update_sql} RETURNING {returning}', params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+
+        # NOTE: 与SQLCompiler.apply_converters一致, 将数据库值转换为python值
+        values = []
+        for field, value in zip(fields, row):
+            col = field.get_col(opts.db_table)
+            for converter in (connection.ops.get_db_converters(col)
+                              + field.get_db_converters(connection)):
+                value = converter(value, col, connection)
+            values.append(value)
+
+        return self.model.from_db(self.db,
+                                  [field.attname for field in fields],
+                                  values)
+
+    def update_by_ids(self, changes, batch_size=UPDATE_BATCH_SIZE):
+        """按id批量更新, 每行的更新值可以不同
+
+        每批一条UPDATE: 各行取值相同的字段直接赋值, 否则使用CASE WHEN;
+        软删除的重命名由数据库拼接(名称_deleted_id), modified在同一语句中更新.
+        NOTE: 不触发post_save, 事务提交后发送bulk_updated信号
+
+        Examples:
+            Role.object_list.update_by_ids({
+                1: {'is_deleted': True, 'modifier': 'admin'},
+                2: {'desc': '管理员'},
+            })
 
-            return found[0]
+        Args:
+            changes (dict): {id: {字段名: 值}}
+            batch_size (int, optional): 每批行数. Defaults to UPDATE_BATCH_SIZE.
+
+        Returns:
+            int: 更新行数
+        """
+        if not changes:
+            return 0
+
+        connection = connections[self.db]
+        rename_field = getattr(self.model, 'RENAME_FIELD', None)
+        ids = list(changes)
+        fields = {field for row in changes.values() for field in row}
+        max_params = connection.features.max_query_params
+        if max_params:
+            # NOTE: 每行每个字段占用id和取值两个参数
+            batch_size = max(1, min(batch_size,
+                                    max_params // (2 * len(fields) + 2)))
+
+        updated_fields = set(fields)
+        now = timezone.now()
+        updated = 0
+        with transaction.atomic(using=self.db):
+            for start in range(0, len(ids), batch_size):
+                batch = {pk: changes[pk]
+                         for pk in ids[start:start + batch_size]}
+                # NOTE: 只处理本批次中有行设置的字段, 各批次的字段可以不同
+                batch_fields = {field for row in batch.values()
+                                for field in row}
+                defaults = {}
+
+                deleted = [pk for pk, row in batch.items()
+                           if row.get('is_deleted') and rename_field
+                           and rename_field not in row]
+                if deleted:
+                    rename = Concat(F(rename_field), Value('_deleted_'),
+                                    Cast('pk', CharField()))
+                    if len(deleted) < len(batch):
+                        rename = Case(When(pk__in=deleted, then=rename),
+                                      default=F(rename_field))
+                    defaults[rename_field] = rename
+                    updated_fields.add(rename_field)
+
+                if hasattr(self.model, 'modified'):
+                    defaults['modified'] = Value(
+                        now, output_field=self.model._meta.get_field(
+                            'modified'))
+                    updated_fields.add('modified')
+
+                values = {field: self._case_value(field, batch,
+                                                  defaults.pop(field, None))
+                          for field in batch_fields}
+                # NOTE: 没有行设置的字段(软删除重命名, modified)直接赋值
+                values.update(defaults)
+
+                updated += self.filter(pk__in=batch).update(**values)
+
+            transaction.on_commit(
+                lambda: bulk_updated.send(sender=self.model, ids=ids,
+                                          fields=updated_fields),
+                using=self.db)
+
+        return updated
+
+    def _case_value(self, field, batch, default=None):
+        """单个字段的更新值: 各行取值相同时直接赋值, 否则按id CASE WHEN
+
+        Args:
+            field (str): 字段名, 本批次中至少有一行设置
+            batch (dict): {id: {字段名: 值}}
+            default (Expression, optional): 未设置该字段的行的取值.
+                Defaults to None(保持原值).
+        """
+        model_field = self.model._meta.get_field(field)
+        rows = [(pk, row[field]) for pk, row in batch.items() if field in row]
+        first = rows[0][1]
+        if len(rows) == len(batch) and all(value == first
+                                           for _, value in rows):
+            return first
+
+        return Case(*[When(pk=pk,
+                           then=(value
+                                 if hasattr(value, 'resolve_expression')
+                                 else Value(value, output_field=model_field)))
+                      for pk, value in rows],
+                    default=default if default is not None else F(field),
+                    output_field=model_field)
 
     def get_by_id(self, id, fields=()):
         """通过id获取json serializable对象
@@ -139,14 +519,10 @@ class CRUDQuerySet(QuerySet):
         Returns:
             dict: model对象详情(json serializable)
         """
-
-        found = self.filter(id=id)
-        if found:
-            return found.values(*fields)[0]
-        return {}
+        return self.get_by_field({'id': id}, fields)
 
     def get_by_field(self, field_query, fields=()):
-        """通过字段获取son serializable对象
+        """通过字段获取json serializable对象(一次LIMIT 1查询)
 
         Args:
             field_query (dict): model object fields
@@ -155,10 +531,9 @@ class CRUDQuerySet(QuerySet):
         Returns:
             dict: model对象详情(json serializable)
         """
-        found = self.filter(**field_query)
-        if found:
-            return self.values(*fields)[0]
-        return {}
+        found = list(self.filter(**field_query).values(*fields)[:1])
+
+        return found[0] if found else {}
 
     def update_with_field_check(self, field_query, id, **kwargs):
         """更新时根据传入字段校验数据库中是否存在记录
@@ -193,19 +568,122 @@ class FilterQuerySet(QuerySet):
 
         return super().order_by(order)
 
+    def keyset_paginate(self,
+                        cursor=None,
+                        order_field='created',
+                        order=1,
+                        page_size=PAGE_SIZE,
+                        count=None):
+        """键集(游标)分页
+
+        按(order_field, 主键)排序, 游标记录上一页首/尾行的这两个值,
+        翻页条件为 order_field >= value AND (order_field > value OR pk > id),
+        前导范围条件可以使用(order_field, id)联合索引, 翻页深度不影响查询耗时.
+        NOTE: order_field需为非空字段; values()查询集需包含order_field和主键
+
+        Args:
+            cursor (str, optional): 上一次返回的next/prev游标. Defaults to None.
+            order_field (str, optional): 排序字段. Defaults to 'created'.
+            order (int, optional): 1升序, -1降序. Defaults to 1.
+            page_size (int, optional): 每页数量, 不超过MAX_PAGE_SIZE.
+                Defaults to PAGE_SIZE.
+            count (str, optional): None不计数, 'exact'为COUNT(*),
+                'estimate'为表统计信息中的估算行数. Defaults to None.
+
+        Returns:
+            dict: {'rows': 当前页数据, 'next': 下一页游标, 'prev': 上一页游标,
+                   'total': 总数(count不为None时)}, 没有下一页/上一页时游标为None
+
+        Raises:
+            ValueError: 游标无效
+        """
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        field = self.model._meta.get_field(order_field)
+        pk_name = self.model._meta.pk.attname
+        backward = False
+        queryset = self
+
+        if cursor:
+            value, pk, backward = CursorHelper.decode(cursor)
+            try:
+                value = field.to_python(value)
+                pk = self.model._meta.pk.to_python(pk)
+            except ValidationError:
+                raise ValueError(f'无效的分页游标: {cursor}')
+            lookup = 'gt' if (order == 1) != backward else 'lt'
+            queryset = (queryset
+                        .filter(**{f'{order_field}__{lookup}e': value})
+                        .filter(Q(**{f'{order_field}__{lookup}': value})
+                                | Q(**{f'pk__{lookup}': pk})))
+
+        prefix = '' if (order == 1) != backward else '-'
+        rows = list(queryset.order_by(f'{prefix}{order_field}',
+                                      f'{prefix}pk')[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if backward:
+            rows.reverse()
+
+        page = {'rows': rows, 'next': None, 'prev': None}
+        if rows:
+            def position(row):
+                if isinstance(row, dict):
+                    return row[order_field], row[pk_name]
+                return getattr(row, field.attname), row.pk
+
+            if has_more or backward:
+                page['next'] = CursorHelper.encode(*position(rows[-1]))
+            if (has_more and backward) or (cursor and not backward):
+                page['prev'] = CursorHelper.encode(*position(rows[0]),
+                                                   backward=True)
+
+        if count == 'exact':
+            page['total'] = self.count()
+        elif count == 'estimate':
+            page['total'] = self.estimate_count()
+
+        return page
+
+    def estimate_count(self):
+        """根据表统计信息估算行数, 不执行COUNT(*)
+
+        NOTE: 估算的是整张表的行数, 有过滤条件(包括软删除、关联过滤)或切片时
+              退回COUNT(*); 不支持的数据库或没有统计信息时同样退回COUNT(*)
+
+        Returns:
+            int
+        """
+        if self.query.where or self.query.is_sliced or self.query.distinct:
+            return self.count()
+
+        connection = connections[self.db]
+        table = self.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+        elif connection.vendor == 'mysql':
+            sql = ('SELECT TABLE_ROWS FROM information_schema.TABLES '
+                   'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s')
+        else:
+            return self.count()
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        if row is None or row[0] is None or row[0] < 0:
+            return self.count()
+
+        return int(row[0])
+
     def fuzzy_filter(self, field_name, search_string, split=' '):
-        """对指定字段field_name进行模糊查询
+        """对指定字段field_name进行模糊查询, 各关键词需全部匹配
+
+        NOTE: 查询方式由settings.SEARCH_BACKEND指定, 见core.search
 
         Args:
             field_name (str): 查询字段名称
             search_string (str): 模糊查询字符串
             split (str, optional): 查询字符串切割符. Defaults to ' '.
         """
-        string_list = search_string.split(split)
-        query_key = f'{field_name}_icontains'
-        for string in string_list:
-            if string:
-                query = {query_key: string}
-                self = self.filter(**query)
+        tokens = [string for string in search_string.split(split) if string]
 
-        return self
+        return get_search_backend().filter(self, field_name, tokens)
@@ -0,0 +1,218 @@
+"""基于RedisUtil列表的队列消费者
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from redis.exceptions import ResponseError
+
+from log.log import lx_log
+
+from .constants import (QUEUE_BATCH_SIZE, QUEUE_BLOCK_TIMEOUT,
+                        QUEUE_WORKER_COUNT)
+
+# NOTE: 原子地从队列左侧取出最多N个元素并放入处理中列表
+MOVE_BATCH_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+
+class RedisQueueConsumer:
+    """可靠的redis列表队列消费者
+
+    生产者通过RedisUtil.rpush写入队列. 消费者用BLMOVE(redis-py或redis服务端
+    低于6.2时为BLPOP)阻塞等待第一个元素, 队列为空时不占用CPU; 之后用一个lua脚本一次取出
+    剩余最多batch_size - 1个元素. 取出的元素先放入处理中列表, 整批交给线程池
+    处理: 处理成功后从处理中列表删除(ack), 失败则放回队列(requeue).
+
+    handler(items)返回None表示整批成功, 返回可迭代对象表示需要重新入队的元素;
+    抛出异常时整批重新入队.
+
+    Args:
+        redis_util (RedisUtil): redis连接
+        queue (str): 队列key
+        handler (callable): 批处理函数
+        batch_size (int, optional): 每批最多元素数. Defaults to QUEUE_BATCH_SIZE.
+        block_timeout (int, optional): 阻塞等待秒数, 超时后检查是否需要停止.
+            Defaults to QUEUE_BLOCK_TIMEOUT.
+        worker_count (int, optional): 处理线程数, 同时也是在途批次上限.
+            Defaults to QUEUE_WORKER_COUNT.
+        processing_queue (str, optional): 处理中列表key.
+            Defaults to '{queue}:processing'.
+    """
+
+    def __init__(self,
+                 redis_util,
+                 queue,
+                 handler,
+                 batch_size=QUEUE_BATCH_SIZE,
+                 block_timeout=QUEUE_BLOCK_TIMEOUT,
+                 worker_count=QUEUE_WORKER_COUNT,
+                 processing_queue=None):
+        self.redis_util = redis_util
+        self.client = redis_util.conn_client
+        self.queue = queue
+        self.processing_queue = processing_queue or f'{queue}:processing'
+        self.handler = handler
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self.worker_count = worker_count
+        self.move_batch = self.client.register_script(MOVE_BATCH_SCRIPT)
+        # NOTE: 服务端不支持BLMOVE(redis<6.2)时首次调用后置为False
+        self.use_blmove = hasattr(self.client, 'blmove')
+        self._slots = threading.BoundedSemaphore(worker_count)
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'processed': 0, 'requeued': 0, 'batches': 0}
+        self._stats_lock = threading.Lock()
+
+    def _wait_first(self):
+        """阻塞等待队列中的第一个元素并移入处理中列表
+
+        Returns:
+            str or None: 超时返回None
+        """
+        if self.use_blmove:
+            try:
+                return self.client.blmove(self.queue,
+                                          self.processing_queue,
+                                          self.block_timeout,
+                                          'LEFT',
+                                          'RIGHT')
+            except ResponseError as e:
+                if 'unknown command' not in str(e).lower():
+                    raise
+                lx_log.info(f'【队列{self.queue}】redis不支持BLMOVE, 改用BLPOP')
+                self.use_blmove = False
+
+        popped = self.client.blpop(self.queue, timeout=self.block_timeout)
+        if popped is None:
+            return None
+        self.client.rpush(self.processing_queue, popped[1])
+
+        return popped[1]
+
+    def fetch_batch(self):
+        """获取一批元素(已移入处理中列表)
+
+        Returns:
+            list: 元素列表, 队列为空且等待超时时为空列表
+        """
+        first = self._wait_first()
+        if first is None:
+            return []
+
+        rest = []
+        if self.batch_size > 1:
+            rest = self.move_batch(keys=[self.queue, self.processing_queue],
+                                   args=[self.batch_size - 1])
+
+        return [first] + list(rest)
+
+    def ack(self, items):
+        """确认处理完成, 从处理中列表删除
+
+        Args:
+            items (list): 已处理的元素
+        """
+        if not items:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for item in items:
+            pipe.lrem(self.processing_queue, 1, item)
+        pipe.execute()
+
+    def requeue(self, items):
+        """将元素从处理中列表放回队列尾部
+
+        Args:
+            items (list): 需要重新处理的元素
+        """
+        if not items:
+            return
+        pipe = self.client.pipeline(transaction=True)
+        for item in items:
+            pipe.lrem(self.processing_queue, 1, item)
+        pipe.rpush(self.queue, *items)
+        pipe.execute()
+
+    def recover(self):
+        """将处理中列表的全部元素放回队列, 用于消费者异常退出后的恢复
+
+        只能在没有其他消费者使用同一个处理中列表时调用.
+
+        Returns:
+            int: 放回队列的元素数
+        """
+        count = 0
+        while True:
+            moved = self.client.rpoplpush(self.processing_queue, self.queue)
+            if moved is None:
+                return count
+            count += 1
+
+    def _handle(self, items):
+        try:
+            try:
+                failed = self.handler(items)
+            except Exception as e:
+                lx_log.error(f'【队列{self.queue}批处理失败】{e}')
+                failed = items
+
+            failed = list(failed) if failed else []
+            failed_set = set(failed)
+            done = [item for item in items if item not in failed_set]
+            self.ack(done)
+            self.requeue(failed)
+            with self._stats_lock:
+                self.stats['batches'] += 1
+                self.stats['processed'] += len(done)
+                self.stats['requeued'] += len(failed)
+        finally:
+            self._slots.release()
+
+    def run(self):
+        """阻塞运行消费循环, 直到调用stop
+        """
+        with ThreadPoolExecutor(max_workers=self.worker_count) as executor:
+            while not self._stop.is_set():
+                # NOTE: 线程池已满时不再从redis取数据, 避免元素堆积在本进程
+                if not self._slots.acquire(timeout=self.block_timeout):
+                    continue
+                try:
+                    items = self.fetch_batch()
+                except Exception as e:
+                    self._slots.release()
+                    lx_log.error(f'【队列{self.queue}获取数据失败】{e}')
+                    self._stop.wait(self.block_timeout)
+                    continue
+                if not items:
+                    self._slots.release()
+                    continue
+                executor.submit(self._handle, items)
+
+    def start(self):
+        """在后台线程中运行消费循环
+
+        Returns:
+            threading.Thread
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+        return self._thread
+
+    def stop(self, wait=True):
+        """停止消费, 已取出的批次会处理完毕
+
+        Args:
+            wait (bool, optional): 是否等待消费线程退出. Defaults to True.
+        """
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,137 @@
+"""json response渲染
+
+替代 converts_keys(data, case='camel') + JsonResponse:
+    - snake→camel的key转换结果按key元组缓存, 同结构的行(如queryset.values())
+      只在第一行转换一次, 之后每行只需一次dict(zip(...))
+    - 不深拷贝原数据, 只重建dict/list容器, 标量值直接复用
+    - 安装了orjson时使用orjson序列化, 否则退回标准库json,
+      日期/Decimal等类型统一交给DjangoJSONEncoder处理, 输出格式与JsonResponse一致
+    - NaN/Infinity不是合法的json, 两种序列化方式都输出为null(与orjson一致)
+"""
+import json
+import math
+
+from any_case import to_camel_case
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from .constants import RENDERER_KEY_CACHE_SIZE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SCALAR_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+class JSONRenderer:
+
+    _keys = {}
+    _key_tuples = {}
+    _encoder = DjangoJSONEncoder()
+
+    @classmethod
+    def camel_key(cls, key):
+        """snake→camel(带缓存), 非字符串key原样返回
+        """
+        camel = cls._keys.get(key)
+        if camel is None:
+            camel = to_camel_case(key) if key.__class__ is str and key else key
+            # NOTE: 缓存有上限, 防止动态key(如以id为key的dict)无限增长
+            if len(cls._keys) < RENDERER_KEY_CACHE_SIZE:
+                cls._keys[key] = camel
+
+        return camel
+
+    @classmethod
+    def camel_keys(cls, keys):
+        """按key元组缓存整行的转换结果
+        """
+        camel = cls._key_tuples.get(keys)
+        if camel is None:
+            camel = tuple(cls.camel_key(key) for key in keys)
+            if len(cls._key_tuples) < RENDERER_KEY_CACHE_SIZE:
+                cls._key_tuples[keys] = camel
+
+        return camel
+
+    @classmethod
+    def camelize(cls, data):
+        """递归转换dict的key为camel case, 不修改原数据
+
+        Args:
+            data (any): dict/list/tuple/queryset等
+
+        Returns:
+            any: 转换后的数据, 容器类型统一为dict/list
+        """
+        data_class = data.__class__
+        if data_class is dict:
+            values = [cls.camelize(value)
+                      if not isinstance(value, SCALAR_TYPES) else value
+                      for value in data.values()]
+            return dict(zip(cls.camel_keys(tuple(data)), values))
+
+        if data_class is list or data_class is tuple:
+            return [cls.camelize(item)
+                    if not isinstance(item, SCALAR_TYPES) else item
+                    for item in data]
+
+        if isinstance(data, SCALAR_TYPES):
+            return data
+        if isinstance(data, dict):
+            return cls.camelize(dict(data))
+        if hasattr(data, '__iter__') and not hasattr(data, 'isoformat'):
+            # NOTE: queryset/生成器/集合等
+            return cls.camelize(list(data))
+
+        return data
+
+    @classmethod
+    def finite(cls, data):
+        """递归将NaN/Infinity替换为None, 不修改原数据
+        """
+        if isinstance(data, float):
+            return data if math.isfinite(data) else None
+        if isinstance(data, dict):
+            return {key: cls.finite(value) for key, value in data.items()}
+        if isinstance(data, (list, tuple)):
+            return [cls.finite(item) for item in data]
+
+        return data
+
+    @classmethod
+    def dumps(cls, data):
+        """序列化为json bytes
+
+        Returns:
+            bytes
+        """
+        if orjson is not None:
+            return orjson.dumps(data,
+                                default=cls._encoder.default,
+                                option=(orjson.OPT_PASSTHROUGH_DATETIME
+                                        | orjson.OPT_NON_STR_KEYS))
+
+        try:
+            return json.dumps(data, cls=DjangoJSONEncoder,
+                              allow_nan=False).encode()
+        except ValueError:
+            # NOTE: 含NaN/Infinity时才遍历替换, 正常数据不多做一次遍历
+            return json.dumps(cls.finite(data),
+                              cls=DjangoJSONEncoder).encode()
+
+    @classmethod
+    def response(cls, data, status=200):
+        """
+        Args:
+            data (dict): 已转换好的响应数据
+            status (int, optional): http状态码. Defaults to 200.
+
+        Returns:
+            HttpResponse
+        """
+        return HttpResponse(cls.dumps(data),
+                            status=status,
+                            content_type='application/json')
@@ -0,0 +1,473 @@
+"""声明式请求参数校验模块
+
+视图在模块导入时声明一次参数规则, RequestSchema 将其编译为专用的校验函数,
+请求时只需执行编译后的函数, 遇到第一个错误即返回.
+批量接口可通过 RequestSchema.validate_many 按列校验多行数据.
+"""
+import codecs
+import json
+import re
+from json import JSONDecodeError, JSONDecoder
+
+from log.log import lx_log
+
+from .helpers import DataTypeHelper
+
+NULL_STRINGS = frozenset(('', 'None', 'null'))
+WHITESPACE = re.compile(r'\s*')
+JSON_TYPES = {
+    'json': (list, dict),
+    'list': (list,),
+    'dict': (dict,),
+}
+# NOTE: 可直接按列map转换的类型
+FAST_COLUMN_TYPES = (str, int, float)
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+BATCH_VALIDATION_SIZE = 5000
+
+
+def to_bool(raw):
+    """布尔参数转换, 逐个校验与按列校验共用, 保证两者结果一致
+    """
+    if raw.__class__ is bool:
+        return raw
+
+    return DataTypeHelper.str_to_bool(str(raw))
+
+
+class Arg:
+    """单个请求参数的校验规则
+
+    Args:
+        key (str): 参数名
+        valid_type (class or str, optional): Defaults to None. 参数类型,
+            'json'/'list'/'dict' 表示需要json解析的参数
+        null (bool, optional): Defaults to True. 是否允许空值
+        choices (iterable, optional): Defaults to None. 有限选项
+        default (any, optional): Defaults to None. 默认值
+        verbose_note (str, optional): Defaults to ''. 参数说明
+    """
+
+    __slots__ = ('key', 'valid_type', 'null', 'choices', 'default',
+                 'verbose_note')
+
+    def __init__(self,
+                 key,
+                 valid_type=None,
+                 null=True,
+                 choices=None,
+                 default=None,
+                 verbose_note=''):
+        self.key = key
+        self.valid_type = valid_type
+        self.null = null
+        self.choices = frozenset(choices) if choices is not None else None
+        self.default = default
+        self.verbose_note = verbose_note
+
+    def compile(self):
+        """编译为专用的校验函数
+
+        Returns:
+            function: check(raw_value) -> (bool, any), 校验失败时返回错误信息
+        """
+        key = self.key
+        default = self.default
+        required = not self.null and default is None
+        missing_msg = f'参数{key}缺失'
+        type_msg = f'参数{key}类型错误'
+        choice_msg = f'参数{key}取值错误'
+        convert = self._compile_convert()
+        choices = self.choices
+
+        def check(raw):
+            if raw is None or (raw.__class__ is str and raw in NULL_STRINGS):
+                if required:
+                    return False, missing_msg
+                return True, default
+
+            ok, value = convert(raw)
+            if not ok:
+                return False, type_msg
+
+            if choices is not None and value:
+                try:
+                    if value not in choices:
+                        return False, choice_msg
+                except TypeError:
+                    return False, choice_msg
+
+            return True, value
+
+        return check
+
+    def compile_column(self):
+        """编译为按列校验的函数
+
+        整列先尝试用C层面的map一次性完成类型转换, 只有该列存在空值或非法值时,
+        才退回到逐个单元格校验并收集错误.
+
+        Returns:
+            function: check_column(column) -> (list, dict), 返回转换后的列值
+                以及{行号: 错误信息}
+        """
+        check = self.compile()
+        choices = self.choices
+        fast = None
+        if self.valid_type in FAST_COLUMN_TYPES:
+            fast = self.valid_type
+        elif self.valid_type is bool:
+            fast = to_bool
+
+        def check_column(column):
+            if fast is not None:
+                try:
+                    if None in column or not NULL_STRINGS.isdisjoint(column):
+                        raise ValueError
+                    values = list(map(fast, column))
+                except (TypeError, ValueError):
+                    pass
+                else:
+                    if choices is None or choices.issuperset(
+                            filter(None, values)):
+                        return values, {}
+
+            values = []
+            errors = {}
+            for index, raw in enumerate(column):
+                ok, value = check(raw)
+                if ok:
+                    values.append(value)
+                else:
+                    values.append(None)
+                    errors[index] = value
+
+            return values, errors
+
+        return check_column
+
+    def _compile_convert(self):
+        valid_type = self.valid_type
+        key = self.key
+
+        if valid_type is None:
+            return lambda raw: (True, raw)
+
+        if valid_type in JSON_TYPES:
+            allowed = JSON_TYPES[valid_type]
+
+            def convert_json(raw):
+                value = raw
+                if isinstance(raw, (str, bytes)):
+                    try:
+                        value = json.loads(raw)
+                    except JSONDecodeError as e:
+                        lx_log.debug(f'【json参数验证错误】{key}: {e}')
+                        return False, None
+                return isinstance(value, allowed), value
+
+            return convert_json
+
+        if valid_type is bool:
+
+            return lambda raw: (True, to_bool(raw))
+
+        def convert(raw):
+            if raw.__class__ is valid_type:
+                return True, raw
+            try:
+                return True, valid_type(raw)
+            except (TypeError, ValueError):
+                return False, None
+
+        return convert
+
+
+class ValidationResult:
+    """参数校验结果
+
+    Attributes:
+        is_valid (bool): 是否校验通过
+        msg (str): 第一个校验失败的参数信息, 通过时为''
+        data (dict): 校验(及类型转换)后的参数取值
+    """
+
+    __slots__ = ('is_valid', 'msg', 'data')
+
+    def __init__(self, is_valid, msg='', data=None):
+        self.is_valid = is_valid
+        self.msg = msg
+        self.data = data if data is not None else {}
+
+    def __bool__(self):
+        return self.is_valid
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __repr__(self):
+        return (f'<ValidationResult is_valid={self.is_valid} '
+                f'msg={self.msg!r}>')
+
+
+class BatchValidationResult:
+    """批量参数校验结果
+
+    Attributes:
+        total (int): 校验的总行数
+        rows (list): 校验通过(及类型转换)后的行数据
+        indexes (list): rows中每行在原始数据中的行号
+        errors (list): 校验失败的行, e.g. [{'row': 3, 'msg': '参数name缺失'}]
+    """
+
+    __slots__ = ('total', 'rows', 'indexes', 'errors')
+
+    def __init__(self, total=0, rows=None, indexes=None, errors=None):
+        self.total = total
+        self.rows = rows if rows is not None else []
+        self.indexes = indexes if indexes is not None else []
+        self.errors = errors if errors is not None else []
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+    def __bool__(self):
+        return self.is_valid
+
+    def extend(self, other, offset=0):
+        """合并另一批次的校验结果
+
+        Args:
+            other (BatchValidationResult): 另一批次的结果
+            offset (int, optional): Defaults to 0. 另一批次首行的行号偏移
+        """
+        self.total += other.total
+        self.rows.extend(other.rows)
+        self.indexes.extend(index + offset for index in other.indexes)
+        self.errors.extend({'row': error['row'] + offset, 'msg': error['msg']}
+                           for error in other.errors)
+
+    def __repr__(self):
+        return (f'<BatchValidationResult total={self.total} '
+                f'errors={len(self.errors)}>')
+
+
+def iter_json_array(source, chunk_size=JSON_STREAM_CHUNK_SIZE):
+    """流式解析json数组, 逐个返回数组元素
+
+    Args:
+        source (str, bytes or file-like): json数组文本或可read()的对象(如request)
+        chunk_size (int, optional): 每次读取的字节数. Defaults to 64KB.
+
+    Yields:
+        any: 数组元素
+
+    Raises:
+        ValueError: 数据不是合法的json数组
+    """
+    if isinstance(source, (str, bytes)):
+        if isinstance(source, bytes):
+            source = source.decode('utf-8')
+        items = json.loads(source) if source.strip() else []
+        if not isinstance(items, list):
+            raise ValueError('请求数据不是json数组')
+        yield from items
+        return
+
+    decoder = JSONDecoder()
+    # NOTE: 增量解码, 避免多字节字符被chunk截断
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def read():
+        chunk = source.read(chunk_size)
+        if isinstance(chunk, bytes):
+            return text_decoder.decode(chunk, final=not chunk), not chunk
+        return chunk, not chunk
+
+    buffer = ''
+    pos = 0
+    eof = False
+    # NOTE: 解析状态, start: 等待'[', first: 等待首个元素或']',
+    #       item: 逗号后等待元素, sep: 元素后等待','或']'
+    state = 'start'
+    # NOTE: 单个元素跨越多个chunk时, 缓冲区至少翻倍后再重新解码,
+    #       避免每读一块就从头解码一次
+    retry_size = 0
+
+    while True:
+        match = WHITESPACE.match(buffer, pos)
+        pos = match.end()
+
+        if pos == len(buffer) or (len(buffer) < retry_size and not eof):
+            if eof:
+                if state == 'start':
+                    return
+                raise ValueError('请求数据json数组不完整')
+            chunk, eof = read()
+            buffer = buffer[pos:] + chunk
+            retry_size -= pos
+            pos = 0
+            continue
+
+        char = buffer[pos]
+        if state == 'start':
+            if char != '[':
+                raise ValueError('请求数据不是json数组')
+            state = 'first'
+            pos += 1
+            continue
+
+        if state == 'sep':
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError('请求数据json数组格式错误')
+            state = 'item'
+            pos += 1
+            continue
+
+        if char == ']' and state == 'first':
+            return
+        if char in ',]':
+            raise ValueError('请求数据json数组格式错误')
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except JSONDecodeError:
+            end = None
+        else:
+            # NOTE: 元素后必须是','或']', 否则可能是被chunk截断的数字(如'2.')
+            following = WHITESPACE.match(buffer, end).end()
+            if following == len(buffer):
+                end = end if eof else None
+            elif buffer[following] not in ',]':
+                end = None
+
+        # NOTE: 元素解析失败或可能被chunk截断时, 读取下一块
+        if end is None:
+            if eof:
+                raise ValueError('请求数据json数组格式错误')
+            buffer = buffer[pos:]
+            pos = 0
+            retry_size = max(len(buffer) * 2, chunk_size)
+            chunk, eof = read()
+            buffer += chunk
+            continue
+
+        retry_size = 0
+        pos = end
+        state = 'sep'
+        yield item
+
+
+class RequestSchema:
+    """编译后的请求参数校验规则集合
+
+    Examples:
+        LOGIN_SCHEMA = RequestSchema(
+            Arg('username', valid_type=str, null=False),
+            Arg('password', valid_type=str, null=False))
+
+        result = LOGIN_SCHEMA.validate(request.POST)
+        if result.is_valid:
+            username = result['username']
+    """
+
+    def __init__(self, *args):
+        keys = [arg.key for arg in args]
+        if len(keys) != len(set(keys)):
+            raise ValueError(f'参数规则重复: {keys}')
+
+        self.args = args
+        self.keys = tuple(keys)
+        self.validate = self._compile()
+        self._column_checks = tuple((arg.key, arg.compile_column())
+                                    for arg in args)
+
+    def validate_many(self, rows):
+        """按列批量校验多行参数, 收集每行的第一个错误而不中断
+
+        Args:
+            rows (iterable): 行数据(dict)列表
+
+        Returns:
+            BatchValidationResult
+        """
+        rows = list(rows)
+        total = len(rows)
+        row_errors = {}
+
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                row_errors[index] = '行数据类型错误'
+                rows[index] = {}
+
+        columns = []
+        for key, check_column in self._column_checks:
+            values, errors = check_column([row.get(key) for row in rows])
+            columns.append(values)
+            for index, msg in errors.items():
+                row_errors.setdefault(index, msg)
+
+        valid_indexes = [index for index in range(total)
+                         if index not in row_errors]
+        keys = self.keys
+        valid_rows = [dict(zip(keys, [column[index] for column in columns]))
+                      for index in valid_indexes]
+        errors = [{'row': index, 'msg': row_errors[index]}
+                  for index in sorted(row_errors)]
+
+        return BatchValidationResult(total, valid_rows, valid_indexes, errors)
+
+    def validate_json_array(self, source, batch_size=BATCH_VALIDATION_SIZE):
+        """流式解析json数组并分批校验, 避免整体载入后再逐行校验
+
+        Args:
+            source (str, bytes or file-like): json数组文本或可read()的对象
+            batch_size (int, optional): 每批校验的行数. Defaults to 5000.
+
+        Returns:
+            BatchValidationResult
+
+        Raises:
+            ValueError: 数据不是合法的json数组
+        """
+        result = BatchValidationResult()
+        batch = []
+        for item in iter_json_array(source):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                result.extend(self.validate_many(batch), result.total)
+                batch = []
+        if batch:
+            result.extend(self.validate_many(batch), result.total)
+
+        return result
+
+    def _compile(self):
+        checks = tuple((arg.key, arg.compile()) for arg in self.args)
+
+        def validate(request_body):
+            """校验请求参数, 遇到第一个错误即返回
+
+            Args:
+                request_body (dict or QueryDict): 请求参数
+
+            Returns:
+                ValidationResult
+            """
+            get = request_body.get
+            data = {}
+            for key, check in checks:
+                ok, value = check(get(key))
+                if not ok:
+                    return ValidationResult(False, value, data)
+                data[key] = value
+
+            return ValidationResult(True, '', data)
+
+        return validate
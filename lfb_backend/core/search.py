@@ -0,0 +1,338 @@
+"""FilterQuerySet.fuzzy_filter的搜索后端
+
+    - like: 每个关键词一个icontains(LIKE '%x%')条件, 需要全表扫描, 作为兜底
+    - fulltext: mysql FULLTEXT索引(ngram分词), 需先建立索引, e.g.
+        ALTER TABLE lfb_role ADD FULLTEXT INDEX ft_lfb_role_name (name)
+        WITH PARSER ngram;
+      长度小于ngram分词长度的关键词以及非mysql数据库退回like
+    - redis: redis中维护的n-gram倒排索引(含拼音全拼/首字母),
+      关键词拆成n-gram后SINTER得到候选主键, 数据库在候选主键内再用like校验
+      (拼音匹配在索引文本上校验). 索引通过register注册的字段在事务提交后
+      增量维护(保存/删除/update_by_ids), 首次使用前需执行rebuild;
+      索引未建立或redis不可用时退回like
+
+settings:
+    SEARCH_BACKEND = 'like'  # like/fulltext/redis
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from redis.exceptions import RedisError
+
+from log.log import lx_log
+
+from .constants import (SEARCH_BATCH_SIZE, SEARCH_KEY_PREFIX,
+                        SEARCH_NGRAM_SIZE)
+from .utils import RedisUtil
+
+try:
+    from xpinyin import Pinyin
+except ImportError:
+    # NOTE: 未安装xpinyin时不索引拼音
+    Pinyin = None
+
+# NOTE: {model: {字段名}}, 由register注册, redis后端只索引这些字段
+SEARCH_FIELDS = {}
+
+
+class LikeSearchBackend:
+
+    def filter(self, queryset, field_name, tokens):
+        """
+        Args:
+            queryset (QuerySet): 查询集
+            field_name (str): 查询字段名称
+            tokens (list): 关键词, 需全部匹配
+
+        Returns:
+            QuerySet
+        """
+        query_key = f'{field_name}__icontains'
+        for token in tokens:
+            queryset = queryset.filter(**{query_key: token})
+
+        return queryset
+
+    def update(self, model, pks):
+        """model记录新增/修改后更新索引, 由数据库维护索引的后端无需处理
+        """
+
+    def remove(self, model, pks):
+        """model记录删除后移除索引
+        """
+
+
+class FullTextSearchBackend(LikeSearchBackend):
+
+    def filter(self, queryset, field_name, tokens):
+        connection = connections[queryset.db]
+        if connection.vendor != 'mysql':
+            return super().filter(queryset, field_name, tokens)
+
+        # NOTE: ngram分词下短于分词长度的关键词无法命中索引
+        indexed = [token for token in tokens
+                   if len(token) >= SEARCH_NGRAM_SIZE]
+        short = [token for token in tokens if len(token) < SEARCH_NGRAM_SIZE]
+        if indexed:
+            quote_name = connection.ops.quote_name
+            opts = queryset.model._meta
+            column = (f'{quote_name(opts.db_table)}.'
+                      f'{quote_name(opts.get_field(field_name).column)}')
+            # NOTE: 每个关键词作为短语(双引号内运算符无效)且必须出现
+            against = ' '.join('+"{}"'.format(token.replace('"', ' '))
+                               for token in indexed)
+            queryset = queryset.extra(
+                where=[f'MATCH ({column}) AGAINST (%s IN BOOLEAN MODE)'],
+                params=[against])
+
+        return super().filter(queryset, field_name, short)
+
+
+class RedisSearchBackend(LikeSearchBackend):
+
+    def __init__(self):
+        self.pinyin = Pinyin() if Pinyin is not None else None
+
+    @staticmethod
+    def key(model, field_name, suffix):
+        return (f'{SEARCH_KEY_PREFIX}:{model._meta.label_lower}:'
+                f'{field_name}:{suffix}')
+
+    @staticmethod
+    def grams(text):
+        """拆分为n-gram, 不足n个字符时返回自身
+        """
+        text = text.lower()
+        if len(text) <= SEARCH_NGRAM_SIZE:
+            return {text} if text else set()
+
+        return {text[i:i + SEARCH_NGRAM_SIZE]
+                for i in range(len(text) - SEARCH_NGRAM_SIZE + 1)}
+
+    def terms(self, text):
+        """文本的全部索引项: 单字、n-gram及拼音全拼/首字母的n-gram
+        """
+        text = str(text or '').lower()
+        terms = set(text) | self.grams(text)
+        if self.pinyin is not None and not text.isascii():
+            terms |= self.grams(self.pinyin.get_pinyin(text, ''))
+            terms |= self.grams(self.pinyin.get_initials(text, ''))
+        terms.discard(' ')
+
+        return terms
+
+    def filter(self, queryset, field_name, tokens):
+        model = queryset.model
+        if not tokens or field_name not in SEARCH_FIELDS.get(model, ()):
+            return super().filter(queryset, field_name, tokens)
+
+        keys = [self.key(model, field_name, f'term:{gram}')
+                for token in tokens for gram in self.grams(token)]
+        try:
+            client = RedisUtil().conn_client
+            if not client.exists(self.key(model, field_name, 'ready')):
+                return super().filter(queryset, field_name, tokens)
+            pks = client.sinter(keys)
+        except RedisError as e:
+            lx_log.error(f'【搜索索引查询失败】{e}')
+            return super().filter(queryset, field_name, tokens)
+
+        # NOTE: n-gram交集只是候选集合("abc"的"ab"/"bc"也会命中"ab_bc"),
+        #       且索引可能落后于数据库, 在候选集合内逐个关键词用LIKE校验;
+        #       拼音匹配无法由数据库校验, 命中拼音的主键作为LIKE的补充
+        candidates = list(pks)
+        pinyin_pks = self.match_pinyin(model, field_name, candidates, tokens)
+        queryset = queryset.filter(pk__in=candidates)
+        query_key = f'{field_name}__icontains'
+        for token in tokens:
+            condition = Q(**{query_key: token})
+            if pinyin_pks.get(token):
+                condition |= Q(pk__in=pinyin_pks[token])
+            queryset = queryset.filter(condition)
+
+        return queryset
+
+    def match_pinyin(self, model, field_name, pks, tokens):
+        """在索引文本上校验拼音全拼/首字母匹配
+
+        Args:
+            model (Model): model类
+            field_name (str): 字段名
+            pks (list): 候选主键
+            tokens (list): 关键词
+
+        Returns:
+            dict: {关键词: [拼音匹配的主键]}, 只包含ascii关键词
+        """
+        tokens = [token for token in tokens if token.isascii()]
+        if self.pinyin is None or not tokens or not pks:
+            return {}
+
+        try:
+            texts = RedisUtil().conn_client.hmget(
+                self.key(model, field_name, 'docs'), pks)
+        except RedisError as e:
+            lx_log.error(f'【搜索索引查询失败】{e}')
+            return {}
+
+        matched = {}
+        for pk, text in zip(pks, texts):
+            if text is None or text.isascii():
+                continue
+            spellings = (self.pinyin.get_pinyin(text, '').lower(),
+                         self.pinyin.get_initials(text, '').lower())
+            for token in tokens:
+                if any(token.lower() in spelling for spelling in spellings):
+                    matched.setdefault(token, []).append(pk)
+
+        return matched
+
+    def index(self, model, field_name, rows):
+        """写入索引, 只增删与旧文本不同的索引项
+
+        Args:
+            model (Model): model类
+            field_name (str): 字段名
+            rows (list): [(主键, 文本)]
+        """
+        if not rows:
+            return
+
+        client = RedisUtil().conn_client
+        docs_key = self.key(model, field_name, 'docs')
+        olds = client.hmget(docs_key, [pk for pk, _ in rows])
+        pipe = client.pipeline(transaction=False)
+        for (pk, text), old in zip(rows, olds):
+            old_terms = self.terms(old) if old is not None else set()
+            new_terms = self.terms(text)
+            for term in old_terms - new_terms:
+                pipe.srem(self.key(model, field_name, f'term:{term}'), pk)
+            for term in new_terms - old_terms:
+                pipe.sadd(self.key(model, field_name, f'term:{term}'), pk)
+            pipe.hset(docs_key, pk, text or '')
+        pipe.execute()
+
+    def update(self, model, pks):
+        pks = list(pks)
+        if not pks:
+            return
+        try:
+            for field_name in SEARCH_FIELDS.get(model, ()):
+                for start in range(0, len(pks), SEARCH_BATCH_SIZE):
+                    rows = list(
+                        model._default_manager
+                        .filter(pk__in=pks[start:start + SEARCH_BATCH_SIZE])
+                        .values_list('pk', field_name))
+                    self.index(model, field_name, rows)
+        except RedisError as e:
+            lx_log.error(f'【搜索索引更新失败】{model.__name__}: {e}')
+
+    def remove(self, model, pks):
+        pks = list(pks)
+        if not pks:
+            return
+        try:
+            client = RedisUtil().conn_client
+            for field_name in SEARCH_FIELDS.get(model, ()):
+                docs_key = self.key(model, field_name, 'docs')
+                olds = client.hmget(docs_key, pks)
+                pipe = client.pipeline(transaction=False)
+                for pk, old in zip(pks, olds):
+                    for term in (self.terms(old) if old is not None else ()):
+                        pipe.srem(self.key(model, field_name, f'term:{term}'),
+                                  pk)
+                pipe.hdel(docs_key, *pks)
+                pipe.execute()
+        except RedisError as e:
+            lx_log.error(f'【搜索索引删除失败】{model.__name__}: {e}')
+
+    def rebuild(self, model, field_name):
+        """清空并全量重建索引, 完成后标记索引可用
+
+        Args:
+            model (Model): 已register的model类
+            field_name (str): 字段名
+        """
+        client = RedisUtil().conn_client
+        client.delete(self.key(model, field_name, 'ready'))
+        pattern = self.key(model, field_name, '*')
+        batch = []
+        for key in client.scan_iter(match=pattern, count=SEARCH_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= SEARCH_BATCH_SIZE:
+                client.delete(*batch)
+                batch = []
+        if batch:
+            client.delete(*batch)
+
+        rows = []
+        queryset = model._default_manager.values_list('pk', field_name)
+        for row in queryset.iterator(chunk_size=SEARCH_BATCH_SIZE):
+            rows.append(row)
+            if len(rows) >= SEARCH_BATCH_SIZE:
+                self.index(model, field_name, rows)
+                rows = []
+        self.index(model, field_name, rows)
+        client.set(self.key(model, field_name, 'ready'), 1)
+
+
+SEARCH_BACKENDS = {
+    'like': LikeSearchBackend,
+    'fulltext': FullTextSearchBackend,
+    'redis': RedisSearchBackend,
+}
+_backends = {}
+
+
+def get_search_backend():
+    """获取settings.SEARCH_BACKEND指定的搜索后端(进程内单例)
+
+    Returns:
+        LikeSearchBackend
+    """
+    name = getattr(settings, 'SEARCH_BACKEND', 'like')
+    backend = _backends.get(name)
+    if backend is None:
+        backend_class = SEARCH_BACKENDS.get(name)
+        if backend_class is None:
+            raise ImproperlyConfigured(f'未知的搜索后端: {name}')
+        backend = _backends.setdefault(name, backend_class())
+
+    return backend
+
+
+def _saved(sender, instance, using, **kwargs):
+    # NOTE: 事务提交后才能查到新数据, 回滚时也不会写入索引
+    pk = instance.pk
+    transaction.on_commit(
+        lambda: get_search_backend().update(sender, [pk]), using=using)
+
+
+def _deleted(sender, instance, using, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(
+        lambda: get_search_backend().remove(sender, [pk]), using=using)
+
+
+def _bulk_updated(sender, ids, fields, **kwargs):
+    if not SEARCH_FIELDS[sender].isdisjoint(fields):
+        get_search_backend().update(sender, ids)
+
+
+def register(model, *field_names):
+    """注册需要建立搜索索引的字段, 在AppConfig.ready中调用
+
+    Args:
+        model (Model): model类
+        *field_names: 字段名
+    """
+    # NOTE: querysets通过fuzzy_filter依赖本模块, 信号在此处导入避免循环引用
+    from .querysets import bulk_updated
+
+    SEARCH_FIELDS.setdefault(model, set()).update(field_names)
+    uid = f'search:{model._meta.label_lower}'
+    post_save.connect(_saved, sender=model, dispatch_uid=uid)
+    post_delete.connect(_deleted, sender=model, dispatch_uid=uid)
+    bulk_updated.connect(_bulk_updated, sender=model, dispatch_uid=uid)
@@ -0,0 +1,79 @@
+"""redis session引擎
+
+session数据保存在redis(RedisUtil连接池)中, 过期由redis TTL控制.
+最近校验过的session在进程内缓存SESSION_LOCAL_TTL秒, 同一用户的连续请求
+不需要访问redis. 删除(登出)通过TwoTierCache广播, 所有进程同时失效本地缓存.
+
+settings:
+    SESSION_ENGINE = 'core.sessions'
+"""
+from django.contrib.sessions.backends.base import (CreateError, SessionBase,
+                                                   UpdateError)
+
+from .cache import TwoTierCache
+from .constants import SESSION_LOCAL_MAXSIZE, SESSION_LOCAL_TTL
+
+SESSION_CACHE = TwoTierCache('session',
+                             local_ttl=SESSION_LOCAL_TTL,
+                             local_maxsize=SESSION_LOCAL_MAXSIZE)
+
+
+class SessionStore(SessionBase):
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = SESSION_CACHE
+
+    def load(self):
+        data = None
+        if self.session_key is not None:
+            data = self._cache.get(self.session_key)
+        if data is None:
+            self._session_key = None
+            return {}
+
+        return self.decode(data)
+
+    def exists(self, session_key):
+        return (session_key is not None
+                and self._cache.get(session_key) is not None)
+
+    def create(self):
+        for _ in range(10000):
+            self._session_key = self._get_new_session_key()
+            try:
+                self.save(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+        raise RuntimeError('无法创建新的session key')
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        data = self.encode(self._get_session(no_load=must_create))
+        timeout = self.get_expiry_age()
+        if must_create:
+            # NOTE: redis不可用时直接抛出, 不在create中重试生成key
+            if not self._cache.add(self.session_key, data, timeout,
+                                   fail_silently=False):
+                raise CreateError
+        elif self._cache.get(self.session_key) is not None:
+            self._cache.set(self.session_key, data, timeout, broadcast=True)
+        else:
+            # NOTE: session已被删除(如其他请求已登出), 不再重新写入
+            raise UpdateError
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(session_key)
+
+    @classmethod
+    def clear_expired(cls):
+        # NOTE: 过期由redis TTL处理
+        pass
@@ -0,0 +1,953 @@
+import io
+import json
+import math
+import os
+import sys
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import JSONDecoder
+from unittest import mock, skipIf, skipUnless
+
+import redis
+import redis.asyncio
+import requests
+from any_case import converts_keys
+from django.http import JsonResponse, QueryDict
+from django.contrib.sessions.backends.base import SessionBase
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from elasticsearch.exceptions import ConnectionError as ESConnectionError
+from redis.exceptions import RedisError, ResponseError
+
+from .cache import TwoTierCache
+from .constants import CACHE_LOCK_WAIT, SESSION_REFRESHED_KEY
+from .elastic import ESBulkIndexer, ESReindexTask, ESScroller
+from .exporters import ExportHelper
+from .middlewares import REFRESH_AFTER, SLIDING_EXPIRY, LoginRequiredMiddleware
+from .pubsub import PubSubHub
+from .queues import RedisQueueConsumer
+from .renderers import JSONRenderer, orjson
+from .schemas import Arg, RequestSchema, iter_json_array
+from .sessions import SESSION_CACHE
+from .sessions import SessionStore as RedisStore
+from .utils import (ESConnectionRegistry, ESUtil, RedisConnectionRegistry,
+                    RedisUtil, Validators)
+
+try:
+    import fakeredis
+    import fakeredis.aioredis
+except ImportError:
+    # NOTE: 未安装fakeredis时跳过依赖redis的测试
+    fakeredis = None
+
+REDIS_CONFIG = {'HOST': 'localhost', 'PORT': 6379, 'DB': 0, 'PASSWD': None}
+# NOTE: 耗时对比受机器负载影响, 默认跳过, 设置RUN_BENCHMARKS=1时运行
+benchmark = skipUnless(os.environ.get('RUN_BENCHMARKS'),
+                       '设置RUN_BENCHMARKS=1时运行基准测试')
+
+
+def report(title, **timings):
+    """输出基准测试耗时(秒)
+    """
+    detail = ', '.join(f'{name}={seconds * 1000:.1f}ms'
+                       for name, seconds in timings.items())
+    sys.stderr.write(f'\n【{title}】{detail}\n')
+
+
+class StubESHandler(BaseHTTPRequestHandler):
+    """本地es桩服务: 记录客户端连接, 所有请求返回固定的_cat/master结果
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # NOTE: 与es一致开启TCP_NODELAY, 否则keep-alive连接上会有40ms的延迟确认
+    disable_nagle_algorithm = True
+    body = b'id 127.0.0.1 127.0.0.1 node\n'
+
+    def handle_request(self):
+        self.server.connections.add(self.client_address)
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+class StubESServerMixin:
+    """为测试类启动本地es桩服务
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubESHandler)
+        cls.server.daemon_threads = True
+        cls.server.connections = set()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        host, port = cls.server.server_address
+        cls.base_url = f'http://{host}:{port}'
+        cls.es_options = {'HOST': host, 'PORT': port,
+                          'NODE': [f'{host}:{port}']}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.server.connections.clear()
+        ESConnectionRegistry.reset()
+
+    def tearDown(self):
+        for connection in ESConnectionRegistry._connections.values():
+            connection.close()
+        ESConnectionRegistry.reset()
+        super().tearDown()
+
+
+class ESConnectionRegistryBenchmarkTest(StubESServerMixin, SimpleTestCase):
+    """每次请求新建连接与注册表共享keep-alive连接的对比
+    """
+
+    NUMBER = 300
+
+    def request_with_requests(self):
+        for _ in range(self.NUMBER):
+            requests.get(f'{self.base_url}/_cat/master')
+
+    def request_with_registry(self):
+        for _ in range(self.NUMBER):
+            ESUtil(self.es_options).connection.request('GET', '_cat/master')
+
+    def test_shared_connection(self):
+        self.assertIs(ESUtil(self.es_options).connection,
+                      ESUtil(self.es_options).connection)
+
+    def test_benchmark(self):
+        bare = timeit.timeit(self.request_with_requests, number=1)
+        bare_connections = len(self.server.connections)
+        self.server.connections.clear()
+
+        pooled = timeit.timeit(self.request_with_registry, number=1)
+        pooled_connections = len(self.server.connections)
+
+        report(f'es管理请求 x{self.NUMBER}', requests=bare, registry=pooled)
+        self.assertEqual(bare_connections, self.NUMBER)
+        self.assertEqual(pooled_connections, 1)
+
+
+@skipIf(fakeredis is None, '需要安装fakeredis')
+class FakeRedisMixin:
+    """redis连接池(含asyncio连接池)改为连接进程内的fakeredis服务
+    """
+
+    def setUp(self):
+        super().setUp()
+        server = fakeredis.FakeServer()
+        connection_pool = redis.ConnectionPool
+
+        def create_pool(**params):
+            return connection_pool(connection_class=fakeredis.FakeConnection,
+                                   server=server,
+                                   **params)
+
+        async_connection_pool = redis.asyncio.BlockingConnectionPool
+
+        def create_async_pool(**params):
+            return async_connection_pool(
+                connection_class=fakeredis.aioredis.FakeConnection,
+                server=server,
+                **params)
+
+        for target, factory in (
+                ('redis.ConnectionPool', create_pool),
+                ('redis.asyncio.BlockingConnectionPool', create_async_pool)):
+            patcher = mock.patch(target, factory)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        RedisConnectionRegistry.reset()
+        self.addCleanup(RedisConnectionRegistry.reset)
+        self.redis_util = RedisUtil(REDIS_CONFIG)
+        # NOTE: fakeredis首次访问db时才创建, 多线程同时创建会互相覆盖, 先建好
+        self.redis_util.conn_client.flushdb()
+
+
+class RequestSchemaBenchmarkTest(SimpleTestCase):
+    """RequestSchema与Validators.args_validator的校验结果及耗时对比
+    """
+
+    NUMBER = 20000
+    ARGS = (
+        ('roleName', str, False, None, None),
+        ('pageSize', int, True, None, 20),
+        ('order', int, True, (1, -1), 1),
+        ('isPrivate', bool, True, None, True),
+        ('permissionIds', 'list', False, None, None),
+        ('orderField', str, True, ('created', 'modified', 'name'), 'created'),
+    )
+
+    def setUp(self):
+        self.body = QueryDict(mutable=True)
+        self.body.update({'roleName': 'role',
+                          'pageSize': '50',
+                          'order': '-1',
+                          'isPrivate': 'false',
+                          'permissionIds': '[1, 2, 3]'})
+        self.schema = RequestSchema(*(
+            Arg(key, valid_type=valid_type, null=null, choices=choices,
+                default=default)
+            for key, valid_type, null, choices, default in self.ARGS))
+
+    def validate_with_validators(self):
+        validator = Validators(request_body=self.body)
+        data = {key: validator.args_validator(arg_key=key,
+                                              valid_type=valid_type,
+                                              null=null,
+                                              choices=choices,
+                                              default=default)
+                for key, valid_type, null, choices, default in self.ARGS}
+        is_valid, _ = validator.is_valid_request()
+
+        return is_valid, data
+
+    def validate_with_schema(self):
+        result = self.schema.validate(self.body)
+
+        return result.is_valid, result.data
+
+    def test_same_result(self):
+        self.assertEqual(self.validate_with_schema(),
+                         self.validate_with_validators())
+
+    @benchmark
+    def test_benchmark(self):
+        validators = min(timeit.repeat(self.validate_with_validators,
+                                       number=self.NUMBER, repeat=3))
+        schema = min(timeit.repeat(self.validate_with_schema,
+                                   number=self.NUMBER, repeat=3))
+        report(f'参数校验 x{self.NUMBER}',
+               validators=validators, schema=schema)
+        self.assertLess(schema, validators)
+
+
+class RequestSchemaBatchTest(SimpleTestCase):
+    """按列校验与逐个校验结果一致
+    """
+
+    def test_bool_column_matches_row_check(self):
+        schema = RequestSchema(Arg('flag', valid_type=bool))
+        raws = [True, False, 'true', 'True', '1', 1, 1.0, 0, 'false', 'yes']
+        rows = [{'flag': raw} for raw in raws]
+
+        result = schema.validate_many(rows)
+
+        self.assertEqual([row['flag'] for row in result.rows],
+                         [schema.validate(row)['flag'] for row in rows])
+        self.assertEqual([row['flag'] for row in result.rows],
+                         [True, False, True, True, True, True, False, False,
+                          False, False])
+
+
+class IterJsonArrayTest(SimpleTestCase):
+    """流式json数组解析
+    """
+
+    def parse(self, text, chunk_size=4):
+        return list(iter_json_array(io.BytesIO(text.encode('utf-8')),
+                                    chunk_size=chunk_size))
+
+    def test_valid(self):
+        for text in ('[]', ' [ ] ', '[1]', '[1, 2.5, "a,]b", null]',
+                     '[{"名称": "权限", "ids": [1, 2]}, [], {}]', ''):
+            for chunk_size in (1, 3, 4, 64):
+                self.assertEqual(self.parse(text, chunk_size),
+                                 json.loads(text) if text else [])
+
+    def test_malformed(self):
+        for text in ('[1 2]', '[,,1]', '[,]', '[1,]', '[1,,2]', '[1',
+                     '[1,', '[', '{"a": 1}', '[tru]'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                self.parse(text)
+
+    def test_large_item_not_redecoded_per_chunk(self):
+        item = {'name': 'x' * 100000}
+        text = json.dumps([item, 1])
+        raw_decode = JSONDecoder.raw_decode
+
+        with mock.patch.object(JSONDecoder, 'raw_decode', autospec=True,
+                               side_effect=raw_decode) as decode:
+            self.assertEqual(self.parse(text, chunk_size=1024), [item, 1])
+
+        # NOTE: 逐块重试需要约100次解码, 缓冲区翻倍后重试只需约10次
+        self.assertLess(decode.call_count, 15)
+
+
+class ESBulkIndexerTest(SimpleTestCase):
+    """超出重试次数的文档记录最后一次失败的真实原因
+    """
+
+    class RejectingES:
+
+        def __init__(self, error=None):
+            self.error = error
+
+        def bulk(self, body, **kwargs):
+            if self.error is not None:
+                raise self.error
+            lines = body.splitlines()[::2]
+            return {'errors': True,
+                    'items': [{'index': {'status': 429,
+                                         'error': {'type': 'rejected'}}}
+                              for _ in lines]}
+
+    def bulk(self, es):
+        indexer = ESBulkIndexer(es, 'index', max_retries=1, backoff=0)
+
+        return indexer.bulk([{'_id': 'a', 'name': 'a'}])
+
+    def test_connection_error(self):
+        result = self.bulk(self.RejectingES(
+            ESConnectionError('N/A', 'down', OSError('down'))))
+
+        self.assertEqual(result.failed[0]['status'], None)
+        self.assertIn('down', result.failed[0]['error'])
+
+    def test_rejected(self):
+        result = self.bulk(self.RejectingES())
+
+        self.assertEqual(result.failed, [{'seq': 0, '_id': 'a', 'status': 429,
+                                          'error': {'type': 'rejected'}}])
+
+
+class ESScrollerTest(SimpleTestCase):
+    """不使用point in time时search_after的排序必须唯一
+    """
+
+    class LegacyES:
+        """不支持open_point_in_time的es客户端
+        """
+
+        def __init__(self, hits):
+            self.hits = hits
+            self.bodies = []
+
+        def search(self, index, body, size, **kwargs):
+            self.bodies.append(dict(body))
+            start = 0
+            if 'search_after' in body:
+                start = [hit['sort'] for hit in self.hits].index(
+                    body['search_after']) + 1
+
+            return {'hits': {'hits': self.hits[start:start + size]}}
+
+    def test_tiebreaker_appended(self):
+        hits = [{'_id': str(i), 'sort': [1, i]} for i in range(5)]
+        es = self.LegacyES(hits)
+
+        scanned = list(ESScroller(es, 'index', mode='search_after', size=2,
+                                  sort=[{'created': 'desc'}]))
+
+        self.assertEqual(scanned, hits)
+        self.assertEqual(es.bodies[0]['sort'],
+                         [{'created': 'desc'}, {'id': 'asc'}])
+
+    def test_default_sort(self):
+        es = self.LegacyES([])
+
+        list(ESScroller(es, 'index', mode='search_after', tiebreaker='uid'))
+
+        self.assertEqual(es.bodies[0]['sort'], [{'uid': 'asc'}])
+
+
+class ESReindexTaskTest(SimpleTestCase):
+    """新任务不复用已存在的索引, 同一别名同时只能有一个任务
+    """
+
+    class StateStore:
+        """只实现get/set(nx)/delete的内存状态存储
+        """
+
+        def __init__(self):
+            self.data = {}
+
+        def get(self, key):
+            return self.data.get(key)
+
+        def set(self, key, value, expired_time=0, nx=False):
+            if nx and key in self.data:
+                return False
+            self.data[key] = value
+            return True
+
+        def delete(self, key):
+            self.data.pop(key, None)
+
+    class Response:
+
+        def __init__(self, status_code, data=None):
+            self.status_code = status_code
+            self.data = data or {}
+            self.text = json.dumps(self.data)
+
+        def json(self):
+            return self.data
+
+    class Connection:
+        """已存在new的es, 记录收到的请求
+        """
+
+        def __init__(self):
+            self.indices = {'old', 'new'}
+            self.requests = []
+            self.metadata = mock.Mock()
+
+        def request(self, method, path, data=None):
+            response = ESReindexTaskTest.Response
+            self.requests.append((method, path))
+            if method == 'HEAD':
+                return response(200 if path in self.indices else 404)
+            if method == 'PUT':
+                if path in self.indices:
+                    return response(400, {'error': {
+                        'type': 'resource_already_exists_exception'}})
+                self.indices.add(path)
+                return response(200)
+            if path.startswith('_tasks'):
+                return response(200, {'completed': False})
+            return response(200, {'task': 'node:1'})
+
+    def setUp(self):
+        self.connection = self.Connection()
+        self.store = self.StateStore()
+
+    def task(self, new_index='new'):
+        return ESReindexTask(self.connection, self.store, 'alias',
+                             old_index='old', new_index=new_index,
+                             mappings={})
+
+    def test_fresh_task_does_not_reuse_index(self):
+        task = self.task()
+        self.assertTrue(task.claim())
+
+        task.advance()
+
+        self.assertEqual(task.stage, ESReindexTask.FAILED)
+        self.assertNotIn(('HEAD', 'new'), self.connection.requests)
+        self.assertFalse(any(path.startswith('_reindex')
+                             for _, path in self.connection.requests))
+        self.assertTrue(self.task().claim())
+
+    def test_resumed_task_reuses_index(self):
+        task = self.task()
+        self.assertTrue(task.claim())
+        task.save()
+
+        resumed = ESReindexTask.load(self.connection, self.store, 'alias')
+        resumed.advance()
+
+        self.assertEqual(resumed.stage, ESReindexTask.REINDEXING)
+        self.assertNotIn(('PUT', 'new'), self.connection.requests)
+
+    def test_claim_is_exclusive(self):
+        self.assertTrue(self.task('other').claim())
+        self.assertFalse(self.task('other').claim())
+
+
+class ESDeleteIndexTest(StubESServerMixin, SimpleTestCase):
+    """delete_index不向别名发送DELETE
+    """
+
+    CAT = {
+        '_cat/indices': [{'index': 'index_v1'}],
+        '_cat/aliases': [{'alias': 'index', 'index': 'index_v1'}],
+        '_cat/master': [{'ip': '127.0.0.1'}],
+    }
+
+    def request(self, method, path, data=None, **kwargs):
+        self.requests.append((method, path))
+        for prefix, rows in self.CAT.items():
+            if path.startswith(prefix):
+                return ESReindexTaskTest.Response(200, rows)
+
+        return ESReindexTaskTest.Response(200)
+
+    def setUp(self):
+        super().setUp()
+        self.requests = []
+        self.util = ESUtil(self.es_options)
+        patcher = mock.patch.object(self.util.connection, 'request',
+                                    self.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_alias_not_deleted(self):
+        msg = self.util.delete_index('index')
+
+        self.assertIn('别名', msg)
+        self.assertNotIn(('DELETE', 'index'), self.requests)
+
+    def test_index_deleted(self):
+        self.assertIsNone(self.util.delete_index('index_v1'))
+        self.assertIn(('DELETE', 'index_v1'), self.requests)
+
+
+class ESRebuildIndexTest(StubESServerMixin, SimpleTestCase):
+    """不阻塞重建返回任务句柄, 存在性预检查网络错误按失败处理
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.stub = ESReindexTaskTest.Connection()
+        self.store = ESReindexTaskTest.StateStore()
+        self.util = ESUtil(self.es_options)
+        patcher = mock.patch.object(self.util.connection, 'request',
+                                    self.stub.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rebuild(self):
+        return self.util.rebuild_index('old', 'new_v2', 'alias', {},
+                                       wait_for_completion=False,
+                                       state_store=self.store)
+
+    def test_returns_resumable_task(self):
+        task = self.rebuild()
+
+        self.assertIsInstance(task, ESReindexTask)
+        self.assertEqual(task.stage, ESReindexTask.REINDEXING)
+        self.assertEqual(task.task_id, 'node:1')
+        resumed = self.util.resume_rebuild_index('alias',
+                                                 state_store=self.store)
+        self.assertEqual(resumed.task_id, 'node:1')
+        self.assertEqual(resumed.stage, ESReindexTask.REINDEXING)
+
+    def test_head_network_error_fails(self):
+        request = self.stub.request
+
+        def flaky(method, path, data=None):
+            if method == 'HEAD':
+                return None
+            return request(method, path, data)
+
+        with mock.patch.object(self.util.connection, 'request', flaky):
+            task = self.rebuild()
+
+        self.assertEqual(task.stage, ESReindexTask.FAILED)
+        self.assertIn('网络错误', task.error)
+        self.assertNotIn(('PUT', 'new_v2'), self.stub.requests)
+        # NOTE: 失败后释放别名锁, 可立即重新发起
+        self.assertTrue(ESReindexTask(None, self.store, 'alias').claim())
+
+
+class RedisQueueTest(FakeRedisMixin, SimpleTestCase):
+    """批量pop及redis服务端不支持BLMOVE时的消费者
+    """
+
+    def test_pop_batch_rejects_non_positive_count(self):
+        self.redis_util.rpush('queue', 'a')
+        for count in (0, -1):
+            with self.assertRaises(ValueError):
+                self.redis_util.lpop_batch('queue', count)
+            with self.assertRaises(ValueError):
+                self.redis_util.rpop_batch('queue', count)
+        self.assertEqual(self.redis_util.lrange('queue'), ['a'])
+
+    def test_consumer_falls_back_without_blmove(self):
+        for item in 'abc':
+            self.redis_util.rpush('queue', item)
+        consumer = RedisQueueConsumer(self.redis_util, 'queue', list,
+                                      batch_size=2, block_timeout=1)
+        error = ResponseError("unknown command 'BLMOVE', with args "
+                              "beginning with: ")
+
+        with mock.patch.object(consumer.client, 'blmove',
+                               side_effect=error) as blmove:
+            self.assertEqual(consumer.fetch_batch(), ['a', 'b'])
+            self.assertEqual(consumer.fetch_batch(), ['c'])
+
+        self.assertEqual(blmove.call_count, 1)
+        self.assertFalse(consumer.use_blmove)
+        self.assertEqual(self.redis_util.lrange('queue:processing'),
+                         ['a', 'b', 'c'])
+
+
+class RedisPipelineTest(FakeRedisMixin, SimpleTestCase):
+    """pipeline的results按redis命令排列, 不按RedisUtil调用排列
+    """
+
+    def test_mset_with_ttls(self):
+        with self.redis_util.pipeline() as pipe:
+            pipe.mset({'a': 1, 'b': 2, 'c': 3}, {'a': 60, 'b': 60})
+
+        # NOTE: a, b各一条set ex, c合并为一条mset
+        self.assertEqual(pipe.results, [True, True, True])
+        self.assertEqual(self.redis_util.mget(['a', 'b', 'c', 'd']),
+                         ['1', '2', '3', None])
+        client = self.redis_util.conn_client
+        self.assertGreater(client.ttl('a'), 0)
+        self.assertEqual(client.ttl('c'), -1)
+
+    def test_push_with_ttl(self):
+        with self.redis_util.pipeline() as pipe:
+            pipe.rpush('queue', 'x', 60)
+            pipe.rpush('queue', 'y')
+            pipe.get('missing')
+
+        self.assertEqual(pipe.results, [1, True, 2, None])
+        self.assertEqual(self.redis_util.lrange('queue'), ['x', 'y'])
+
+    def test_empty_batches_send_nothing(self):
+        self.assertEqual(self.redis_util.mget([]), [])
+        with self.redis_util.pipeline() as pipe:
+            self.assertEqual(pipe.mget([]), [])
+            pipe.mset({})
+            pipe.set('a', 1)
+            pipe.mget(['a', 'b'])
+
+        self.assertEqual(pipe.results, [True, ['1', None]])
+
+    def test_error_discards_queued_commands(self):
+        with self.assertRaises(RuntimeError):
+            with self.redis_util.pipeline() as pipe:
+                pipe.set('a', 1)
+                raise RuntimeError
+
+        self.assertEqual(pipe.results, [])
+        self.assertIsNone(self.redis_util.get('a'))
+
+
+class RedisPushStressTest(FakeRedisMixin, SimpleTestCase):
+    """多线程通过各自新建的RedisUtil并发push, 不加锁且共用一个连接池
+    """
+
+    THREADS = 16
+    PUSHES = 500
+
+    def push(self, worker):
+        for i in range(self.PUSHES):
+            redis_util = RedisUtil(REDIS_CONFIG)
+            value = f'{worker}:{i}'
+            if i % 2:
+                redis_util.rpush('stress', value)
+            else:
+                redis_util.lpush('stress:ttl', value, expired_time=60)
+
+        return RedisUtil(REDIS_CONFIG).conn_client
+
+    def test_concurrent_push(self):
+        start = timeit.default_timer()
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            clients = list(executor.map(self.push, range(self.THREADS)))
+        elapsed = timeit.default_timer() - start
+
+        report(f'并发push {self.THREADS}线程 x{self.PUSHES}', push=elapsed)
+        pushed = set(self.redis_util.lrange('stress')
+                     + self.redis_util.lrange('stress:ttl'))
+        self.assertEqual(pushed, {f'{worker}:{i}'
+                                  for worker in range(self.THREADS)
+                                  for i in range(self.PUSHES)})
+        self.assertTrue(all(client is self.redis_util.conn_client
+                            for client in clients))
+        pool = self.redis_util.conn_pool
+        self.assertLessEqual(len(pool._available_connections)
+                             + len(pool._in_use_connections), self.THREADS)
+        self.assertGreater(self.redis_util.conn_client.ttl('stress:ttl'), 0)
+
+
+class PubSubHubTest(FakeRedisMixin, SimpleTestCase):
+    """订阅者或redis命令出错后监听线程继续分发
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.hub = PubSubHub(self.redis_util.conn_client)
+
+    def publish(self, subscription, msg):
+        # NOTE: 订阅命令由监听线程异步执行, 等待redis端订阅生效后再发布
+        client = self.redis_util.conn_client
+        deadline = timeit.default_timer() + 5
+        while (client.pubsub_numsub('channel')[0][1] == 0
+               and timeit.default_timer() < deadline):
+            time.sleep(0.01)
+        self.redis_util.public('channel', msg)
+        message = subscription.get(timeout=5)
+
+        return message and message['data']
+
+    def test_failing_subscriber(self):
+        broken = self.hub.subscribe('channel')
+        broken.deliver = mock.Mock(side_effect=RuntimeError('broken'))
+        subscription = self.hub.subscribe('channel')
+
+        self.assertEqual(self.publish(subscription, 'a'), 'a')
+        self.assertEqual(self.publish(subscription, 'b'), 'b')
+        self.assertEqual(broken.deliver.call_count, 2)
+        self.assertTrue(self.hub._thread.is_alive())
+
+    def test_response_error_reconnects(self):
+        subscription = self.hub.subscribe('channel')
+        self.assertEqual(self.publish(subscription, 'a'), 'a')
+
+        with mock.patch.object(self.hub.pubsub, 'get_message',
+                               side_effect=ResponseError('error')):
+            self.hub._thread.join(0.5)
+        self.assertEqual(self.publish(subscription, 'b'), 'b')
+        self.assertGreaterEqual(self.hub.stats['reconnects'], 1)
+        self.assertTrue(self.hub._thread.is_alive())
+
+
+class TwoTierCacheTest(SimpleTestCase):
+    """redis不可用时读穿透直接加载, 不等待加载锁
+    """
+
+    def setUp(self):
+        # NOTE: 不启动失效广播的监听线程
+        patcher = mock.patch.object(TwoTierCache, '_listener_pid',
+                                    os.getpid())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        RedisConnectionRegistry.reset()
+        self.addCleanup(RedisConnectionRegistry.reset)
+
+    def test_redis_down_loads_immediately(self):
+        down = RedisUtil(dict(REDIS_CONFIG, HOST='127.0.0.1', PORT=1),
+                         decode=False)
+        cache = TwoTierCache('test-down', redis_util=down)
+        loader = mock.Mock(return_value={'id': 1})
+
+        start = timeit.default_timer()
+        value = cache.get_or_set('key', loader)
+        elapsed = timeit.default_timer() - start
+
+        self.assertEqual(value, {'id': 1})
+        self.assertEqual(loader.call_count, 1)
+        self.assertLess(elapsed, CACHE_LOCK_WAIT / 2)
+
+
+class LoginRequiredMiddlewareTest(SimpleTestCase):
+    """合并的豁免url正则, 以及超过REFRESH_AFTER后才续期session
+    """
+
+    def setUp(self):
+        self.get_response = mock.Mock(return_value='ok')
+        self.middleware = LoginRequiredMiddleware(self.get_response)
+        self.session = SessionBase()
+
+    def call(self, path, is_authenticated=False):
+        request = RequestFactory().get(path)
+        request.user = mock.Mock(is_authenticated=is_authenticated)
+        request.session = self.session
+
+        return self.middleware(request)
+
+    def test_exempt_urls(self):
+        for path in ('/api/v1/login', '/admin/', '/admin/login/', '/silk/',
+                     '/~'):
+            self.assertEqual(self.call(path), 'ok', path)
+
+        for path in ('/api/v1/login/extra', '/api/v1/list/role', '/silk'):
+            response = self.call(path)
+            self.assertEqual(json.loads(response.content)['status'],
+                             '10007', path)
+
+    def test_refresh_after_fraction(self):
+        with mock.patch('core.middlewares.time.time', return_value=1000):
+            self.call('/api/v1/list/role', is_authenticated=True)
+        self.assertTrue(self.session.modified)
+        self.assertEqual(self.session[SESSION_REFRESHED_KEY], 1000)
+        self.assertEqual(self.session.get_expiry_age(), SLIDING_EXPIRY)
+
+        self.session.modified = False
+        with mock.patch('core.middlewares.time.time',
+                        return_value=1000 + REFRESH_AFTER - 1):
+            self.call('/api/v1/list/role', is_authenticated=True)
+        self.assertFalse(self.session.modified)
+
+        with mock.patch('core.middlewares.time.time',
+                        return_value=1000 + REFRESH_AFTER):
+            self.call('/api/v1/list/role', is_authenticated=True)
+        self.assertTrue(self.session.modified)
+        self.assertEqual(self.session[SESSION_REFRESHED_KEY],
+                         1000 + REFRESH_AFTER)
+
+    def test_anonymous_session_untouched(self):
+        self.call('/api/v1/login')
+
+        self.assertFalse(self.session.modified)
+        self.assertNotIn(SESSION_REFRESHED_KEY, self.session)
+
+
+class SessionEngineBenchmarkTest(FakeRedisMixin, TestCase):
+    """redis session引擎(含进程内缓存)与数据库session的对比
+    """
+
+    NUMBER = 2000
+
+    def setUp(self):
+        super().setUp()
+        for attr, value in (('_redis_util', None),
+                            ('_listener_pid', os.getpid())):
+            patcher = mock.patch.object(SESSION_CACHE, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        SESSION_CACHE.local.clear()
+        self.addCleanup(SESSION_CACHE.local.clear)
+
+    @staticmethod
+    def create(store_class):
+        store = store_class()
+        store['_auth_user_id'] = '1'
+        store.create()
+
+        return store.session_key
+
+    def load(self, store_class, session_key, clear_local=False):
+        for _ in range(self.NUMBER):
+            if clear_local:
+                SESSION_CACHE.local.clear()
+            self.assertEqual(store_class(session_key)['_auth_user_id'], '1')
+
+    @benchmark
+    def test_benchmark(self):
+        db_key = self.create(DBStore)
+        redis_key = self.create(RedisStore)
+
+        db = timeit.timeit(lambda: self.load(DBStore, db_key), number=1)
+        redis_only = timeit.timeit(
+            lambda: self.load(RedisStore, redis_key, clear_local=True),
+            number=1)
+        local = timeit.timeit(lambda: self.load(RedisStore, redis_key),
+                              number=1)
+
+        report(f'session读取 x{self.NUMBER}',
+               db=db, redis=redis_only, local=local)
+        self.assertLess(local, db)
+
+    def test_create_fails_fast_when_redis_down(self):
+        client = SESSION_CACHE.redis.conn_client
+        down = mock.patch.object(client, 'set',
+                                 side_effect=RedisError('down'))
+
+        with down as set_, self.assertRaises(RedisError):
+            RedisStore().create()
+
+        self.assertEqual(set_.call_count, 1)
+
+
+class JSONRendererTest(SimpleTestCase):
+    """orjson与标准库json两种序列化方式的输出一致
+    """
+
+    DATA = {'max_value': math.inf, 'min_value': -math.inf,
+            'avg_value': math.nan, 'values': [1.5, math.nan],
+            'rows': ({'float_value': math.inf}, )}
+
+    EXPECTED = {'max_value': None, 'min_value': None,
+                'avg_value': None, 'values': [1.5, None],
+                'rows': [{'float_value': None}]}
+
+    def test_stdlib_non_finite_floats(self):
+        with mock.patch('core.renderers.orjson', None):
+            content = JSONRenderer.dumps(self.DATA)
+
+        self.assertEqual(json.loads(content), self.EXPECTED)
+        self.assertTrue(math.isnan(self.DATA['avg_value']))
+
+    @skipIf(orjson is None, '需要安装orjson')
+    def test_orjson_non_finite_floats(self):
+        content = JSONRenderer.dumps(self.DATA)
+
+        self.assertEqual(json.loads(content), self.EXPECTED)
+
+
+class JSONRendererBenchmarkTest(SimpleTestCase):
+    """JSONRenderer与converts_keys + JsonResponse的结果及耗时对比
+    """
+
+    NUMBER = 10000
+
+    def setUp(self):
+        created = datetime(2022, 1, 1, 8, 30)
+        self.rows = [{'user_id': i,
+                      'user_name': f'user{i}',
+                      'is_active': bool(i % 2),
+                      'total_amount': Decimal('12.50'),
+                      'created_time': created,
+                      'role_list': [{'role_id': j, 'role_name': f'role{j}'}
+                                    for j in range(3)]}
+                     for i in range(self.NUMBER)]
+
+    def old(self):
+        return JsonResponse({'data': converts_keys(self.rows, case='camel')})
+
+    def new(self):
+        data = JSONRenderer.camelize(self.rows)
+
+        return JSONRenderer.response({'data': data})
+
+    def test_same_output(self):
+        self.assertEqual(json.loads(self.old().content),
+                         json.loads(self.new().content))
+
+    @benchmark
+    def test_benchmark(self):
+        old = timeit.timeit(self.old, number=1)
+        new = timeit.timeit(self.new, number=1)
+
+        report(f'json响应渲染 x{self.NUMBER}行', old=old, new=new)
+        self.assertLess(new, old)
+
+
+class ExportInThreadTest(SimpleTestCase):
+    """ExportHelper.iter_in_thread在后台线程中生成数据块
+    """
+
+    def test_chunks(self):
+        threads = set()
+
+        def chunks():
+            for i in range(10):
+                threads.add(threading.get_ident())
+                yield str(i).encode()
+
+        content = b''.join(ExportHelper.iter_in_thread(chunks(), maxsize=2))
+
+        self.assertEqual(content, b'0123456789')
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_error(self):
+        def chunks():
+            yield b'0'
+            raise ValueError('failed')
+
+        with self.assertRaisesMessage(ValueError, 'failed'):
+            list(ExportHelper.iter_in_thread(chunks()))
+
+    def test_close(self):
+        closed = threading.Event()
+
+        def chunks():
+            try:
+                while True:
+                    yield b'0'
+            finally:
+                closed.set()
+
+        content = ExportHelper.iter_in_thread(chunks(), maxsize=1)
+        self.assertEqual(next(content), b'0')
+        content.close()
+
+        self.assertTrue(closed.wait(1))
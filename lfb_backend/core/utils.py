@@ -1,4 +1,5 @@
 import json
+import os
 import threading
 import traceback
 from json import JSONDecodeError
@@ -6,14 +7,22 @@ from json import JSONDecodeError
 import redis
 import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
 
 from elasticsearch import Elasticsearch
 from log.log import lx_log
 
-from .constants import (DEFAULT_HEADERS, DOC_TYPE, REDIS_ENCODING,
-                        REDIS_MAX_CONN)
-from .errors import ExternalError
+from .constants import (BULK_CHUNK_BYTES, BULK_CHUNK_SIZE, BULK_MAX_RETRIES,
+                        DEFAULT_HEADERS, DOC_TYPE, ES_METADATA_TTL,
+                        ES_POOL_SIZE, ES_RETRIES, ES_TIMEOUT,
+                        PUBSUB_QUEUE_SIZE, REDIS_ENCODING, REDIS_MAX_CONN,
+                        REINDEX_REQUESTS_PER_SECOND, SCROLL_SIZE,
+                        SCROLL_TIEBREAKER)
+from .elastic import (ESBulkIndexer, ESMetadataCache, ESReindexTask,
+                      ESScroller, parallel_scan)
 from .helpers import DataTypeHelper
+from .pubsub import PubSubHub
 
 
 class Validators:
@@ -172,18 +181,125 @@ class Validators:
         return all([isinstance(ele, data_type) for ele in list_ele])
 
 
+class ESConnection:
+    """es连接: elasticsearch客户端及管理类接口使用的keep-alive会话
+
+    Args:
+        options (dict): es配置信息, e.g. settings.ES_OPTIONS
+    """
+
+    def __init__(self, options):
+        self.host = options.get('HOST')
+        self.port = options.get('PORT')
+        self.base_url = f'http://{self.host}:{self.port}'
+        self.timeout = options.get('TIMEOUT', ES_TIMEOUT)
+        pool_size = options.get('POOL_SIZE', ES_POOL_SIZE)
+
+        self.es = Elasticsearch(options.get('NODE'),
+                                sniff_on_connection_fail=True,
+                                maxsize=pool_size,
+                                timeout=self.timeout)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size,
+                              max_retries=options.get('RETRIES', ES_RETRIES))
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.metadata = ESMetadataCache(
+            self, options.get('METADATA_TTL', ES_METADATA_TTL))
+
+    def request(self, method, path, data=None, **kwargs):
+        """通过连接池向es发送管理类http请求
+
+        Args:
+            method (str): http方法
+            path (str): 请求路径, e.g. '_cat/indices?v'
+            data (dict, optional): Defaults to None. 请求体, 将序列化为json
+
+        Returns:
+            Response or None: 网络错误时返回None
+        """
+        if data is not None:
+            kwargs['data'] = json.dumps(data)
+        kwargs.setdefault('timeout', self.timeout)
+        try:
+            return self.session.request(method,
+                                        f'{self.base_url}/{path}',
+                                        **kwargs)
+        except RequestException as e:
+            lx_log.error(f'【es请求{method} {path}】{e}')
+
+    def close(self):
+        self.session.close()
+
+
+class ESConnectionRegistry:
+    """进程级es连接注册表
+
+    相同配置的ESUtil共用同一个ESConnection, fork后的子进程会重新建立连接,
+    不会与父进程共享socket.
+    """
+
+    _lock = threading.Lock()
+    _connections = {}
+    _pid = os.getpid()
+
+    @classmethod
+    def get(cls, options):
+        """获取(或创建)指定配置的es连接
+
+        Args:
+            options (dict): es配置信息
+
+        Returns:
+            ESConnection
+        """
+        if cls._pid != os.getpid():
+            cls.reset()
+
+        key = json.dumps(options, sort_keys=True, default=str)
+        connection = cls._connections.get(key)
+        if connection is None:
+            with cls._lock:
+                connection = cls._connections.get(key)
+                if connection is None:
+                    connection = ESConnection(options)
+                    cls._connections[key] = connection
+
+        return connection
+
+    @classmethod
+    def reset(cls):
+        """丢弃当前进程继承的所有连接(fork后调用)
+        """
+        cls._lock = threading.Lock()
+        cls._connections = {}
+        cls._pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=ESConnectionRegistry.reset)
+
+
 class ESUtil:
     """elastic search相关操作
     """
 
-    def __init__(self):
-        self.es_host = settings.ES_OPTIONS.get('HOST')
-        self.es_port = settings.ES_OPTIONS.get('PORT')
-        self.es = Elasticsearch(settings.ES_OPTIONS.get('NODE'),
-                                sniff_on_connection_fail=True)
-        self.indexes_search_url = (f'http://{self.es_host}:{self.es_port}/'
-                                   f'_cat/indices?v')
-        self.alias_url = f'http://{self.es_host}:{self.es_port}/_alias'
+    def __init__(self, options=None):
+        """从进程级注册表获取es连接, 重复创建ESUtil不会新建连接
+
+        Args:
+            options (dict, optional): es配置信息. Defaults to settings.ES_OPTIONS.
+        """
+        self.connection = ESConnectionRegistry.get(
+            options if options is not None else settings.ES_OPTIONS)
+        self.es_host = self.connection.host
+        self.es_port = self.connection.port
+        self.es = self.connection.es
+        self.metadata = self.connection.metadata
+        self.indexes_search_url = f'{self.connection.base_url}/_cat/indices?v'
+        self.alias_url = f'{self.connection.base_url}/_alias'
 
     def es_search(self, index, dsl):
         """查询es数据
@@ -199,6 +315,48 @@ class ESUtil:
 
         return info
 
+    def es_scan(self,
+                index,
+                query=None,
+                source=None,
+                size=SCROLL_SIZE,
+                mode='scroll',
+                sort=None,
+                prefetch=False,
+                slices=1,
+                tiebreaker=SCROLL_TIEBREAKER):
+        """遍历索引全部命中文档, 逐条惰性返回
+
+        Args:
+            index (str): 需要遍历的索引
+            query (dict, optional): 查询条件. Defaults to match_all.
+            source (list or bool, optional): _source过滤字段. Defaults to None.
+            size (int, optional): 每页文档数. Defaults to SCROLL_SIZE.
+            mode (str, optional): 'scroll'或'search_after'.
+                Defaults to 'scroll'.
+            sort (list, optional): 排序条件. Defaults to None.
+            prefetch (bool, optional): 是否后台预取下一页. Defaults to False.
+            slices (int, optional): 切片并行数, 大于1时每个切片一个线程,
+                不保证顺序. Defaults to 1.
+            tiebreaker (str, optional): search_after不使用point in time时
+                追加的唯一排序字段. Defaults to SCROLL_TIEBREAKER.
+
+        Returns:
+            generator: hit迭代器
+        """
+        kwargs = {
+            'query': query,
+            'source': source,
+            'size': size,
+            'mode': mode,
+            'sort': sort,
+            'tiebreaker': tiebreaker,
+        }
+        if slices > 1:
+            return parallel_scan(self.es, index, slices, **kwargs)
+
+        return ESScroller(self.es, index, **kwargs).iter_hits(prefetch)
+
     def bulk_es_insert(self, data, index, doc_type=DOC_TYPE):
         """es批量往索引里插入数据
 
@@ -214,37 +372,76 @@ class ESUtil:
 
         return info
 
+    def streaming_bulk_insert(self,
+                              docs,
+                              index,
+                              doc_type=DOC_TYPE,
+                              chunk_size=BULK_CHUNK_SIZE,
+                              max_chunk_bytes=BULK_CHUNK_BYTES,
+                              thread_count=1,
+                              max_retries=BULK_MAX_RETRIES):
+        """流式分块批量插入, 适用于大批量导出等无法一次构造body的场景
+
+        Args:
+            docs (iterable): 文档(dict)迭代器或生成器, 可包含_id等元数据字段
+            index (str): 需要插入的索引
+            doc_type (str, optional): 索引文档类型. Defaults to DOC_TYPE.
+            chunk_size (int, optional): 每次提交的最大文档数.
+                Defaults to BULK_CHUNK_SIZE.
+            max_chunk_bytes (int, optional): 每次提交的最大字节数.
+                Defaults to BULK_CHUNK_BYTES.
+            thread_count (int, optional): 并行提交的线程数. Defaults to 1.
+            max_retries (int, optional): 被拒绝文档的最大重试次数.
+                Defaults to BULK_MAX_RETRIES.
+
+        Returns:
+            BulkResult: 成功数及逐条失败信息
+        """
+        indexer = ESBulkIndexer(self.es,
+                                index,
+                                doc_type=doc_type,
+                                chunk_size=chunk_size,
+                                max_chunk_bytes=max_chunk_bytes,
+                                thread_count=thread_count,
+                                max_retries=max_retries)
+
+        return indexer.bulk(docs)
+
     def delete_index(self, index):
         """删除指定索引
 
         Args:
-            index (str): 需要删除的索引
+            index (str): 需要删除的索引, 不能是别名
 
         Returns:
             str or None: 删除操作返回消息
         """
-        delete_url = f'http://{self.es_host}:{self.es_port}/{index}'
-        info = None
-        del_info = None
-        try:
-            info = requests.get(self.indexes_search_url).content.decode()
-        except ExternalError as e:
-            lx_log.error(f'【索引删除索引查询】{e.messag}')
+        is_alias = self.metadata.is_alias(index)
+        if is_alias is None:
 
-        if info and info.find(index) != -1:
-            try:
-                del_info = requests.delete(delete_url)
-            except ExternalError as e:
-                lx_log.error(f'【索引删除{index}】{e.messag}')
+            return '索引删除连接es网络错误'
 
-            if del_info and del_info.status_code != 200:
+        if is_alias:
 
-                return '索引删除失败'
+            return '索引删除失败: 不能删除别名, 请指定索引名'
 
-        if info is None or del_info is None:
+        exists = self.metadata.index_exists(index, include_aliases=False)
+        if exists is None:
 
             return '索引删除连接es网络错误'
 
+        if exists:
+            del_info = self.connection.request('DELETE', index)
+            self.metadata.invalidate()
+
+            if del_info is None:
+
+                return '索引删除连接es网络错误'
+
+            if del_info.status_code != 200:
+
+                return '索引删除失败'
+
     def create_index(self, index, alias, mappings):
         """创建索引指定映射关系并创建别名
 
@@ -256,7 +453,6 @@ class ESUtil:
         Returns:
             str: 索引创建操作返回消息
         """
-        create_index_url = f'http://{self.es_host}:{self.es_port}/{index}'
         alias_data = {
             'actions': {
                 'add': {
@@ -265,155 +461,137 @@ class ESUtil:
                 }
             }
         }
-        index_res = None
-        alias_res = None
-        try:
-            index_res = requests.put(create_index_url,
-                                     headers=DEFAULT_HEADERS,
-                                     data=json.dumps(mappings))
-        except ExternalError as e:
-            lx_log.error(f'【索引创建{index}】{e.messag}')
-
-        if index_res and index_res.status_code == 200:
-            try:
-                alias_res = requests.put(self.alias_url,
-                                         headers=DEFAULT_HEADERS,
-                                         data=json.dumps(alias_data))
-            except ExternalError as e:
-                lx_log.error(f'【索引创建别名{index}】{e.messag}')
-
-            if not alias_res or (alias_res and alias_res.status_code != 200):
+        index_res = self.connection.request('PUT', index, data=mappings)
+        self.metadata.invalidate()
+
+        if index_res is not None and index_res.status_code == 200:
+            alias_res = self.connection.request('PUT', '_alias',
+                                                data=alias_data)
+            self.metadata.invalidate()
+
+            if alias_res is None or alias_res.status_code != 200:
 
                 return '索引创建成功，别名创建失败'
         else:
 
             return '索引创建失败'
 
-    def rebuild_index(self, old_index, new_index, alias, mappings):
-        """重建索引并迁移旧索引数据
+    def start_rebuild_index(self,
+                            old_index,
+                            new_index,
+                            alias,
+                            mappings,
+                            requests_per_second=REINDEX_REQUESTS_PER_SECOND,
+                            slices='auto',
+                            state_store=None):
+        """启动后台索引重建任务并立即返回任务句柄
+
+        新索引创建后以es后台task方式迁移数据(限流, 切片), 迁移完成后在一个
+        _aliases请求中原子切换别名, 期间别名始终指向可用索引.
 
         Args:
             old_index (str): 旧索引索引名
             new_index (str): 新索引索引名
             alias (str): 索引别名
             mappings (dict): 索引文档字段映射关系
+            requests_per_second (int, optional): 迁移限流, -1为不限流.
+                Defaults to REINDEX_REQUESTS_PER_SECOND.
+            slices (int or str, optional): 迁移切片数. Defaults to 'auto'.
+            state_store (RedisUtil, optional): 任务状态存储.
+                Defaults to RedisUtil().
 
         Returns:
-            str: 索引迁移操作返回消息
-        """
-        duplicate_date_url = f'http://{self.es_host}:{self.es_port}/_reindex'
-        create_index_url = f'http://{self.es_host}:{self.es_port}/{new_index}'
-        duplicate_date = {
-            'source': {
-                'index': old_index
-            },
-            'dest': {
-                'index': new_index
-            }
-        }
-        remove_date = {
-            'actions': {
-                'remove': {
-                    'index': old_index,
-                    'alias': alias
-                }
-            }
-        }
-        create_data = {
-            'actions': {
-                'add': {
-                    'index': new_index,
-                    'alias': alias
-                }
-            }
-        }
-        # NOTE: 先查询需删除索引和新索引是否存在
-        search_res = None
-        try:
-            search_res = requests.get(self.indexes_search_url).content.decode()
-        except ExternalError as e:
-            lx_log.error(f'【索引迁移索引查询】{e.message}')
-
-        if search_res and search_res.find(old_index) == -1:
-
-            return '原索引不存在, 请直接创建索引'
+            ESReindexTask: 任务句柄, 通过advance()/wait()推进,
+                失败信息见task.error
+        """
+        if state_store is None:
+            state_store = RedisUtil()
+        task = ESReindexTask(self.connection,
+                             state_store,
+                             alias,
+                             old_index=old_index,
+                             new_index=new_index,
+                             mappings=mappings,
+                             requests_per_second=requests_per_second,
+                             slices=slices)
+        if not task.claim():
+            task.stage = ESReindexTask.FAILED
+            task.error = f'索引{alias}迁移任务进行中, 请稍后重新操作'
+            return task
+
+        # NOTE: 先查询需删除索引和新索引是否存在, 直接请求es不读取元数据缓存;
+        #       网络错误或非200/404响应无法判断索引是否存在, 按失败处理
+        old_res = self.connection.request('HEAD', old_index)
+        if old_res is None or old_res.status_code not in (200, 404):
+            task.fail('原索引查询失败: 连接网络错误')
+            return task
+        if old_res.status_code == 404:
+            task.fail('原索引不存在, 请直接创建索引')
+            return task
+
+        new_res = self.connection.request('HEAD', new_index)
+        if new_res is None or new_res.status_code not in (200, 404):
+            task.fail('新索引查询失败: 连接网络错误')
+            return task
+        if new_res.status_code == 200:
+            task.fail('新索引已存在, 请修改后重新操作')
+            return task
+
+        task.advance()
+
+        return task
+
+    def resume_rebuild_index(self, alias, state_store=None):
+        """恢复(如进程崩溃后)未完成的索引重建任务
 
-        if search_res and search_res.find(new_index) > -1:
+        Args:
+            alias (str): 索引别名
+            state_store (RedisUtil, optional): 任务状态存储.
+                Defaults to RedisUtil().
 
-            return '新索引已存在, 请修改后重新操作'
-        # NOTE: 创建新索引
-        create_res = None
-        try:
-            create_res = requests.put(create_index_url,
-                                      headers=DEFAULT_HEADERS,
-                                      data=json.dumps(mappings))
-        except ExternalError as e:
-            lx_log.error(f'【索引迁移索引创建{new_index}】{e.message}')
-
-        if not create_res or (create_res and create_res.status_code != 200):
-            if create_res:
-                err_msg = (json
-                           .loads(create_res.content.decode())
-                           .get('error')
-                           .get('type'))
-            else:
-                err_msg = '连接网络错误'
+        Returns:
+            ESReindexTask or None: 没有记录的任务时返回None
+        """
+        if state_store is None:
+            state_store = RedisUtil()
+        task = ESReindexTask.load(self.connection, state_store, alias)
+        if task is not None and task.is_running:
+            task.advance()
+
+        return task
+
+    def rebuild_index(self,
+                      old_index,
+                      new_index,
+                      alias,
+                      mappings,
+                      wait_for_completion=True,
+                      **kwargs):
+        """重建索引并迁移旧索引数据
 
-            return f'索引迁移新索引创建失败: {err_msg}'
-        # NOTE: 迁移旧索引数据至新索引
-        dup_res = None
-        try:
-            dup_res = requests.post(duplicate_date_url,
-                                    headers=DEFAULT_HEADERS,
-                                    data=json.dumps(duplicate_date))
-        except ExternalError as e:
-            lx_log.error(f'【索引{new_index}】{e.message}')
-
-        if not dup_res or (dup_res and dup_res.status_code != 200):
-            if dup_res:
-                err_msg = '数据迁移错误'
-            else:
-                err_msg = '连接网络错误'
+        Args:
+            old_index (str): 旧索引索引名
+            new_index (str): 新索引索引名
+            alias (str): 索引别名
+            mappings (dict): 索引文档字段映射关系
+            wait_for_completion (bool, optional): 是否阻塞等待迁移完成,
+                大索引建议传False并通过返回的任务句柄advance()/wait()推进,
+                进程重启后可用resume_rebuild_index(alias)恢复.
+                Defaults to True.
+            **kwargs: 传给start_rebuild_index的限流/切片参数
 
-            return f'索引迁移数据迁移失败: {err_msg}'
-        # NOTE: 删除旧索引别名
-        remove_res = None
-        try:
-            remove_res = requests.post(self.alias_url,
-                                       headers=DEFAULT_HEADERS,
-                                       data=json.dumps(remove_date))
-        except ExternalError as e:
-            lx_log.error(f'【索引迁移索引别名删除{new_index}】{e.message}')
-
-        if not remove_res or (remove_res and remove_res.status_code != 200):
-            if remove_res:
-                err_msg = (json
-                           .loads(remove_res.content.decode())
-                           .get('error')
-                           .get('type'))
-            else:
-                err_msg = '连接网络错误'
+        Returns:
+            str or ESReindexTask: 阻塞等待时返回索引迁移操作返回消息,
+                否则返回任务句柄(失败信息见task.error)
+        """
+        task = self.start_rebuild_index(old_index, new_index, alias,
+                                        mappings, **kwargs)
+        if not wait_for_completion:
+            return task
 
-            return f'索引迁移数据迁移失败: {err_msg}'
-        # NOTE: 创建新索引别名
-        alias_res = None
-        try:
-            alias_res = requests.post(self.alias_url,
-                                      headers=DEFAULT_HEADERS,
-                                      data=json.dumps(create_data))
-        except ExternalError as e:
-            lx_log.error(f'【索引迁移索引别名创建{new_index}】{e.message}')
-
-        if not alias_res or (alias_res and alias_res.status_code != 200):
-            if alias_res:
-                err_msg = (json
-                           .loads(remove_res.content.decode())
-                           .get('error')
-                           .get('type'))
-            else:
-                err_msg = '连接网络错误'
+        task.wait()
 
-            return f'索引迁移数据迁移失败: {err_msg}'
+        return task.error
 
     def bulk_delete_data(self, index, doc_type, ids):
         """根据id批量删除索引数据
@@ -435,63 +613,193 @@ class ESUtil:
         self.es.bulk(index=index, doc_type=doc_type, body=actions)
 
     def get_master_node_ip(self):
-        """获取主节点ip
+        """获取主节点ip(读取元数据缓存)
         """
-        search_url = f'http://{self.host}:{self.port}/_cat/master'
-        master_node_ip = None
-        try:
-            res = requests.get(search_url, headers=DEFAULT_HEADERS)
-            master_node_ip = res.text.split(' ')[-2]
-        except (ExternalError, AttributeError, IndexError) as e:
-            lx_log.error(f'【索引主节点查询】{e.message}')
+        master_node_ip = self.metadata.master_node_ip
+        if master_node_ip is None:
+            lx_log.error('【索引主节点查询】获取主节点失败')
 
         return master_node_ip
 
 
-class RedisUtil:
-    """连接redis相关操作
+class RedisConnectionRegistry:
+    """进程级redis客户端注册表
+
+    相同配置的RedisUtil共用同一个线程安全的连接池, fork后的子进程会重新建立
+    连接池, 不会与父进程共享socket.
     """
 
-    def __init__(self, config=settings.REDIS_OPTIONS, decode=True):
-        """redis连接池初始化
+    _lock = threading.Lock()
+    _clients = {}
+    _pid = os.getpid()
+
+    @classmethod
+    def get(cls, config, decode=True):
+        """获取(或创建)指定配置的redis客户端
 
         Args:
-            config (dict, optional): 配置信息. Defaults to settings.REDIS_OPTIONS.
+            config (dict): redis配置信息
             decode (bool, optional): 是否对结果进行解码. Defaults to True.
+
+        Returns:
+            redis.Redis
         """
-        self.config = config
-        max_conn = self.config.get('max_connections', REDIS_MAX_CONN)
-        encoding = self.config.get('encoding', REDIS_ENCODING)
+        if cls._pid != os.getpid():
+            cls.reset()
+
+        key = (json.dumps(config, sort_keys=True, default=str), decode)
+        client = cls._clients.get(key)
+        if client is None:
+            with cls._lock:
+                client = cls._clients.get(key)
+                if client is None:
+                    client = cls._create(config, decode)
+                    cls._clients[key] = client
+
+        return client
+
+    @staticmethod
+    def _create(config, decode):
+        max_conn = config.get('max_connections', REDIS_MAX_CONN)
+        encoding = config.get('encoding', REDIS_ENCODING)
         conn_params = {
-            'host': self.config['HOST'],
-            'port': self.config['PORT'],
-            'db': self.config['DB'],
-            'password': self.config['PASSWD'],
+            'host': config['HOST'],
+            'port': config['PORT'],
+            'db': config['DB'],
+            'password': config['PASSWD'],
             'max_connections': max_conn
         }
         if decode is True:
             conn_params['encoding'] = encoding
             conn_params['decode_responses'] = True
-        self.conn_pool = redis.ConnectionPool(**conn_params)
-        self.conn_client = redis.Redis(connection_pool=self.conn_pool)
-        self.mutex = threading.Lock()
+        conn_pool = redis.ConnectionPool(**conn_params)
+
+        return redis.Redis(connection_pool=conn_pool)
+
+    @classmethod
+    def reset(cls):
+        """丢弃当前进程继承的所有连接池(fork后调用)
+        """
+        cls._lock = threading.Lock()
+        cls._clients = {}
+        cls._pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=RedisConnectionRegistry.reset)
+
 
-    def set(self, key, value, expired_time=0):
+class RedisUtil:
+    """连接redis相关操作
+    """
+
+    def __init__(self, config=None, decode=True):
+        """从进程级注册表获取共享的redis连接池
+
+        Args:
+            config (dict, optional): 配置信息. Defaults to settings.REDIS_OPTIONS.
+            decode (bool, optional): 是否对结果进行解码. Defaults to True.
+        """
+        self.config = config if config is not None else settings.REDIS_OPTIONS
+        self.conn_client = RedisConnectionRegistry.get(self.config, decode)
+        self.conn_pool = self.conn_client.connection_pool
+
+    def set(self, key, value, expired_time=0, nx=False):
         """redis设置字符串类型值
 
         Args:
             key (str): 需要设置的key
             value (optional): 需要设置的value
             expired_time (int, optional): 设置失效时间单位s. Defaults to 0.
+            nx (bool, optional): 是否仅在key不存在时设置. Defaults to False.
+
+        Returns:
+            bool: 是否设置成功
         """
-        self.conn_client.set(key, value)
         if isinstance(expired_time, int) and expired_time > 0:
-            self.conn_client.expire(key, expired_time)
+            return bool(self.conn_client.set(key, value, ex=expired_time,
+                                             nx=nx))
+
+        return bool(self.conn_client.set(key, value, nx=nx))
 
     def get(self, key):
 
         return self.conn_client.get(key)
 
+    def mget(self, keys):
+        """批量获取字符串类型值
+
+        Args:
+            keys (list): 需要获取的key列表
+
+        Returns:
+            list: 与keys一一对应的值, 不存在的key为None
+        """
+        if not keys:
+            return []
+
+        return self.conn_client.mget(keys)
+
+    def mset(self, mapping, expired_time=0):
+        """批量设置字符串类型值, 一次网络往返完成
+
+        Args:
+            mapping (dict): 需要设置的{key: value}
+            expired_time (int or dict, optional): 失效时间单位s, 为dict时表示
+                每个key各自的失效时间({key: 秒数}). Defaults to 0.
+        """
+        if not mapping:
+            return
+
+        if isinstance(expired_time, dict):
+            key_ttls = expired_time
+            default_ttl = 0
+        else:
+            key_ttls = {}
+            default_ttl = expired_time
+
+        pipe, execute = self._queue()
+        plain = {}
+        for key, value in mapping.items():
+            ttl = key_ttls.get(key, default_ttl)
+            if isinstance(ttl, int) and ttl > 0:
+                pipe.set(key, value, ex=ttl)
+            else:
+                plain[key] = value
+        if plain:
+            pipe.mset(plain)
+        if execute:
+            pipe.execute()
+
+    def pipeline(self, transaction=False):
+        """获取批量执行上下文, 上下文内的RedisUtil调用在退出时一次性发送
+
+        Examples:
+            with redis_util.pipeline() as pipe:
+                pipe.set('a', 1, 60)
+                pipe.rpush('queue', 'msg')
+                pipe.get('b')
+            a_result, push_result, b_value = pipe.results
+
+        results按redis命令排列, 调用与命令的对应关系见RedisPipeline.
+
+        Args:
+            transaction (bool, optional): 是否以MULTI/EXEC事务执行.
+                Defaults to False.
+
+        Returns:
+            RedisPipeline
+        """
+        return RedisPipeline(self, transaction=transaction)
+
+    def _queue(self):
+        """获取用于排队批量命令的pipeline
+
+        Returns:
+            tuple: (pipeline, 是否需要由调用方立即execute)
+        """
+        return self.conn_client.pipeline(transaction=False), True
+
     def delete(self, key):
         self.conn_client.delete(key)
 
@@ -503,13 +811,7 @@ class RedisUtil:
             value (str): 需要push的value(数据类型是json)
             expired_time (int, optional): 设置失效时间单位s. Defaults to 0.
         """
-        self.mutex.acquire()
-        pipe = self.conn_client.pipeline()
-        pipe.rpush(key, value)
-        if isinstance(expired_time, int) and expired_time > 0:
-            pipe.expire(key, expired_time)
-        pipe.execute()
-        self.mutex.release
+        self._push('rpush', key, value, expired_time)
 
     def lpush(self, key, value, expired_time=0):
         """执行redis列表左push操作
@@ -519,13 +821,20 @@ class RedisUtil:
             value (str): 需要push的value(数据类型是json)
             expired_time (int, optional): 设置失效时间单位s. Defaults to 0.
         """
-        self.mutex.acquire()
-        pipe = self.conn_client.pipeline()
-        pipe.lpush(key, value)
-        if isinstance(expired_time, int) and expired_time > 0:
-            pipe.expire(key, expired_time)
-        pipe.execute()
-        self.mutex.release
+        self._push('lpush', key, value, expired_time)
+
+    def _push(self, command, key, value, expired_time):
+        # NOTE: 连接池本身线程安全, push与expire在同一个pipeline中发送,
+        # 不需要python层面的锁
+        if not (isinstance(expired_time, int) and expired_time > 0):
+            getattr(self.conn_client, command)(key, value)
+            return
+
+        pipe, execute = self._queue()
+        getattr(pipe, command)(key, value)
+        pipe.expire(key, expired_time)
+        if execute:
+            pipe.execute()
 
     def rpop(self, key):
 
@@ -535,6 +844,72 @@ class RedisUtil:
 
         return self.conn_client.lpop(key)
 
+    def blpop(self, keys, timeout=0):
+        """阻塞式左pop, 队列为空时在redis端等待而不是轮询
+
+        Args:
+            keys (str or list): 一个或多个列表key
+            timeout (int, optional): 最长等待秒数, 0为一直等待. Defaults to 0.
+
+        Returns:
+            tuple or None: (key, value), 超时返回None
+        """
+        return self.conn_client.blpop(keys, timeout=timeout)
+
+    def brpop(self, keys, timeout=0):
+        """阻塞式右pop
+
+        Args:
+            keys (str or list): 一个或多个列表key
+            timeout (int, optional): 最长等待秒数, 0为一直等待. Defaults to 0.
+
+        Returns:
+            tuple or None: (key, value), 超时返回None
+        """
+        return self.conn_client.brpop(keys, timeout=timeout)
+
+    def lpop_batch(self, key, count):
+        """一次网络往返从列表左侧pop最多count个元素
+
+        Args:
+            key (str): 列表key
+            count (int): 最多pop的元素数, 需大于0
+
+        Returns:
+            list: pop出的元素
+
+        Raises:
+            ValueError: count小于1
+        """
+        if count < 1:
+            raise ValueError(f'count需大于0: {count}')
+        pipe = self.conn_client.pipeline(transaction=True)
+        pipe.lrange(key, 0, count - 1)
+        pipe.ltrim(key, count, -1)
+
+        return pipe.execute()[0]
+
+    def rpop_batch(self, key, count):
+        """一次网络往返从列表右侧pop最多count个元素
+
+        Args:
+            key (str): 列表key
+            count (int): 最多pop的元素数, 需大于0
+
+        Returns:
+            list: pop出的元素, 按pop顺序(从右往左)排列
+
+        Raises:
+            ValueError: count小于1
+        """
+        if count < 1:
+            raise ValueError(f'count需大于0: {count}')
+        pipe = self.conn_client.pipeline(transaction=True)
+        pipe.lrange(key, -count, -1)
+        pipe.ltrim(key, 0, -count - 1)
+
+        return pipe.execute()[0][::-1]
+
     def lrange(self, key, start=0, end=-1):
 
         return self.conn_client.lrange(key, start, end)
@@ -556,14 +931,90 @@ class RedisUtil:
         """
         self.conn_client.publish(channel, msg)
 
-    def subscribe(self, channel):
+    def subscribe(self, channel, maxsize=PUBSUB_QUEUE_SIZE):
         """订阅指定频道的信息
 
+        本进程内所有订阅共用一个redis pubsub连接, 由PubSubHub分发消息.
+
         Args:
-            channel (str): 通道名称
+            channel (str or list): 通道名称
+            maxsize (int, optional): 本地消息队列长度.
+                Defaults to PUBSUB_QUEUE_SIZE.
+
+        Returns:
+            Subscription: 通过get()/迭代读取消息, close()退订
+        """
+        return PubSubHub.get(self).subscribe(channels=channel,
+                                             maxsize=maxsize)
+
+    def psubscribe(self, pattern, maxsize=PUBSUB_QUEUE_SIZE):
+        """按模式订阅频道, e.g. 'cache:*'
+
+        Args:
+            pattern (str or list): 频道模式
+            maxsize (int, optional): 本地消息队列长度.
+                Defaults to PUBSUB_QUEUE_SIZE.
+
+        Returns:
+            Subscription
         """
-        pub = self.conn_client.pubsub()
-        pub.subscribe(channel)
-        pub.parse_response()
+        return PubSubHub.get(self).subscribe(patterns=pattern,
+                                             maxsize=maxsize)
+
+    def subscribe_async(self, channel=(), pattern=(),
+                        maxsize=PUBSUB_QUEUE_SIZE):
+        """在asyncio事件循环中订阅(如daphne/channels consumer)
+
+        Args:
+            channel (str or list, optional): 通道名称. Defaults to ().
+            pattern (str or list, optional): 频道模式. Defaults to ().
+            maxsize (int, optional): 本地消息队列长度.
+                Defaults to PUBSUB_QUEUE_SIZE.
+
+        Returns:
+            AsyncSubscription: 通过await get()/async for读取消息
+        """
+        return PubSubHub.get(self).subscribe_async(channels=channel,
+                                                   patterns=pattern,
+                                                   maxsize=maxsize)
+
 
-        return pub
+class RedisPipeline(RedisUtil):
+    """RedisUtil的批量执行版本, 所有调用排队后在execute/退出上下文时一次发送
+
+    一次RedisUtil调用可能对应0到多个redis命令, results按命令而非调用排列:
+    带失效时间的push为push和expire两条; mset中带失效时间的key各一条set,
+    其余key合并为一条mset; mget([])与mset({})不发送命令.
+
+    Attributes:
+        results (list): execute后每个redis命令的返回值, 按发送顺序排列
+    """
+
+    def __init__(self, redis_util, transaction=False):
+        self.config = redis_util.config
+        self.conn_pool = redis_util.conn_pool
+        self.conn_client = redis_util.conn_client.pipeline(
+            transaction=transaction)
+        self.results = []
+
+    def _queue(self):
+        return self.conn_client, False
+
+    def execute(self):
+        """发送所有排队的命令
+
+        Returns:
+            list: 每个redis命令(非每次调用)的返回值
+        """
+        self.results = self.conn_client.execute()
+
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.execute()
+        else:
+            self.conn_client.reset()